@@ -18,10 +18,13 @@ Module dedicated functions/classes dealing with rate limiting requests.
 """
 
 import copy
+import hashlib
 import httplib
+import itertools
 import json
 import math
 import re
+import socket
 import time
 import urllib
 import webob.exc
@@ -31,6 +34,7 @@ from collections import defaultdict
 
 from webob.dec import wsgify
 
+from nova import flags
 from nova import quota
 from nova import utils
 from nova import wsgi as base_wsgi
@@ -40,6 +44,16 @@ from nova.api.openstack.views import limits as limits_views
 from nova.api.openstack import wsgi
 
 
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('rate_limit_max_users', 10000,
+                     'Number of users whose rate limit levels are kept in '
+                     'memory by each limiter; the least recently seen users '
+                     'are forgotten beyond it')
+flags.DEFINE_integer('rate_limit_proxy_connections', 10,
+                     'Number of idle keep-alive connections a '
+                     'WsgiLimiterProxy keeps open to the limiter service')
+
+
 # Convenience constants for the limits dictionary passed to Limiter().
 PER_SECOND = 1
 PER_MINUTE = 60
@@ -218,6 +232,14 @@ class Limit(object):
         if self.verb != verb or not re.match(self.regex, url):
             return
 
+        return self.record()
+
+    def record(self):
+        """
+        Counts a request against this limit, whichever way it was matched.
+
+        @return: Seconds to wait before the request is allowed, or None
+        """
         now = self._get_time()
 
         if self.last_request is None:
@@ -249,6 +271,16 @@ class Limit(object):
         """Retrieve the current time. Broken out for testability."""
         return time.time()
 
+    def get_state(self):
+        """Return the level of this limit as a JSON serializable list."""
+        return [self.water_level, self.last_request,
+                self.remaining, self.next_request]
+
+    def set_state(self, state):
+        """Restore a level returned by `get_state`."""
+        (self.water_level, self.last_request,
+         self.remaining, self.next_request) = state
+
     def display_unit(self):
         """Display the string name of the unit."""
         return self.UNITS.get(self.unit, "UNKNOWN")
@@ -277,10 +309,104 @@ DEFAULT_LIMITS = [
 ]
 
 
+class LimitMatcher(object):
+    """
+    Finds the limits matching a request with a single regex match.
+
+    The regexes of the limits for each verb are joined into one pattern in
+    which every limit is an optional lookahead followed by an empty group,
+    so the groups that took part in the match name the matching limits.
+    Regexes with groups of their own would shift the group numbers, so a
+    verb using any of them falls back to matching each limit in turn.
+    """
+
+    def __init__(self, limits):
+        """
+        Compile the regexes of the given `Limit` objects by verb.
+
+        @param limits: List of `Limit` objects
+        """
+        rules = defaultdict(list)
+        for index, limit in enumerate(limits):
+            rules[limit.verb].append((index, limit.regex))
+
+        self.verbs = {}
+        for verb, verb_rules in rules.items():
+            self.verbs[verb] = self._compile(verb_rules)
+
+    @staticmethod
+    def _compile(rules):
+        indexes = [index for index, _regex in rules]
+        compiled = [re.compile(regex) for _index, regex in rules]
+        if any(regex.groups for regex in compiled):
+            return None, zip(indexes, compiled)
+        combined = "".join("(?:(?=(?:%s))())?" % regex
+                           for _index, regex in rules)
+        return re.compile(combined), indexes
+
+    def match(self, verb, url):
+        """
+        Return the indexes of the limits matching a request, in order.
+        """
+        if verb not in self.verbs:
+            return []
+
+        combined, rules = self.verbs[verb]
+        if combined is None:
+            return [index for index, regex in rules if regex.match(url)]
+
+        groups = combined.match(url).groups()
+        return [index for index, group in itertools.izip(rules, groups)
+                if group is not None]
+
+
+class LimitLevels(object):
+    """
+    The limits of each user, created on first use.
+
+    Only max_users users are kept.  When there are more, the least recently
+    seen tenth of them is forgotten, and their limits start over if they
+    come back.
+    """
+
+    def __init__(self, factory, max_users):
+        """
+        @param factory: Callable returning new limits for a username
+        @param max_users: Number of users to keep
+        """
+        self.factory = factory
+        self.max_users = max(max_users, 1)
+        self._levels = {}
+        self._last_seen = {}
+        self._clock = itertools.count()
+
+    def __getitem__(self, username):
+        if username not in self._levels:
+            if len(self._levels) >= self.max_users:
+                self._evict()
+            self._levels[username] = self.factory(username)
+        self._last_seen[username] = self._clock.next()
+        return self._levels[username]
+
+    def __contains__(self, username):
+        return username in self._levels
+
+    def __len__(self):
+        return len(self._levels)
+
+    def _evict(self):
+        count = max(self.max_users // 10, 1)
+        users = sorted(self._last_seen, key=self._last_seen.get)
+        for username in users[:count]:
+            del self._levels[username]
+            del self._last_seen[username]
+
+
 class RateLimitingMiddleware(base_wsgi.Middleware):
     """
-    Rate-limits requests passing through this middleware. All limit information
-    is stored in memory for this implementation.
+    Rate-limits requests passing through this middleware. By default all limit
+    information is stored in the memory of each worker; use `MemcachedLimiter`
+    or `WsgiLimiterProxy` as the limiter to share it between workers.
     """
 
     def __init__(self, application, limits=None, limiter=None, **kwargs):
@@ -351,13 +477,23 @@ class Limiter(object):
         @param limits: List of `Limit` objects
         """
         self.limits = copy.deepcopy(limits)
-        self.levels = defaultdict(lambda: copy.deepcopy(limits))
+        self.matcher = LimitMatcher(self.limits)
 
         # Pick up any per-user limit information
+        self.user_limits = {}
+        self.user_matchers = {}
         for key, value in kwargs.items():
             if key.startswith('user:'):
                 username = key[5:]
-                self.levels[username] = self.parse_limits(value)
+                self.user_limits[username] = self.parse_limits(value)
+                self.user_matchers[username] = LimitMatcher(
+                        self.user_limits[username])
+
+        self.levels = LimitLevels(self._new_levels,
+                                  FLAGS.rate_limit_max_users)
+
+    def _new_levels(self, username):
+        return copy.deepcopy(self.user_limits.get(username, self.limits))
 
     def get_limits(self, username=None):
         """
@@ -371,10 +507,22 @@ class Limiter(object):
 
         @return: Tuple of delay (in seconds) and error message (or None, None)
         """
+        matched = self._match(verb, url, username)
+        if not matched:
+            return None, None
+
+        return self._check(self.levels[username], matched)
+
+    def _match(self, verb, url, username):
+        matcher = self.user_matchers.get(username, self.matcher)
+        return matcher.match(verb, url)
+
+    def _check(self, levels, matched):
         delays = []
 
-        for limit in self.levels[username]:
-            delay = limit(verb, url)
+        for index in matched:
+            limit = levels[index]
+            delay = limit.record()
             if delay:
                 delays.append((delay, limit.error_message))
 
@@ -445,6 +593,60 @@ class Limiter(object):
         return result
 
 
+class MemcachedLimiter(Limiter):
+    """
+    Rate-limit checking class which keeps the levels of each user in
+    memcached, so all API workers enforce the same limits.
+
+    Like the EC2 Lockout middleware, it uses an in-process cache when
+    memcached_servers is not set.  Levels are read and written back without
+    locking, so concurrent requests from one user on different workers may
+    let a few more requests through than the limit allows.
+    """
+
+    def __init__(self, limits, **kwargs):
+        super(MemcachedLimiter, self).__init__(limits, **kwargs)
+        if FLAGS.memcached_servers:
+            import memcache
+        else:
+            from nova import fakememcache as memcache
+        self.mc = memcache.Client(FLAGS.memcached_servers, debug=0)
+
+    @staticmethod
+    def _key(username, levels):
+        """Key the levels by user and by the limits they were taken for."""
+        rules = ";".join("%s %s %s %s" % (limit.verb, limit.regex,
+                                          limit.value, limit.unit)
+                         for limit in levels)
+        digest = hashlib.md5(unicode(username).encode("utf-8"))
+        digest.update(rules)
+        return "ratelimit-%s" % digest.hexdigest()
+
+    def check_for_delay(self, verb, url, username=None):
+        """
+        Check the given verb/user/user triplet for limit, against the levels
+        shared through memcached.
+
+        @return: Tuple of delay (in seconds) and error message (or None, None)
+        """
+        matched = self._match(verb, url, username)
+        if not matched:
+            return None, None
+
+        levels = self.levels[username]
+        key = self._key(username, levels)
+        state = self.mc.get(key)
+        if state:
+            for limit, limit_state in zip(levels, json.loads(state)):
+                limit.set_state(limit_state)
+
+        result = self._check(levels, matched)
+
+        state = json.dumps([limit.get_state() for limit in levels])
+        self.mc.set(key, state, time=max(limit.unit for limit in levels))
+        return result
+
+
 class WsgiLimiter(object):
     """
     Rate-limit checking from a WSGI application. Uses an in-memory `Limiter`.
@@ -509,24 +711,51 @@ class WsgiLimiterProxy(object):
         @param limiter_address: IP/port combination of where to request limit
         """
         self.limiter_address = limiter_address
+        self._idle = []
+
+    def _post(self, path, body, headers):
+        """
+        POST to the limiter, reusing an idle keep-alive connection if there
+        is one.  An idle connection the limiter has since closed is dropped
+        and the request sent again.
+
+        @return: Tuple of the response and its body
+        """
+        while True:
+            reused = bool(self._idle)
+            if reused:
+                conn = self._idle.pop()
+            else:
+                conn = httplib.HTTPConnection(self.limiter_address)
+
+            try:
+                conn.request("POST", path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                continue
+
+            if (not resp.will_close and
+                len(self._idle) < FLAGS.rate_limit_proxy_connections):
+                self._idle.append(conn)
+            return resp, data
 
     def check_for_delay(self, verb, path, username=None):
         body = json.dumps({"verb": verb, "path": path})
         headers = {"Content-Type": "application/json"}
 
-        conn = httplib.HTTPConnection(self.limiter_address)
-
         if username:
-            conn.request("POST", "/%s" % (username), body, headers)
+            resp, data = self._post("/%s" % (username), body, headers)
         else:
-            conn.request("POST", "/", body, headers)
-
-        resp = conn.getresponse()
+            resp, data = self._post("/", body, headers)
 
-        if 200 >= resp.status < 300:
+        if 200 <= resp.status < 300:
             return None, None
 
-        return resp.getheader("X-Wait-Seconds"), resp.read() or None
+        return resp.getheader("X-Wait-Seconds"), data or None
 
     # Note: This method gets called before the class is instantiated,
     # so this must be either a static method or a class method.  It is
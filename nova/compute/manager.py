@@ -1686,9 +1686,9 @@ class ComputeManager(manager.SchedulerDependentManager):
             self._last_host_check = curr_time
             LOG.info(_("Updating host status"))
             # This will grab info about the host and queue it
-            # to be sent to the Schedulers.
-            self.update_service_capabilities(
-                self.driver.get_host_stats(refresh=True))
+            # to be sent to the Schedulers. The driver decides how old
+            # the stats it keeps may get before they are read again.
+            self.update_service_capabilities(self.driver.get_host_stats())
 
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
@@ -885,6 +885,20 @@ def quota_destroy_all_by_project(context, project_id):
     return IMPL.quota_get_all_by_project(context, project_id)
 
 
+def quota_usage_get(context, project_id):
+    """Get the instances, cores, ram, volumes and gigabytes of a project.
+
+    A project is counted from its instances and volumes the first time, and
+    its usage is kept up to date as they change after that.
+    """
+    return IMPL.quota_usage_get(context, project_id)
+
+
+def quota_usage_reconcile(context):
+    """Recount the usage of every project, returning those that drifted."""
+    return IMPL.quota_usage_reconcile(context)
+
+
 ###################
 
 
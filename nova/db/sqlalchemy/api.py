@@ -20,6 +20,7 @@ Implementation of SQLAlchemy backend.
 """
 import re
 import warnings
+from collections import defaultdict
 
 from nova import block_device
 from nova import db
@@ -1098,6 +1099,8 @@ def instance_create(context, values):
     session = get_session()
     with session.begin():
         instance_ref.save(session=session)
+        _quota_usage_add(session, instance_ref['project_id'],
+                         _instance_quota_usage(instance_ref))
     return instance_ref
 
 
@@ -1118,6 +1121,15 @@ def instance_data_get_for_project(context, project_id):
 def instance_destroy(context, instance_id):
     session = get_session()
     with session.begin():
+        instance_ref = session.query(models.Instance).\
+                               filter_by(id=instance_id).\
+                               filter_by(deleted=False).\
+                               first()
+        if instance_ref:
+            _quota_usage_move(session,
+                              instance_ref['project_id'],
+                              _instance_quota_usage(instance_ref),
+                              instance_ref['project_id'], {})
         session.query(models.Instance).\
                 filter_by(id=instance_id).\
                 update({'deleted': True,
@@ -1557,8 +1569,13 @@ def instance_update(context, instance_id, values):
                                                 session=session)
         else:
             instance_ref = instance_get(context, instance_id, session=session)
+        old_project_id = instance_ref['project_id']
+        old_usage = _instance_quota_usage(instance_ref)
         instance_ref.update(values)
         instance_ref.save(session=session)
+        _quota_usage_move(session, old_project_id, old_usage,
+                          instance_ref['project_id'],
+                          _instance_quota_usage(instance_ref))
         return instance_ref
 
 
@@ -2166,6 +2183,135 @@ def quota_destroy_all_by_project(context, project_id):
 ###################
 
 
+_QUOTA_USAGE_RESOURCES = ('instances', 'cores', 'ram', 'volumes', 'gigabytes')
+
+
+def _instance_quota_usage(instance_ref):
+    if instance_ref['deleted']:
+        return {}
+    return {'instances': 1,
+            'cores': instance_ref['vcpus'] or 0,
+            'ram': instance_ref['memory_mb'] or 0}
+
+
+def _volume_quota_usage(volume_ref):
+    if volume_ref['deleted']:
+        return {}
+    return {'volumes': 1,
+            'gigabytes': volume_ref['size'] or 0}
+
+
+def _quota_usage_add(session, project_id, deltas):
+    """Adds to the usage of a project within the caller's transaction.
+
+    A project without a usage row is skipped, as the row is counted from
+    scratch when its quota is first checked.
+    """
+    values = {}
+    for resource, delta in deltas.iteritems():
+        if delta:
+            column = getattr(models.QuotaUsage, resource)
+            values[resource] = column + delta
+    if not project_id or not values:
+        return
+    values['updated_at'] = utils.utcnow()
+    session.query(models.QuotaUsage).\
+            filter_by(project_id=project_id).\
+            filter_by(deleted=False).\
+            update(values, synchronize_session=False)
+
+
+def _quota_usage_move(session, old_project_id, old_usage,
+                      new_project_id, new_usage):
+    """Moves the usage of a row from what it was to what it is now."""
+    if old_project_id == new_project_id:
+        deltas = dict((resource,
+                       new_usage.get(resource, 0) -
+                       old_usage.get(resource, 0))
+                      for resource in _QUOTA_USAGE_RESOURCES)
+        _quota_usage_add(session, new_project_id, deltas)
+        return
+    _quota_usage_add(session, old_project_id,
+                     dict((resource, -value)
+                          for resource, value in old_usage.iteritems()))
+    _quota_usage_add(session, new_project_id, new_usage)
+
+
+def _quota_usage_count(session, project_id=None):
+    """Counts the usage of a project, or of every project by project id."""
+    instances = session.query(models.Instance.project_id,
+                              func.count(models.Instance.id),
+                              func.sum(models.Instance.vcpus),
+                              func.sum(models.Instance.memory_mb)).\
+                        filter_by(deleted=False)
+    volumes = session.query(models.Volume.project_id,
+                            func.count(models.Volume.id),
+                            func.sum(models.Volume.size)).\
+                      filter_by(deleted=False)
+    if project_id is not None:
+        instances = instances.filter_by(project_id=project_id)
+        volumes = volumes.filter_by(project_id=project_id)
+
+    usages = defaultdict(lambda: dict.fromkeys(_QUOTA_USAGE_RESOURCES, 0))
+    # NOTE(vish): convert None to 0
+    for project, count, cores, ram in \
+            instances.group_by(models.Instance.project_id):
+        usages[project].update(instances=count or 0, cores=cores or 0,
+                               ram=ram or 0)
+    for project, count, gigabytes in \
+            volumes.group_by(models.Volume.project_id):
+        usages[project].update(volumes=count or 0,
+                               gigabytes=gigabytes or 0)
+    return usages
+
+
+@require_admin_context
+def quota_usage_get(context, project_id):
+    session = get_session()
+    usage_ref = session.query(models.QuotaUsage).\
+                        filter_by(project_id=project_id).\
+                        filter_by(deleted=False).\
+                        first()
+    if not usage_ref:
+        usage_ref = models.QuotaUsage()
+        usage_ref.project_id = project_id
+        usage_ref.update(_quota_usage_count(session, project_id)[project_id])
+        try:
+            usage_ref.save(session=session)
+        except (IntegrityError, exception.DBError):
+            # NOTE: another request counted the project first.
+            session = get_session()
+            usage_ref = session.query(models.QuotaUsage).\
+                                filter_by(project_id=project_id).\
+                                filter_by(deleted=False).\
+                                one()
+    return dict((resource, usage_ref[resource] or 0)
+                for resource in _QUOTA_USAGE_RESOURCES)
+
+
+@require_admin_context
+def quota_usage_reconcile(context):
+    session = get_session()
+    with session.begin():
+        counted = _quota_usage_count(session)
+        usage_refs = session.query(models.QuotaUsage).\
+                             filter_by(deleted=False).\
+                             with_lockmode('update').\
+                             all()
+        fixed = []
+        for usage_ref in usage_refs:
+            usage = counted[usage_ref.project_id]
+            if any(usage_ref[resource] != usage[resource]
+                   for resource in _QUOTA_USAGE_RESOURCES):
+                usage_ref.update(usage)
+                usage_ref.save(session=session)
+                fixed.append(usage_ref.project_id)
+    return fixed
+
+
+###################
+
+
 @require_admin_context
 def volume_allocate_shelf_and_blade(context, volume_id):
     session = get_session()
@@ -2226,6 +2372,8 @@ def volume_create(context, values):
     session = get_session()
     with session.begin():
         volume_ref.save(session=session)
+        _quota_usage_add(session, volume_ref['project_id'],
+                         _volume_quota_usage(volume_ref))
     return volume_ref
 
 
@@ -2245,6 +2393,15 @@ def volume_data_get_for_project(context, project_id):
 def volume_destroy(context, volume_id):
     session = get_session()
     with session.begin():
+        volume_ref = session.query(models.Volume).\
+                             filter_by(id=volume_id).\
+                             filter_by(deleted=False).\
+                             first()
+        if volume_ref:
+            _quota_usage_move(session,
+                              volume_ref['project_id'],
+                              _volume_quota_usage(volume_ref),
+                              volume_ref['project_id'], {})
         session.query(models.Volume).\
                 filter_by(id=volume_id).\
                 update({'deleted': True,
@@ -2406,8 +2563,13 @@ def volume_update(context, volume_id, values):
                                 delete=True)
     with session.begin():
         volume_ref = volume_get(context, volume_id, session=session)
+        old_project_id = volume_ref['project_id']
+        old_usage = _volume_quota_usage(volume_ref)
         volume_ref.update(values)
         volume_ref.save(session=session)
+        _quota_usage_move(session, old_project_id, old_usage,
+                          volume_ref['project_id'],
+                          _volume_quota_usage(volume_ref))
 
 
 ####################
@@ -404,6 +404,25 @@ class Quota(BASE, NovaBase):
     hard_limit = Column(Integer, nullable=True)
 
 
+class QuotaUsage(BASE, NovaBase):
+    """Represents the instances and volumes a project is using.
+
+    Kept up to date in the transactions that create, delete or resize them,
+    so quota checks read this row instead of counting the project's rows.
+    """
+
+    __tablename__ = 'quota_usages'
+    id = Column(Integer, primary_key=True)
+
+    project_id = Column(String(255), unique=True)
+
+    instances = Column(Integer, default=0)
+    cores = Column(Integer, default=0)
+    ram = Column(Integer, default=0)
+    volumes = Column(Integer, default=0)
+    gigabytes = Column(Integer, default=0)
+
+
 class Snapshot(BASE, NovaBase):
     """Represents a block storage device that can be attached to a vm."""
     __tablename__ = 'snapshots'
@@ -874,7 +893,7 @@ def register_models():
               Project, Certificate, ConsolePool, Console, Zone,
               VolumeMetadata, VolumeTypes, VolumeTypeExtraSpecs,
               AgentBuild, InstanceMetadata, InstanceTypeExtraSpecs, Migration,
-              VirtualStorageArray)
+              VirtualStorageArray, QuotaUsage)
     engine = create_engine(FLAGS.sql_connection, echo=False)
     for model in models:
         model.metadata.create_all(engine)
@@ -87,8 +87,10 @@ def allowed_instances(context, requested_instances, instance_type):
     context = context.elevated()
     requested_cores = requested_instances * instance_type['vcpus']
     requested_ram = requested_instances * instance_type['memory_mb']
-    usage = db.instance_data_get_for_project(context, project_id)
-    used_instances, used_cores, used_ram = usage
+    usage = db.quota_usage_get(context, project_id)
+    used_instances = usage['instances']
+    used_cores = usage['cores']
+    used_ram = usage['ram']
     quota = get_project_quotas(context, project_id)
     allowed_instances = _get_request_allotment(requested_instances,
                                                used_instances,
@@ -108,8 +110,9 @@ def allowed_volumes(context, requested_volumes, size):
     context = context.elevated()
     size = int(size)
     requested_gigabytes = requested_volumes * size
-    used_volumes, used_gigabytes = db.volume_data_get_for_project(context,
-                                                                  project_id)
+    usage = db.quota_usage_get(context, project_id)
+    used_volumes = usage['volumes']
+    used_gigabytes = usage['gigabytes']
     quota = get_project_quotas(context, project_id)
     allowed_volumes = _get_request_allotment(requested_volumes, used_volumes,
                                              quota['volumes'])
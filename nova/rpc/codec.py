@@ -0,0 +1,156 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Versioned envelope for RPC messages, with pluggable body codecs.
+
+An enveloped message is a dict the broker serializer can still carry:
+
+    {'_envelope': 1, 'codec': 'json', 'encoding': None,
+     'context': {...}, 'body': {...}}
+
+With the json codec and no compression the body is left inline, so nothing
+is encoded twice.  Otherwise the body is encoded by the codec, zlib
+compressed if it is larger than rpc_compress_threshold, and base64 encoded
+into a string.  The request context travels as one 'context' entry instead
+of a _context_* key for each of its values.  Messages without the _envelope
+key are left alone, so enveloped and plain messages can be mixed.
+"""
+
+import base64
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from nova import exception
+from nova import flags
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_boolean('rpc_envelope', False,
+                     'Send RPC requests in the versioned envelope. Replies '
+                     'are only enveloped for callers that sent one. Every '
+                     'service answering calls must understand it first.')
+flags.DEFINE_string('rpc_codec', 'json',
+                    'Codec for enveloped RPC bodies: json or msgpack.')
+flags.DEFINE_integer('rpc_compress_threshold', 16 * 1024,
+                     'Enveloped RPC bodies larger than this many bytes are '
+                     'zlib compressed. Zero turns compression off.')
+
+ENVELOPE_VERSION = 1
+
+
+class UnknownCodec(exception.Error):
+    pass
+
+
+class JsonCodec(object):
+    """Text codec that any consumer can read."""
+
+    name = 'json'
+
+    def dumps(self, value):
+        return utils.dumps(value)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec(object):
+    """Compact binary codec, available if msgpack is installed."""
+
+    name = 'msgpack'
+
+    def dumps(self, value):
+        return msgpack.packb(utils.to_primitive(value))
+
+    def loads(self, data):
+        return msgpack.unpackb(data)
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise UnknownCodec(_('RPC codec %s is unknown or not installed')
+                           % name)
+
+
+register_codec(JsonCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+
+def is_envelope(msg):
+    return isinstance(msg, dict) and '_envelope' in msg
+
+
+def wrap(body, context=None, codec=None, **plain):
+    """Put a message body and its context dict in an envelope.
+
+    Keys in plain are left outside the envelope so the consumer can read
+    them without decoding the body.
+    """
+    codec = get_codec(codec or FLAGS.rpc_codec)
+    envelope = {'_envelope': ENVELOPE_VERSION,
+                'codec': codec.name,
+                'encoding': None}
+    if context is not None:
+        envelope['context'] = context
+    threshold = FLAGS.rpc_compress_threshold
+    if codec.name == JsonCodec.name and not threshold:
+        envelope['body'] = body
+    else:
+        data = codec.dumps(body)
+        if threshold and len(data) > threshold:
+            data = zlib.compress(data)
+            envelope['encoding'] = 'zlib'
+            envelope['body'] = base64.b64encode(data)
+        elif codec.name == JsonCodec.name:
+            envelope['body'] = body
+        else:
+            envelope['encoding'] = 'base64'
+            envelope['body'] = base64.b64encode(data)
+    envelope.update(plain)
+    return envelope
+
+
+def unwrap(envelope):
+    """Returns the body and the context dict (or None) of an envelope."""
+    version = envelope['_envelope']
+    if version > ENVELOPE_VERSION:
+        raise exception.Error(_('RPC envelope version %s is newer than %s')
+                              % (version, ENVELOPE_VERSION))
+    body = envelope['body']
+    encoding = envelope.get('encoding')
+    if encoding is not None:
+        data = base64.b64decode(body)
+        if encoding == 'zlib':
+            data = zlib.decompress(data)
+        body = get_codec(envelope['codec']).loads(data)
+    return body, envelope.get('context')
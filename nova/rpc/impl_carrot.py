@@ -43,7 +43,7 @@ from nova import context
 from nova import exception
 from nova import fakerabbit
 from nova import flags
-from nova.rpc.common import RemoteError, LOG
+from nova.rpc.common import RemoteError, Timeout, LOG
 
 # Needed for tests
 eventlet.monkey_patch()
@@ -512,8 +512,13 @@ class RpcContext(context.RequestContext):
         msg_reply(self.msg_id, *args, **kwargs)
 
 
-def multicall(context, topic, msg):
-    """Make a call that returns multiple times."""
+def multicall(context, topic, msg, timeout=None):
+    """Make a call that returns multiple times.
+
+    If timeout is given, Timeout is raised when no reply arrives within that
+    many seconds of the call.
+
+    """
     LOG.debug(_('Making asynchronous call on %s ...'), topic)
     msg_id = uuid.uuid4().hex
     msg.update({'_msg_id': msg_id})
@@ -522,7 +527,7 @@ def multicall(context, topic, msg):
 
     con_conn = ConnectionPool.get()
     consumer = DirectConsumer(connection=con_conn, msg_id=msg_id)
-    wait_msg = MulticallWaiter(consumer)
+    wait_msg = MulticallWaiter(consumer, msg_id, timeout=timeout)
     consumer.register_callback(wait_msg)
 
     publisher = TopicPublisher(connection=con_conn, topic=topic)
@@ -533,10 +538,14 @@ def multicall(context, topic, msg):
 
 
 class MulticallWaiter(object):
-    def __init__(self, consumer):
+    def __init__(self, consumer, msg_id=None, timeout=None):
         self._consumer = consumer
         self._results = queue.Queue()
         self._closed = False
+        self._msg_id = msg_id
+        self._deadline = None
+        if timeout is not None:
+            self._deadline = time.time() + timeout
 
     def close(self):
         self._closed = True
@@ -563,6 +572,11 @@ class MulticallWaiter(object):
                 except Exception:
                     self.close()
                     raise
+                if rv is None and self._deadline is not None and \
+                   time.time() > self._deadline:
+                    self.close()
+                    raise Timeout(_('Timed out waiting for a reply to '
+                                    'message ID %s') % self._msg_id)
                 time.sleep(0.01)
 
             result = self._results.get()
@@ -580,9 +594,9 @@ def create_connection(new=True):
     return Connection.instance(new=new)
 
 
-def call(context, topic, msg):
+def call(context, topic, msg, timeout=None):
     """Sends a message on a topic and wait for a response."""
-    rv = multicall(context, topic, msg)
+    rv = multicall(context, topic, msg, timeout=timeout)
     # NOTE(vish): return the last result from the multicall
     rv = list(rv)
     if not rv:
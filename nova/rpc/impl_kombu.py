@@ -28,17 +28,28 @@ import uuid
 import eventlet
 from eventlet import greenpool
 from eventlet import pools
+from eventlet import queue
+from eventlet import semaphore
 import greenlet
 
 from nova import context
 from nova import exception
 from nova import flags
-from nova.rpc.common import RemoteError, LOG
+from nova.rpc import codec
+from nova.rpc.common import RemoteError, Timeout, LOG
 
 # Needed for tests
 eventlet.monkey_patch()
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('rpc_reply_chunk_size', 100,
+                     'Most results of a generator sent in one reply message.')
+flags.DEFINE_boolean('rpc_reply_queue', False,
+                     'Receive the replies to all calls on one queue per '
+                     'process. Only turn it on once every service answering '
+                     'the calls, guest agents included, understands the '
+                     '_reply_q message key; older ones reply where nobody '
+                     'listens and the call times out.')
 
 
 class ConsumerBase(object):
@@ -597,8 +608,13 @@ class ProxyCallback(object):
         Example: {'method': 'echo', 'args': {'value': 42}}
 
         """
+        context_dict = None
+        enveloped = codec.is_envelope(message_data)
+        if enveloped:
+            message_data, context_dict = codec.unwrap(message_data)
         LOG.debug(_('received %s') % message_data)
-        ctxt = _unpack_context(message_data)
+        ctxt = _unpack_context(message_data, context_dict)
+        ctxt.envelope = enveloped
         method = message_data.get('method')
         args = message_data.get('args', {})
         if not method:
@@ -618,6 +634,9 @@ class ProxyCallback(object):
         # NOTE(vish): magic is fun!
         try:
             rval = node_func(context=ctxt, **node_args)
+            if ctxt.batch_reply:
+                self._reply_batched(ctxt, rval)
+                return
             # Check if the result was a generator
             if isinstance(rval, types.GeneratorType):
                 for x in rval:
@@ -631,18 +650,44 @@ class ProxyCallback(object):
             ctxt.reply(None, sys.exc_info())
         return
 
+    def _reply_batched(self, ctxt, rval):
+        """Reply to a caller that understands chunks and the ending flag.
 
-def _unpack_context(msg):
-    """Unpack context from msg."""
-    context_dict = {}
-    for key in list(msg.keys()):
+        A plain result goes out in one message that also ends the call.  A
+        generator's results go out rpc_reply_chunk_size at a time, the last
+        chunk ending the call.
+        """
+        if not isinstance(rval, types.GeneratorType):
+            ctxt.reply(rval, None, ending=True)
+            return
+        chunk = []
+        for x in rval:
+            chunk.append(x)
+            if len(chunk) >= FLAGS.rpc_reply_chunk_size:
+                ctxt.reply_many(chunk)
+                chunk = []
+        ctxt.reply_many(chunk, ending=True)
+
+
+def _unpack_context(msg, context_dict=None):
+    """Unpack context from msg, or from the dict an envelope carried."""
+    if context_dict is not None:
         # NOTE(vish): Some versions of python don't like unicode keys
         #             in kwargs.
-        key = str(key)
-        if key.startswith('_context_'):
-            value = msg.pop(key)
-            context_dict[key[9:]] = value
+        context_dict = dict((str(key), value)
+                            for key, value in context_dict.iteritems())
+    else:
+        context_dict = {}
+        for key in list(msg.keys()):
+            # NOTE(vish): Some versions of python don't like unicode keys
+            #             in kwargs.
+            key = str(key)
+            if key.startswith('_context_'):
+                value = msg.pop(key)
+                context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
+    context_dict['batch_reply'] = msg.pop('_batch_reply', False)
     LOG.debug(_('unpacked context: %s'), context_dict)
     return RpcContext.from_dict(context_dict)
 
@@ -661,24 +706,75 @@ def _pack_context(msg, context):
     msg.update(context_d)
 
 
+def _pack_message(msg, context):
+    """Pack context into msg, returning the message to send.
+
+    RPC requests are put in an envelope if rpc_envelope is set.  Messages
+    without a method, such as notifications, are always sent plain because
+    their consumers may not understand it.
+
+    """
+    if FLAGS.rpc_envelope and 'method' in msg:
+        return codec.wrap(msg, context=context.to_dict())
+    _pack_context(msg, context)
+    return msg
+
+
 class RpcContext(context.RequestContext):
     """Context that supports replying to a rpc.call"""
     def __init__(self, *args, **kwargs):
         msg_id = kwargs.pop('msg_id', None)
         self.msg_id = msg_id
+        self.reply_q = kwargs.pop('reply_q', None)
+        self.batch_reply = kwargs.pop('batch_reply', False)
+        self.envelope = kwargs.pop('envelope', False)
         super(RpcContext, self).__init__(*args, **kwargs)
 
     def reply(self, *args, **kwargs):
         if self.msg_id:
-            msg_reply(self.msg_id, *args, **kwargs)
+            msg_reply(self.msg_id, *args, reply_q=self.reply_q,
+                      envelope=self.envelope, **kwargs)
+
+    def reply_many(self, results, ending=False):
+        """Send several results in one message to a batch_reply caller."""
+        if self.msg_id:
+            msg_reply(self.msg_id, reply_q=self.reply_q, results=results,
+                      ending=ending, envelope=self.envelope)
+
+
+def _results_from_reply(data):
+    """Returns the results in a reply and whether it ends the call.
+
+    Replies from services that predate batching carry one result each and
+    end with a None result.
+
+    :raises RemoteError: if the reply carries a failure.
+    """
+    if codec.is_envelope(data):
+        data, _context = codec.unwrap(data)
+    if data['failure']:
+        raise RemoteError(*data['failure'])
+    if 'results' in data:
+        results = data['results']
+    else:
+        results = [data['result']]
+    ending = data.get('ending', False)
+    if None in results:
+        results = results[:results.index(None)]
+        ending = True
+    return results, ending
 
 
 class MulticallWaiter(object):
-    def __init__(self, connection):
+    def __init__(self, connection, msg_id=None, timeout=None):
         self._connection = connection
         self._iterator = connection.iterconsume()
         self._result = None
         self._done = False
+        self._msg_id = msg_id
+        self._deadline = None
+        if timeout is not None:
+            self._deadline = time.time() + timeout
 
     def done(self):
         self._done = True
@@ -687,26 +783,130 @@ class MulticallWaiter(object):
         self._connection.close()
 
     def __call__(self, data):
-        """The consume() callback will call this.  Store the result."""
-        if data['failure']:
-            self._result = RemoteError(*data['failure'])
-        else:
-            self._result = data['result']
+        """The consume() callback will call this.  Store the reply."""
+        self._result = data
+
+    def __iter__(self):
+        """Return a result until we get a 'None' response from consumer"""
+        if self._done:
+            raise StopIteration
+        while True:
+            timer = None
+            if self._deadline is not None:
+                timer = eventlet.Timeout(max(self._deadline - time.time(), 0))
+            try:
+                self._iterator.next()
+            except eventlet.Timeout as t:
+                if t is not timer:
+                    raise
+                self.done()
+                raise Timeout(_('Timed out waiting for a reply to '
+                                'message ID %s') % self._msg_id)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            try:
+                results, ending = _results_from_reply(self._result)
+            except RemoteError:
+                self.done()
+                raise
+            for result in results:
+                yield result
+            if ending:
+                self.done()
+                raise StopIteration
+
+
+class ReplyWaiter(object):
+    """Receives the replies to every call made by this process.
+
+    The replies all arrive on one exclusive queue, declared once, and each is
+    handed to the call waiting on its _msg_id.
+    """
+
+    def __init__(self):
+        self.reply_q = 'reply_%s' % uuid.uuid4().hex
+        self.waiters = {}
+        self.connection = Connection()
+        self.connection.declare_direct_consumer(self.reply_q, self)
+        self.connection.consume_in_thread()
+
+    def __call__(self, data):
+        """The consume() callback; routes a reply to its call."""
+        msg_id = data.pop('_msg_id', None)
+        waiter = self.waiters.get(msg_id)
+        if waiter is None:
+            LOG.warn(_('No call is waiting on message ID %s, dropping its '
+                       'reply') % msg_id)
+            return
+        waiter.put(data)
+
+    def register(self, msg_id):
+        self.waiters[msg_id] = queue.LightQueue()
+        return self.waiters[msg_id]
+
+    def unregister(self, msg_id):
+        self.waiters.pop(msg_id, None)
+
+    def close(self):
+        self.connection.close()
+
+
+class ReplyQueueMulticallWaiter(object):
+    """Iterates over the replies to one call routed by the ReplyWaiter."""
+
+    def __init__(self, reply_waiter, msg_id, timeout=None):
+        self._reply_waiter = reply_waiter
+        self._msg_id = msg_id
+        self._replies = reply_waiter.register(msg_id)
+        self._done = False
+        self._deadline = None
+        if timeout is not None:
+            self._deadline = time.time() + timeout
+
+    def done(self):
+        if not self._done:
+            self._done = True
+            self._reply_waiter.unregister(self._msg_id)
 
     def __iter__(self):
         """Return a result until we get a 'None' response from consumer"""
         if self._done:
             raise StopIteration
         while True:
-            self._iterator.next()
-            result = self._result
-            if isinstance(result, Exception):
+            timeout = None
+            if self._deadline is not None:
+                timeout = max(self._deadline - time.time(), 0)
+            try:
+                data = self._replies.get(timeout=timeout)
+            except queue.Empty:
                 self.done()
-                raise result
-            if result == None:
+                raise Timeout(_('Timed out waiting for a reply to '
+                                'message ID %s') % self._msg_id)
+            try:
+                results, ending = _results_from_reply(data)
+            except RemoteError:
+                self.done()
+                raise
+            for result in results:
+                yield result
+            if ending:
                 self.done()
                 raise StopIteration
-            yield result
+
+
+_REPLY_WAITER = None
+_REPLY_WAITER_LOCK = semaphore.Semaphore()
+
+
+def _get_reply_waiter():
+    """Start the process's ReplyWaiter the first time a call is made."""
+    global _REPLY_WAITER
+    with _REPLY_WAITER_LOCK:
+        if _REPLY_WAITER is None:
+            _REPLY_WAITER = ReplyWaiter()
+            LOG.debug(_('Receiving replies on %s'), _REPLY_WAITER.reply_q)
+    return _REPLY_WAITER
 
 
 def create_connection(new=True):
@@ -714,40 +914,54 @@ def create_connection(new=True):
     return ConnectionContext(pooled=not new)
 
 
-def multicall(context, topic, msg):
-    """Make a call that returns multiple times."""
+def multicall(context, topic, msg, timeout=None):
+    """Make a call that returns multiple times.
+
+    If timeout is given, Timeout is raised when no reply arrives within that
+    many seconds of the call.
+
+    """
+    LOG.debug(_('Making asynchronous call on %s ...'), topic)
+    msg_id = uuid.uuid4().hex
+    msg.update({'_msg_id': msg_id, '_batch_reply': True})
+    LOG.debug(_('MSG_ID is %s') % (msg_id))
+    if FLAGS.rpc_reply_queue:
+        reply_waiter = _get_reply_waiter()
+        msg['_reply_q'] = reply_waiter.reply_q
+        msg = _pack_message(msg, context)
+        # Register before sending so a quick reply is not dropped.
+        wait_msg = ReplyQueueMulticallWaiter(reply_waiter, msg_id,
+                                             timeout=timeout)
+        with ConnectionContext() as conn:
+            conn.topic_send(topic, msg)
+        return wait_msg
+
+    msg = _pack_message(msg, context)
     # Can't use 'with' for multicall, as it returns an iterator
     # that will continue to use the connection.  When it's done,
     # connection.close() will get called which will put it back into
     # the pool
-    LOG.debug(_('Making asynchronous call on %s ...'), topic)
-    msg_id = uuid.uuid4().hex
-    msg.update({'_msg_id': msg_id})
-    LOG.debug(_('MSG_ID is %s') % (msg_id))
-    _pack_context(msg, context)
-
     conn = ConnectionContext()
-    wait_msg = MulticallWaiter(conn)
+    wait_msg = MulticallWaiter(conn, msg_id, timeout=timeout)
     conn.declare_direct_consumer(msg_id, wait_msg)
     conn.topic_send(topic, msg)
 
     return wait_msg
 
 
-def call(context, topic, msg):
+def call(context, topic, msg, timeout=None):
     """Sends a message on a topic and wait for a response."""
-    rv = multicall(context, topic, msg)
     # NOTE(vish): return the last result from the multicall
-    rv = list(rv)
-    if not rv:
-        return
-    return rv[-1]
+    rv = None
+    for rv in multicall(context, topic, msg, timeout=timeout):
+        pass
+    return rv
 
 
 def cast(context, topic, msg):
     """Sends a message on a topic without waiting for a response."""
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
-    _pack_context(msg, context)
+    msg = _pack_message(msg, context)
     with ConnectionContext() as conn:
         conn.topic_send(topic, msg)
 
@@ -755,15 +969,20 @@ def cast(context, topic, msg):
 def fanout_cast(context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
-    _pack_context(msg, context)
+    msg = _pack_message(msg, context)
     with ConnectionContext() as conn:
         conn.fanout_send(topic, msg)
 
 
-def msg_reply(msg_id, reply=None, failure=None):
+def msg_reply(msg_id, reply=None, failure=None, reply_q=None, results=None,
+              ending=False, envelope=False):
     """Sends a reply or an error on the channel signified by msg_id.
 
-    Failure should be a sys.exc_info() tuple.
+    Failure should be a sys.exc_info() tuple.  If the caller named a reply_q
+    the reply goes there, tagged with msg_id.  A list of results may be sent
+    in place of reply, and ending tells a batch_reply caller that nothing
+    follows.  With envelope the reply is put in an RPC envelope, leaving
+    _msg_id outside it.
 
     """
     with ConnectionContext() as conn:
@@ -780,4 +999,15 @@ def msg_reply(msg_id, reply=None, failure=None):
             msg = {'result': dict((k, repr(v))
                             for k, v in reply.__dict__.iteritems()),
                     'failure': failure}
-        conn.direct_send(msg_id, msg)
+        if results is not None:
+            msg['results'] = results
+            del msg['result']
+        if ending:
+            msg['ending'] = True
+        if envelope:
+            msg = codec.wrap(msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
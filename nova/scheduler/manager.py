@@ -36,6 +36,9 @@ FLAGS = flags.FLAGS
 flags.DEFINE_string('scheduler_driver',
                     'nova.scheduler.multi.MultiScheduler',
                     'Default driver to use for the scheduler')
+flags.DEFINE_integer('quota_usage_reconcile_interval', 60 * 60,
+                     'Seconds between recounting the quota usage of every '
+                     'project to fix any drift. Zero turns it off.')
 
 
 class SchedulerManager(manager.Manager):
@@ -47,6 +50,7 @@ class SchedulerManager(manager.Manager):
             scheduler_driver = FLAGS.scheduler_driver
         self.driver = utils.import_object(scheduler_driver)
         self.driver.set_zone_manager(self.zone_manager)
+        self.last_quota_reconcile = None
         super(SchedulerManager, self).__init__(*args, **kwargs)
 
     def __getattr__(self, key):
@@ -56,6 +60,24 @@ class SchedulerManager(manager.Manager):
     def periodic_tasks(self, context=None):
         """Poll child zones periodically to get status."""
         self.zone_manager.ping(context)
+        self._reconcile_quota_usage(context)
+
+    def _reconcile_quota_usage(self, context):
+        """Recounts the quota usage of every project every so often."""
+        if FLAGS.quota_usage_reconcile_interval <= 0:
+            return
+        if self.last_quota_reconcile is not None and \
+           not utils.is_older_than(self.last_quota_reconcile,
+                                   FLAGS.quota_usage_reconcile_interval):
+            return
+        self.last_quota_reconcile = utils.utcnow()
+        try:
+            drifted = db.quota_usage_reconcile(context)
+        except Exception as e:
+            LOG.error(_("Error when reconciling quota usage: %s") % e)
+            return
+        if drifted:
+            LOG.warn(_("Fixed the quota usage of projects %s") % drifted)
 
     def get_host_list(self, context=None):
         """Get a list of hosts from the ZoneManager."""
@@ -77,6 +99,52 @@ class SchedulerManager(manager.Manager):
         self.zone_manager.update_service_capabilities(service_name,
                             host, capabilities)
 
+    def reserve_memory(self, context, host, memory_mb, ttl=None):
+        """Hold memory on a host if the driver keeps a capacity ledger.
+
+        Returns the reservation, which names this scheduler so that
+        release_memory can be sent back to it, or False when the driver
+        does not take reservations.
+        """
+        reserve = getattr(self.driver, 'reserve_memory', None)
+        if reserve is None:
+            return False
+        reservation_id = reserve(context.elevated(), host, memory_mb, ttl=ttl)
+        return {'scheduler': self.host, 'id': reservation_id}
+
+    def release_memory(self, context, reservation_id, used=False):
+        """End a reservation made by reserve_memory."""
+        release = getattr(self.driver, 'release_memory', None)
+        if release is not None:
+            release(context.elevated(), reservation_id, used=used)
+
+    def run_instances(self, context, topic, instance_ids, strategy=None,
+                      **kwargs):
+        """Place a batch of instances together and start each of them.
+
+        Drivers without schedule_run_instances place them one at a time.
+        Returns the host picked for each instance id, in order.
+        """
+        schedule = getattr(self.driver, 'schedule_run_instances', None)
+        if schedule is None:
+            for instance_id in instance_ids:
+                self._schedule('run_instance', context, topic,
+                               instance_id=instance_id, **kwargs)
+            return [None] * len(instance_ids)
+
+        hosts = schedule(context.elevated(), instance_ids, strategy=strategy,
+                         **kwargs)
+        for instance_id in instance_ids:
+            host = hosts[instance_id]
+            args = dict(kwargs, instance_id=instance_id)
+            rpc.cast(context,
+                     db.queue_get_for(context, topic, host),
+                     {"method": "run_instance",
+                      "args": args})
+            LOG.debug(_("Casted to %(topic)s %(host)s for run_instance")
+                        % locals())
+        return [hosts[instance_id] for instance_id in instance_ids]
+
     def select(self, context=None, *args, **kwargs):
         """Select a list of hosts best matching the provided specs."""
         return self.driver.select(context, *args, **kwargs)
@@ -19,6 +19,8 @@ Tests dealing with HTTP rate-limiting.
 
 import httplib
 import json
+import re
+import socket
 import StringIO
 import stubout
 import time
@@ -502,6 +504,55 @@ class LimitTest(BaseLimitTestSuite):
         self.assertEqual(4, limit.last_request)
 
 
+class LimitMatcherTest(BaseLimitTestSuite):
+    """
+    Tests for the `limits.LimitMatcher` class.
+    """
+
+    def _assert_matches_each_limit(self, test_limits):
+        matcher = limits.LimitMatcher(test_limits)
+        for verb in ["GET", "POST", "PUT", "DELETE"]:
+            for url in ["/servers", "/servers/1", "/delayed", "/anything",
+                        "/images?changes-since=1", ""]:
+                expected = [index for index, limit in enumerate(test_limits)
+                            if limit.verb == verb and
+                               re.match(limit.regex, url)]
+                self.assertEqual(expected, matcher.match(verb, url))
+
+    def test_matches_like_each_limit(self):
+        test_limits = TEST_LIMITS + limits.DEFAULT_LIMITS
+        self._assert_matches_each_limit(test_limits)
+
+    def test_regex_with_groups(self):
+        test_limits = TEST_LIMITS + [
+            limits.Limit("GET", "*", "^/(servers|images)", 1, 1),
+            limits.Limit("GET", "*", ".*", 1, 1),
+        ]
+        self._assert_matches_each_limit(test_limits)
+
+    def test_unknown_verb(self):
+        matcher = limits.LimitMatcher(TEST_LIMITS)
+        self.assertEqual([], matcher.match("HEAD", "/delayed"))
+
+
+class LimitLevelsTest(BaseLimitTestSuite):
+    """
+    Tests for the `limits.LimitLevels` class.
+    """
+
+    def test_least_recently_seen_users_are_forgotten(self):
+        levels = limits.LimitLevels(lambda username: [username], 10)
+        for username in range(10):
+            self.assertEqual([username], levels[username])
+        levels[0]
+
+        levels[10]
+        self.assertEqual(10, len(levels))
+        self.assertTrue(0 in levels)
+        self.assertFalse(1 in levels)
+        self.assertTrue(10 in levels)
+
+
 class ParseLimitsTest(BaseLimitTestSuite):
     """
     Tests for the default limits parser in the in-memory
@@ -722,6 +773,35 @@ class LimiterTest(BaseLimitTestSuite):
         self.assertEqual(expected, results)
 
 
+class MemcachedLimiterTest(BaseLimitTestSuite):
+    """
+    Tests for the `limits.MemcachedLimiter` class.
+    """
+
+    def setUp(self):
+        """Run before each test."""
+        BaseLimitTestSuite.setUp(self)
+        self.limiter = limits.MemcachedLimiter(TEST_LIMITS)
+        self.other_limiter = limits.MemcachedLimiter(TEST_LIMITS)
+        self.other_limiter.mc = self.limiter.mc
+
+    def test_limiters_share_levels(self):
+        results = []
+        for limiter in [self.limiter, self.other_limiter] * 2:
+            results.append(limiter.check_for_delay("POST", "/servers")[0])
+        self.assertEqual([None] * 3 + [20.0], results)
+
+    def test_users_have_their_own_levels(self):
+        delay = self.limiter.check_for_delay("GET", "/delayed", "user1")
+        self.assertEqual((None, None), delay)
+
+        delay = self.other_limiter.check_for_delay("GET", "/delayed", "user2")
+        self.assertEqual((None, None), delay)
+
+        delay = self.other_limiter.check_for_delay("GET", "/delayed", "user1")
+        self.assertEqual(60.0, delay[0])
+
+
 class WsgiLimiterTest(BaseLimitTestSuite):
     """
     Tests for `limits.WsgiLimiter` class.
@@ -812,12 +892,15 @@ class FakeHttplibConnection(object):
     Fake `httplib.HTTPConnection`.
     """
 
+    http_version = "HTTP/1.0"
+
     def __init__(self, app, host):
         """
         Initialize `FakeHttplibConnection`.
         """
         self.app = app
         self.host = host
+        self.closed = False
 
     def request(self, method, path, body="", headers=None):
         """
@@ -835,7 +918,7 @@ class FakeHttplibConnection(object):
         req.body = body
 
         resp = str(req.get_response(self.app))
-        resp = "HTTP/1.0 %s" % resp
+        resp = "%s %s" % (self.http_version, resp)
         sock = FakeHttplibSocket(resp)
         self.http_response = httplib.HTTPResponse(sock)
         self.http_response.begin()
@@ -844,8 +927,25 @@ class FakeHttplibConnection(object):
         """Return our generated response from the request."""
         return self.http_response
 
+    def close(self):
+        self.closed = True
 
-def wire_HTTPConnection_to_WSGI(host, app):
+
+class FakeKeepAliveConnection(FakeHttplibConnection):
+    """
+    Fake `httplib.HTTPConnection` whose responses keep the connection open.
+    """
+
+    http_version = "HTTP/1.1"
+    connections = []
+
+    def __init__(self, app, host):
+        FakeHttplibConnection.__init__(self, app, host)
+        self.connections.append(self)
+
+
+def wire_HTTPConnection_to_WSGI(host, app,
+                                connection_class=FakeHttplibConnection):
     """Monkeypatches HTTPConnection so that if you try to connect to host, you
     are instead routed straight to the given WSGI app.
 
@@ -870,7 +970,7 @@ def wire_HTTPConnection_to_WSGI(host, app):
 
         def __call__(self, connection_host, *args, **kwargs):
             if connection_host == host:
-                return FakeHttplibConnection(app, host)
+                return connection_class(app, host)
             else:
                 return self.wrapped(connection_host, *args, **kwargs)
 
@@ -911,6 +1011,42 @@ class WsgiLimiterProxyTest(BaseLimitTestSuite):
         self.assertEqual((delay, error), expected)
 
 
+class WsgiLimiterProxyKeepAliveTest(BaseLimitTestSuite):
+    """
+    Tests for the connections kept open by `limits.WsgiLimiterProxy`.
+    """
+
+    def setUp(self):
+        BaseLimitTestSuite.setUp(self)
+        self.app = limits.WsgiLimiter(TEST_LIMITS)
+        FakeKeepAliveConnection.connections = []
+        wire_HTTPConnection_to_WSGI("169.254.0.2:80", self.app,
+                                    FakeKeepAliveConnection)
+        self.proxy = limits.WsgiLimiterProxy("169.254.0.2:80")
+
+    def test_connection_is_reused(self):
+        delay = self.proxy.check_for_delay("GET", "/delayed")
+        self.assertEqual(delay, (None, None))
+
+        delay, error = self.proxy.check_for_delay("GET", "/delayed")
+        self.assertEqual("60.00", delay)
+        self.assertEqual(1, len(FakeKeepAliveConnection.connections))
+
+    def test_closed_connection_is_replaced(self):
+        self.proxy.check_for_delay("GET", "/delayed")
+        stale = FakeKeepAliveConnection.connections[0]
+
+        def closed_by_peer(*args, **kwargs):
+            raise socket.error("Connection reset by peer")
+
+        self.stubs.Set(stale, "request", closed_by_peer)
+
+        delay, error = self.proxy.check_for_delay("GET", "/delayed")
+        self.assertEqual("60.00", delay)
+        self.assertTrue(stale.closed)
+        self.assertEqual(2, len(FakeKeepAliveConnection.connections))
+
+
 class LimitsViewBuilderV11Test(test.TestCase):
 
     def setUp(self):
@@ -20,11 +20,12 @@ Fakes a DNS driver to make testing easier.
 """
 
 
+from reddwarf.dns.driver import DnsDriver
 from reddwarf.dns.driver import DnsEntryNotFound
 from reddwarf.dns.driver import DnsZone
 
 
-class FakeDnsDriver(object):
+class FakeDnsDriver(DnsDriver):
     """Fakes a DnsDriver.  Useful for unit testing."""
 
     def __init__(self, default_dns_zone=None):
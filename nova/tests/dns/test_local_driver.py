@@ -0,0 +1,88 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (c) 2012 Openstack, LLC.
+#    All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the local, file backed Dns Driver.
+"""
+
+import os
+import shutil
+import tempfile
+
+from nova import test
+from reddwarf.dns.driver import DnsEntry
+from reddwarf.dns.driver import DnsEntryNotFound
+from reddwarf.dns.local.driver import LocalDnsDriver
+
+
+class LocalDnsDriverTest(test.TestCase):
+
+    def setUp(self):
+        super(LocalDnsDriverTest, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'hosts')
+        self.driver = LocalDnsDriver(path=self.path, latency=0, jitter=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super(LocalDnsDriverTest, self).tearDown()
+
+    def _entry(self, name, content, type="A"):
+        return DnsEntry(name=name, content=content, type=type, ttl=300)
+
+    def test_create_entry_writes_hosts_line(self):
+        self.driver.create_entry(self._entry("a.dbaas.local", "10.0.0.1"))
+        with open(self.path) as hosts_file:
+            self.assertEqual("10.0.0.1 a.dbaas.local # A 300\n",
+                             hosts_file.read())
+
+    def test_entries_survive_a_restart(self):
+        self.driver.create_entries([self._entry("a.dbaas.local", "10.0.0.1"),
+                                    self._entry("b.dbaas.local",
+                                                "a.dbaas.local", "CNAME")])
+        driver = LocalDnsDriver(path=self.path, latency=0, jitter=0)
+        entries = driver.get_entries_by_name("b.dbaas.local")
+        self.assertEqual(1, len(entries))
+        self.assertEqual("CNAME", entries[0].type)
+        self.assertEqual("a.dbaas.local", entries[0].content)
+        self.assertEqual(1, len(driver.get_entries_by_content("10.0.0.1")))
+
+    def test_create_entries_reports_duplicates(self):
+        self.driver.create_entry(self._entry("a.dbaas.local", "10.0.0.1"))
+        created, failed = self.driver.create_entries(
+            [self._entry("a.dbaas.local", "10.0.0.2"),
+             self._entry("b.dbaas.local", "10.0.0.3")])
+        self.assertEqual(["b.dbaas.local"], [entry.name for entry in created])
+        self.assertEqual(["a.dbaas.local"],
+                         [entry.name for entry, _error in failed])
+
+    def test_delete_entry(self):
+        self.driver.create_entry(self._entry("a.dbaas.local", "10.0.0.1"))
+        self.driver.delete_entry("a.dbaas.local", "A")
+        self.assertEqual([], self.driver.get_entries_by_name("a.dbaas.local"))
+        self.assertRaises(DnsEntryNotFound, self.driver.delete_entry,
+                          "a.dbaas.local", "A")
+
+    def test_latency_is_injected(self):
+        sleeps = []
+        self.stubs.Set(LocalDnsDriver, '_sleep',
+                       staticmethod(lambda seconds: sleeps.append(seconds)))
+        driver = LocalDnsDriver(path=self.path, latency=0.25, jitter=0)
+        driver.create_entries([self._entry("a.dbaas.local", "10.0.0.1"),
+                               self._entry("b.dbaas.local", "10.0.0.2")])
+        driver.get_entries_by_content("10.0.0.1")
+        self.assertEqual([0.25, 0.25], sleeps)
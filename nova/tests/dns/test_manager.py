@@ -20,9 +20,8 @@ Unit tests for the Dns Manager.
 """
 
 
-import unittest
-
 from nova import context
+from nova import test
 from reddwarf.dns.driver import DnsEntry
 from reddwarf.dns.driver import DnsEntryNotFound
 from reddwarf.dns.manager import DnsManager
@@ -42,9 +41,11 @@ class FakeEntryFactory(object):
             return None
 
 
-class BaseCase(unittest.TestCase):
+class BaseCase(test.TestCase):
 
     def setUp(self):
+        super(BaseCase, self).setUp()
+        self.flags(dns_batch_delay=0)
         self.driver = FakeDnsDriver()
         self.entry_factory = FakeEntryFactory()
         self.manager = DnsManager()
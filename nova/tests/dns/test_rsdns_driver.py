@@ -0,0 +1,96 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright (c) 2012 Openstack, LLC.
+#    All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for reconciling the RSDNS record index.
+"""
+
+from nova import test
+from reddwarf.dns.rsdns import driver
+
+
+class FakeRecord(object):
+
+    def __init__(self, id, name, data, type='A'):
+        self.id = id
+        self.name = name
+        self.data = data
+        self.type = type
+
+
+class FakeRow(object):
+
+    def __init__(self, id, name, content, type='A'):
+        self.id = id
+        self.name = name
+        self.content = content
+        self.type = type
+
+
+class FakeRecords(object):
+
+    def __init__(self, records):
+        self.records = records
+        self.while_listing = lambda: None
+
+    def list(self, domain_id=None):
+        self.while_listing()
+        return self.records
+
+
+class FakeClient(object):
+
+    def __init__(self, records):
+        self.records = FakeRecords(records)
+
+
+class ReconcileTest(test.TestCase):
+
+    def setUp(self):
+        super(ReconcileTest, self).setUp()
+        self.driver = driver.RsDnsDriver.__new__(driver.RsDnsDriver)
+        self.driver.default_dns_zone = driver.RsDnsZone(id=1, name='x.com')
+        self.driver.dns_client = FakeClient([
+            FakeRecord(1, 'kept.x.com', '10.0.0.1'),
+            FakeRecord(2, 'moved.x.com', '10.0.0.3'),
+            FakeRecord(3, 'foreign.x.com', '10.0.0.9')])
+        self.rows = [FakeRow('1', 'kept.x.com', '10.0.0.1'),
+                     FakeRow('2', 'moved.x.com', '10.0.0.2'),
+                     FakeRow('4', 'gone.x.com', '10.0.0.4')]
+        self.changes = []
+        self.stubs.Set(driver.dbapi, 'rsdns_record_find',
+                       lambda name=None, content=None: list(self.rows))
+        self.stubs.Set(driver.dbapi, 'rsdns_record_delete',
+                       lambda name: self.changes.append(('delete', name)))
+        self.stubs.Set(driver.dbapi, 'rsdns_record_update',
+                       lambda name, values: self.changes.append(
+                           ('update', name, values['content'])))
+        self.stubs.Set(driver.dbapi, 'rsdns_record_create',
+                       lambda **kwargs: self.changes.append(
+                           ('create', kwargs['name'])))
+
+    def test_only_indexed_records_are_reconciled(self):
+        counts = self.driver.reconcile()
+        self.assertEqual({'removed': 1, 'updated': 1}, counts)
+        self.assertEqual([('update', 'moved.x.com', '10.0.0.3'),
+                          ('delete', 'gone.x.com')], self.changes)
+
+    def test_records_indexed_while_listing_are_kept(self):
+        self.driver.dns_client.records.while_listing = lambda: \
+            self.rows.append(FakeRow('5', 'new.x.com', '10.0.0.5'))
+        self.driver.reconcile()
+        self.assertFalse(('delete', 'new.x.com') in self.changes)
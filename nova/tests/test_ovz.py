@@ -15,7 +15,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import mox
+import os
+import shutil
+import tempfile
 import __builtin__
 from nova import exception
 from nova import flags
@@ -46,6 +50,8 @@ INSTANCE = {
 
 RES_PERCENT = .50
 
+BATCH = mox.IsA(openvz_conn.OVZSetBatch)
+
 VZLIST = "\t1001\n\t%d\n\t1003\n\t1004\n" % (INSTANCE['id'],)
 
 VZNAME = """\tinstance-00001001\n"""
@@ -54,6 +60,11 @@ VZNAMES = """\tinstance-00001001\n\t%s
               \tinstance-00001003\n\tinstance-00001004\n""" % (
     INSTANCE['name'],)
 
+VZSNAPSHOT = """      1001 instance-00001001 running
+      %d %s running
+      1003 - stopped
+""" % (INSTANCE['id'], INSTANCE['name'])
+
 GOODSTATUS = {
     'state': power_state.RUNNING,
     'max_mem': 0,
@@ -136,6 +147,22 @@ Current CPU utilization: 51000
 Power of the node: 758432
 """
 
+BEANCOUNTERS = (
+    "Version: 2.5\n"
+    "       uid  resource                     held              maxheld"
+    "              barrier                limit              failcnt\n"
+    "      %d:  kmemsize                  2281566              2703374"
+    "             11055923             11377049                    0\n"
+    "            privvmpages                 12842                15346"
+    "               262144               262144                    0\n"
+    "            vmguarpages                     0                    0"
+    "               262144  9223372036854775807                    0\n"
+    "         0:  kmemsize                 10541452             14434528"
+    "  9223372036854775807  9223372036854775807                    0\n"
+    "            vmguarpages                     0                    0"
+    "                    0  9223372036854775807                    0\n"
+) % INSTANCE['id']
+
 CPUCHECKNOCONT = """Current CPU utilization: 51000
 Power of the node: 758432
 """
@@ -283,6 +310,13 @@ MEM_PAGES = 131072
 
 VCPUS = 2
 
+
+class FakeStatvfs(object):
+    f_frsize = 4096
+    f_blocks = 100 * 1024 * 1024 / 4
+    f_bavail = 40 * 1024 * 1024 / 4
+
+
 class OpenVzConnTestCase(test.TestCase):
     def setUp(self):
         super(OpenVzConnTestCase, self).setUp()
@@ -301,22 +335,46 @@ class OpenVzConnTestCase(test.TestCase):
     def test_list_instances_detail_success(self):
         # Testing happy path of OpenVzConnection.list_instances()
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
-        openvz_conn.utils.execute('vzlist', '--all', '-o', 'name', '-H',
-                                  run_as_root=True).AndReturn((VZNAMES, None))
+        openvz_conn.utils.execute('vzlist', '--all', '-H', '-o',
+                                  'ctid,name,status', run_as_root=True)\
+                                  .AndReturn((VZSNAPSHOT, None))
+        self.mox.StubOutWithMock(openvz_conn.db, 'instance_get_all_by_host')
+        openvz_conn.db.instance_get_all_by_host(mox.IgnoreArg(),
+                                                mox.IgnoreArg())\
+            .AndReturn([{'id': 1001, 'power_state': power_state.SHUTDOWN},
+                        {'id': INSTANCE['id'],
+                         'power_state': power_state.RUNNING}])
         conn = openvz_conn.OpenVzConnection(False)
-        self.mox.StubOutWithMock(conn, 'get_info')
-        conn.get_info(mox.IgnoreArg()).MultipleTimes().AndReturn(GOODSTATUS)
 
         # Start test
         self.mox.ReplayAll()
 
         vzs = conn.list_instances_detail()
         self.assertEqual(vzs.__class__, list)
+        self.assertEqual(2, len(vzs))
+        for vz in vzs:
+            self.assertEqual(power_state.RUNNING, vz.state)
+
+    def test_get_info_reuses_host_snapshot(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzlist', '--all', '-H', '-o',
+                                  'ctid,name,status', run_as_root=True)\
+                                  .AndReturn((VZSNAPSHOT, None))
+        self.mox.StubOutWithMock(openvz_conn.db, 'instance_get')
+        openvz_conn.db.instance_get(mox.IgnoreArg(), mox.IgnoreArg())\
+            .MultipleTimes().AndReturn({'id': INSTANCE['id'],
+                                        'power_state': power_state.RUNNING})
+        conn = openvz_conn.OpenVzConnection(False)
+        self.mox.ReplayAll()
+        for _i in range(3):
+            self.assertEqual(GOODSTATUS, conn.get_info(INSTANCE['name']))
+        self.assertRaises(exception.NotFound, conn.get_info,
+                          'instance-00001003')
 
     def test_list_instances_detail_failure(self):
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
-        openvz_conn.utils.execute('vzlist', '--all', '-o', 'name', '-H',
-                                   run_as_root=True) \
+        openvz_conn.utils.execute('vzlist', '--all', '-H', '-o',
+                                  'ctid,name,status', run_as_root=True) \
                                   .AndRaise(exception.ProcessExecutionError)
         conn = openvz_conn.OpenVzConnection(False)
 
@@ -552,22 +610,22 @@ class OpenVzConnTestCase(test.TestCase):
         conn._percent_of_resource(FAKE_INST_TYPE['memory_mb'])\
             .AndReturn(RES_PERCENT)
         self.mox.StubOutWithMock(conn, '_set_vmguarpages')
-        conn._set_vmguarpages(INSTANCE, MEM_PAGES)
+        conn._set_vmguarpages(INSTANCE, MEM_PAGES, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_privvmpages')
-        conn._set_privvmpages(INSTANCE, MEM_PAGES)
+        conn._set_privvmpages(INSTANCE, MEM_PAGES, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_kmemsize')
         conn._set_kmemsize(INSTANCE,
-            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024))
+            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024), batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_cpuunits')
-        conn._set_cpuunits(INSTANCE, RES_PERCENT)
+        conn._set_cpuunits(INSTANCE, RES_PERCENT, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_cpulimit')
-        conn._set_cpulimit(INSTANCE, RES_PERCENT)
+        conn._set_cpulimit(INSTANCE, RES_PERCENT, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_cpus')
-        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'])
+        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'], batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_ioprio')
-        conn._set_ioprio(INSTANCE, RES_PERCENT)
+        conn._set_ioprio(INSTANCE, RES_PERCENT, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_diskspace')
-        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE)
+        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE, batch=BATCH)
         self.mox.ReplayAll()
         conn._set_instance_size(INSTANCE)
 
@@ -583,25 +641,74 @@ class OpenVzConnTestCase(test.TestCase):
         conn._percent_of_resource(FAKE_INST_TYPE['memory_mb'])\
         .AndReturn(RES_PERCENT)
         self.mox.StubOutWithMock(conn, '_set_vmguarpages')
-        conn._set_vmguarpages(INSTANCE, MEM_PAGES)
+        conn._set_vmguarpages(INSTANCE, MEM_PAGES, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_privvmpages')
-        conn._set_privvmpages(INSTANCE, MEM_PAGES)
+        conn._set_privvmpages(INSTANCE, MEM_PAGES, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_kmemsize')
         conn._set_kmemsize(INSTANCE,
-            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024))
+            ((FAKE_INST_TYPE['memory_mb'] * 1024) * 1024), batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_cpuunits')
-        conn._set_cpuunits(INSTANCE, RES_PERCENT)
+        conn._set_cpuunits(INSTANCE, RES_PERCENT, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_cpulimit')
-        conn._set_cpulimit(INSTANCE, RES_PERCENT)
+        conn._set_cpulimit(INSTANCE, RES_PERCENT, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_cpus')
-        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'])
+        conn._set_cpus(INSTANCE, FAKE_INST_TYPE['vcpus'], batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_ioprio')
-        conn._set_ioprio(INSTANCE, RES_PERCENT)
+        conn._set_ioprio(INSTANCE, RES_PERCENT, batch=BATCH)
         self.mox.StubOutWithMock(conn, '_set_diskspace')
-        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE)
+        conn._set_diskspace(INSTANCE, FAKE_INST_TYPE, batch=BATCH)
         self.mox.ReplayAll()
         conn._set_instance_size(INSTANCE, FAKE_INST_TYPE['id'])
 
+    def test_set_instance_size_single_vzctl_set(self):
+        self.mox.StubOutWithMock(openvz_conn.instance_types,
+                                 'get_instance_type')
+        openvz_conn.instance_types.get_instance_type(
+            INSTANCE['instance_type_id']).AndReturn(FAKE_INST_TYPE)
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--vmguarpages', 262144,
+                                  '--privvmpages', 262144,
+                                  '--kmemsize', mox.IgnoreArg(),
+                                  '--cpuunits', mox.IgnoreArg(),
+                                  '--cpulimit', mox.IgnoreArg(),
+                                  '--cpus', mox.IgnoreArg(),
+                                  '--ioprio', mox.IgnoreArg(),
+                                  '--diskspace', '40G:44G',
+                                  run_as_root=True).AndReturn(('', ''))
+        conn = openvz_conn.OpenVzConnection(False)
+        self.mox.StubOutWithMock(conn, 'utility')
+        conn.utility = UTILITY
+        self.mox.ReplayAll()
+        conn._set_instance_size(INSTANCE)
+
+    def test_set_batch_replaces_option(self):
+        batch = openvz_conn.OVZSetBatch(INSTANCE['id'])
+        batch.add('--hostname', 'old')
+        batch.add('--onboot', 'no')
+        batch.add('--hostname', 'new')
+        self.assertEqual(['--hostname', 'new', '--onboot', 'no'],
+                         batch.args())
+
+    def test_set_batch_empty_does_not_run(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        self.mox.ReplayAll()
+        batch = openvz_conn.OVZSetBatch(INSTANCE['id'])
+        self.assertFalse(batch.apply())
+
+    def test_set_batch_failure(self):
+        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
+        openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
+                                  '--name', INSTANCE['name'],
+                                  run_as_root=True)\
+                                  .AndRaise(exception.ProcessExecutionError)
+        self.mox.ReplayAll()
+        conn = openvz_conn.OpenVzConnection(False)
+        batch = openvz_conn.OVZSetBatch(INSTANCE['id'])
+        conn._set_name(INSTANCE, batch=batch)
+        self.assertRaises(exception.Error, batch.apply)
+        self.assertNotEqual(None, batch.duration)
+
     def test_set_vmguarpages_success(self):
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
         openvz_conn.utils.execute('vzctl', 'set', INSTANCE['id'], '--save',
@@ -783,22 +890,143 @@ class OpenVzConnTestCase(test.TestCase):
         self.assertEqual(float, type(conn._percent_of_resource(MEMORYMB)))
 
     def test_get_memory_success(self):
-        self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
-        openvz_conn.utils.execute('cat', '/proc/meminfo', run_as_root=True)\
-                                  .AndReturn((MEMINFO, ''))
-        self.mox.ReplayAll()
         conn = openvz_conn.OpenVzConnection(False)
-        conn._get_memory()
+        self.mox.StubOutWithMock(conn, '_read_proc')
+        conn._read_proc('/proc/meminfo').AndReturn(MEMINFO)
+        self.mox.ReplayAll()
+        meminfo = conn._get_memory()
         self.assertEquals(int, type(conn.utility['MEMORY_MB']))
         self.assertTrue(conn.utility['MEMORY_MB'] > 0)
+        self.assertEqual(291992, meminfo['MemFree'])
 
     def test_get_memory_failure(self):
+        conn = openvz_conn.OpenVzConnection(False)
+        self.mox.StubOutWithMock(conn, '_read_proc')
+        conn._read_proc('/proc/meminfo').AndRaise(exception.Error)
+        self.mox.ReplayAll()
+        self.assertRaises(exception.Error, conn._get_memory)
+
+    def test_read_proc_falls_back_to_sudo(self):
+        self.mox.StubOutWithMock(__builtin__, 'open')
+        __builtin__.open('/proc/user_beancounters', 'r').AndRaise(IOError)
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
-        openvz_conn.utils.execute('cat', '/proc/meminfo', run_as_root=True)\
-                                  .AndRaise(exception.ProcessExecutionError)
+        openvz_conn.utils.execute('cat', '/proc/user_beancounters',
+                                  run_as_root=True)\
+                                  .AndReturn((BEANCOUNTERS, ''))
         self.mox.ReplayAll()
         conn = openvz_conn.OpenVzConnection(False)
-        self.assertRaises(exception.Error, conn._get_memory)
+        self.assertEqual(BEANCOUNTERS,
+                         conn._read_proc('/proc/user_beancounters'))
+
+    def test_get_beancounters(self):
+        conn = openvz_conn.OpenVzConnection(False)
+        self.mox.StubOutWithMock(conn, '_read_proc')
+        conn._read_proc('/proc/user_beancounters').AndReturn(BEANCOUNTERS)
+        self.mox.ReplayAll()
+        beancounters = conn._get_beancounters()
+        self.assertEqual(['0', str(INSTANCE['id'])],
+                         sorted(beancounters.keys()))
+        self.assertEqual(262144, beancounters[str(INSTANCE['id'])]
+                                             ['vmguarpages']['barrier'])
+
+    def test_get_host_stats_is_cached(self):
+        conn = openvz_conn.OpenVzConnection(False)
+        self.mox.StubOutWithMock(conn, '_update_host_stats')
+        conn._update_host_stats().AndReturn({'host_memory_free': 1024})
+        conn._update_host_stats().AndReturn({'host_memory_free': 512})
+        self.mox.ReplayAll()
+        self.assertEqual(1024, conn.get_host_stats()['host_memory_free'])
+        self.assertEqual(1024, conn.get_host_stats()['host_memory_free'])
+        self.assertEqual(512,
+                         conn.get_host_stats(refresh=True)['host_memory_free'])
+
+    def test_update_host_stats(self):
+        conn = openvz_conn.OpenVzConnection(False)
+        conn.utility = {'CTIDS': {}, 'TOTAL': 0, 'UNITS': 100000,
+                        'MEMORY_MB': 0, 'CPULIMIT': 0}
+        self.mox.StubOutWithMock(conn, '_read_proc')
+        conn._read_proc('/proc/meminfo').AndReturn(MEMINFO)
+        conn._read_proc('/proc/cpuinfo').AndReturn('processor\t: 0\n'
+                                                   'processor\t: 1\n')
+        conn._read_proc('/proc/user_beancounters').AndReturn(BEANCOUNTERS)
+        self.mox.StubOutWithMock(conn, '_get_cpuunits_allocated')
+        conn._get_cpuunits_allocated().AndReturn({'1002': 25000})
+        self.mox.StubOutWithMock(openvz_conn.os, 'statvfs')
+        openvz_conn.os.statvfs(FLAGS.ovz_ve_private_dir)\
+                               .AndReturn(FakeStatvfs())
+        self.mox.ReplayAll()
+        stats = conn._update_host_stats()
+        self.assertEqual(494, stats['host_memory_total'])
+        self.assertEqual(1024, stats['host_memory_allocated'])
+        self.assertEqual(0, stats['host_memory_free'])
+        self.assertEqual(75000, stats['cpuunits_free'])
+        self.assertEqual(200, stats['cpulimit_total'])
+        self.assertEqual(100, stats['disk_total'])
+        self.assertEqual(40, stats['disk_available'])
+        self.assertEqual(1, stats['container_count'])
+
+    def _fake_fetch(self, data, checksum=None):
+        def fetch(context, image_ref, path, user, project):
+            image = open(path, 'wb')
+            image.write(data)
+            image.close()
+            return {'checksum': checksum or hashlib.md5(data).hexdigest()}
+        return fetch
+
+    def test_fetch_template_downloads_once(self):
+        template_dir = tempfile.mkdtemp()
+        try:
+            self.flags(ovz_image_template_dir=template_dir)
+            self.stubs.Set(openvz_conn.images, 'fetch',
+                           self._fake_fetch('template'))
+            conn = openvz_conn.OpenVzConnection(False)
+            self.assertTrue(conn._fetch_template(None, INSTANCE['image_ref']))
+            self.assertFalse(conn._fetch_template(None,
+                                                  INSTANCE['image_ref']))
+            self.assertEqual(['%s.tar.gz' % INSTANCE['image_ref']],
+                             os.listdir(template_dir))
+        finally:
+            shutil.rmtree(template_dir)
+
+    def test_fetch_template_bad_checksum(self):
+        template_dir = tempfile.mkdtemp()
+        try:
+            self.flags(ovz_image_template_dir=template_dir)
+            self.stubs.Set(openvz_conn.images, 'fetch',
+                           self._fake_fetch('template', checksum='bad'))
+            conn = openvz_conn.OpenVzConnection(False)
+            self.assertRaises(exception.ImageUnacceptable,
+                              conn._fetch_template,
+                              None, INSTANCE['image_ref'])
+            self.assertEqual([], os.listdir(template_dir))
+        finally:
+            shutil.rmtree(template_dir)
+
+    def test_evict_templates_keeps_leased(self):
+        template_dir = tempfile.mkdtemp()
+        try:
+            self.flags(ovz_image_template_dir=template_dir,
+                       ovz_template_cache_max_gb=4.0 / (1024 * 1024 * 1024))
+            for name, mtime in (('1', 300), ('2', 200), ('3', 100)):
+                path = os.path.join(template_dir, '%s.tar.gz' % name)
+                image = open(path, 'wb')
+                image.write('12345')
+                image.close()
+                os.utime(path, (mtime, mtime))
+            conn = openvz_conn.OpenVzConnection(False)
+            conn.template_leases = {2: 1}
+            self.assertEqual(['3', '1'], conn._evict_templates())
+            self.assertEqual(['2.tar.gz'], os.listdir(template_dir))
+        finally:
+            shutil.rmtree(template_dir)
+
+    def test_prewarm_images_continues_after_failure(self):
+        conn = openvz_conn.OpenVzConnection(False)
+        self.mox.StubOutWithMock(conn, '_fetch_template')
+        conn._fetch_template(None, '1').AndRaise(exception.Error)
+        conn._fetch_template(None, '2').AndReturn(True)
+        self.mox.ReplayAll()
+        self.assertEqual(['2'], conn.prewarm_images(None, ['1', '2']))
 
     def test_set_ioprio_success(self):
         self.mox.StubOutWithMock(openvz_conn.utils, 'execute')
@@ -24,6 +24,7 @@ from nova import quota
 from nova import test
 from nova import volume
 from nova.compute import instance_types
+from nova.db.sqlalchemy import models
 
 
 FLAGS = flags.FLAGS
@@ -195,6 +196,66 @@ class QuotaTestCase(test.TestCase):
         items = quota.allowed_metadata_items(self.context, 101)
         self.assertEqual(items, 101)
 
+    def _get_usage(self):
+        return db.quota_usage_get(self.context, self.project_id)
+
+    def test_usage_is_counted_the_first_time(self):
+        self._create_instance(cores=2)
+        self._create_volume(size=5)
+        usage = self._get_usage()
+        self.assertEqual(usage['instances'], 1)
+        self.assertEqual(usage['cores'], 2)
+        self.assertEqual(usage['volumes'], 1)
+        self.assertEqual(usage['gigabytes'], 5)
+
+    def test_usage_follows_instances(self):
+        self._get_usage()
+        instance_id = self._create_instance(cores=2)
+        self._create_instance(cores=1)
+        self.assertEqual(self._get_usage()['cores'], 3)
+
+        db.instance_update(self.context, instance_id,
+                           {'vcpus': 4, 'memory_mb': 512})
+        usage = self._get_usage()
+        self.assertEqual(usage['instances'], 2)
+        self.assertEqual(usage['cores'], 5)
+        self.assertEqual(usage['ram'], 512)
+
+        db.instance_destroy(self.context, instance_id)
+        db.instance_destroy(self.context, instance_id)
+        usage = self._get_usage()
+        self.assertEqual(usage['instances'], 1)
+        self.assertEqual(usage['cores'], 1)
+        self.assertEqual(usage['ram'], 0)
+
+    def test_usage_follows_volumes(self):
+        self._get_usage()
+        volume_id = self._create_volume(size=5)
+        db.volume_update(self.context, volume_id, {'size': 8})
+        usage = self._get_usage()
+        self.assertEqual(usage['volumes'], 1)
+        self.assertEqual(usage['gigabytes'], 8)
+
+        db.volume_destroy(self.context, volume_id)
+        usage = self._get_usage()
+        self.assertEqual(usage['volumes'], 0)
+        self.assertEqual(usage['gigabytes'], 0)
+
+    def test_reconcile_fixes_drifted_usage(self):
+        self._create_instance(cores=2)
+        self._get_usage()
+        instance_ref = models.Instance()
+        instance_ref.update({'project_id': self.project_id, 'vcpus': 1})
+        instance_ref.save()
+
+        self.assertEqual(self._get_usage()['instances'], 1)
+        drifted = db.quota_usage_reconcile(self.context)
+        self.assertEqual(drifted, [self.project_id])
+        usage = self._get_usage()
+        self.assertEqual(usage['instances'], 2)
+        self.assertEqual(usage['cores'], 3)
+        self.assertEqual(db.quota_usage_reconcile(self.context), [])
+
     def test_too_many_instances(self):
         instance_ids = []
         for i in range(FLAGS.quota_instances):
@@ -0,0 +1,75 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit Tests for the RPC message envelope
+"""
+
+from nova import context
+from nova import test
+from nova.rpc import codec
+from nova.rpc import impl_kombu
+
+
+class RpcCodecTestCase(test.TestCase):
+
+    def setUp(self):
+        super(RpcCodecTestCase, self).setUp()
+        self.body = {'method': 'list_databases',
+                     'args': {'names': ['db%d' % i for i in range(500)]}}
+        self.context = {'user_id': 'fake', 'project_id': 'fake'}
+
+    def test_small_json_body_is_inline(self):
+        envelope = codec.wrap(self.body, context=self.context)
+        self.assertTrue(codec.is_envelope(envelope))
+        self.assertEqual(None, envelope['encoding'])
+        self.assertEqual(self.body, envelope['body'])
+        self.assertEqual((self.body, self.context), codec.unwrap(envelope))
+
+    def test_large_body_is_compressed(self):
+        self.flags(rpc_compress_threshold=100)
+        envelope = codec.wrap(self.body, context=self.context)
+        self.assertEqual('zlib', envelope['encoding'])
+        self.assertTrue(len(envelope['body']) < len(str(self.body)))
+        self.assertEqual((self.body, self.context), codec.unwrap(envelope))
+
+    def test_plain_keys_stay_outside(self):
+        envelope = codec.wrap({'result': 1}, _msg_id='abc')
+        self.assertEqual('abc', envelope['_msg_id'])
+        self.assertEqual(({'result': 1}, None), codec.unwrap(envelope))
+
+    def test_plain_message_is_not_an_envelope(self):
+        self.assertFalse(codec.is_envelope({'method': 'echo'}))
+
+    def test_unknown_codec(self):
+        self.assertRaises(codec.UnknownCodec, codec.wrap, self.body,
+                          codec='no_such_codec')
+
+    @test.skip_unless(codec.msgpack is not None, "msgpack is not installed")
+    def test_msgpack_round_trip(self):
+        envelope = codec.wrap(self.body, codec='msgpack')
+        self.assertEqual('base64', envelope['encoding'])
+        self.assertEqual(self.body, codec.unwrap(envelope)[0])
+
+    def test_pack_message_envelopes_requests_only(self):
+        self.flags(rpc_envelope=True)
+        ctxt = context.get_admin_context()
+        request = impl_kombu._pack_message({'method': 'echo'}, ctxt)
+        self.assertTrue(codec.is_envelope(request))
+        self.assertEqual(ctxt.to_dict(), request['context'])
+        notification = impl_kombu._pack_message({'event_type': 'x'}, ctxt)
+        self.assertFalse(codec.is_envelope(notification))
+        self.assertEqual(ctxt.user_id, notification['_context_user_id'])
@@ -19,9 +19,14 @@
 Unit Tests for remote procedure calls shared between all implementations
 """
 
+import time
+
+import eventlet
+
 from nova import context
 from nova import log as logging
 from nova.rpc.common import RemoteError
+from nova.rpc.common import Timeout
 from nova import test
 
 
@@ -122,6 +127,18 @@ class _BaseRpcTestCase(test.TestCase):
         except RemoteError as exc:
             self.assertEqual(int(exc.value), value)
 
+    def test_call_timeout(self):
+        """Make sure a call without a reply in time raises Timeout."""
+        start = time.time()
+        self.assertRaises(Timeout,
+                          self.rpc.call,
+                          self.context,
+                          'test',
+                          {"method": "block",
+                           "args": {"value": 2}},
+                          timeout=0.2)
+        self.assertTrue(time.time() - start < 2)
+
     def test_nested_calls(self):
         """Test that we can do an rpc.call inside another call."""
         class Nested(object):
@@ -187,3 +204,9 @@ class TestReceiver(object):
     def fail(context, value):
         """Raises an exception with the value sent in."""
         raise Exception(value)
+
+    @staticmethod
+    def block(context, value):
+        """Waits value seconds before returning."""
+        eventlet.sleep(value)
+        return value
@@ -82,6 +82,89 @@ class RpcKombuTestCase(test_rpc_common._BaseRpcTestCase):
 
         self.assertEqual(self.received_message, message)
 
+    def test_calls_share_one_reply_queue(self):
+        """Test that calls declare no queue of their own."""
+        self.flags(rpc_reply_queue=True)
+        self.rpc.call(self.context, 'test', {"method": "echo",
+                                             "args": {"value": 1}})
+        declared = []
+        original = self.rpc.ConsumerBase.reconnect
+
+        def reconnect(consumer, channel):
+            declared.append(consumer.kwargs['name'])
+            original(consumer, channel)
+
+        self.stubs.Set(self.rpc.ConsumerBase, 'reconnect', reconnect)
+        for value in range(3):
+            result = self.rpc.call(self.context, 'test',
+                                   {"method": "echo",
+                                    "args": {"value": value}})
+            self.assertEqual(value, result)
+        self.assertEqual([], declared)
+
+    def test_late_reply_is_dropped(self):
+        """Test that a reply nobody waits for does not break later calls."""
+        self.flags(rpc_reply_queue=True)
+        reply_waiter = self.rpc._get_reply_waiter()
+        reply_waiter({'_msg_id': 'unknown', 'result': 1, 'failure': None})
+        self.assertEqual(2, self.rpc.call(self.context, 'test',
+                                          {"method": "echo",
+                                           "args": {"value": 2}}))
+
+    def test_call_without_reply_queue(self):
+        """Test the per call reply queue still works."""
+        self.flags(rpc_reply_queue=False)
+        self.assertEqual(3, self.rpc.call(self.context, 'test',
+                                          {"method": "echo",
+                                           "args": {"value": 3}}))
+
+    def _count_replies(self):
+        replies = []
+        original = self.rpc.msg_reply
+
+        def msg_reply(msg_id, *args, **kwargs):
+            replies.append(kwargs.get('results', args[:1]))
+            original(msg_id, *args, **kwargs)
+
+        self.stubs.Set(self.rpc, 'msg_reply', msg_reply)
+        return replies
+
+    def test_call_result_is_one_reply(self):
+        """Test a plain result and its end go out in one message."""
+        replies = self._count_replies()
+        result = self.rpc.call(self.context, 'test', {"method": "echo",
+                                                      "args": {"value": 4}})
+        self.assertEqual(4, result)
+        self.assertEqual(1, len(replies))
+
+    def test_generator_results_are_chunked(self):
+        """Test a generator's results are sent a chunk at a time."""
+        class Streamer(object):
+            @staticmethod
+            def count(context, value):
+                for i in xrange(value):
+                    yield i
+
+        self.flags(rpc_reply_chunk_size=10)
+        conn = self.rpc.create_connection(True)
+        conn.create_consumer('streamer', Streamer(), False)
+        conn.consume_in_thread()
+        replies = self._count_replies()
+        result = self.rpc.multicall(self.context, 'streamer',
+                                    {"method": "count",
+                                     "args": {"value": 25}})
+        self.assertEqual(range(25), list(result))
+        conn.close()
+        self.assertEqual([10, 10, 5], [len(reply) for reply in replies])
+
+    def test_enveloped_call(self):
+        """Test a compressed, enveloped call and reply."""
+        self.flags(rpc_envelope=True, rpc_compress_threshold=10)
+        value = ['x' * 10] * 10
+        result = self.rpc.call(self.context, 'test',
+                               {"method": "echo", "args": {"value": value}})
+        self.assertEqual(value, result)
+
     @test.skip_test("kombu memory transport seems buggy with fanout queues "
             "as this test passes when you use rabbit (fake_rabbit=False)")
     def test_fanout_send_receive(self):
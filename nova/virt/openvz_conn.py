@@ -22,8 +22,10 @@ is sketchy at best.
 
 import os
 import fnmatch
+import hashlib
 import socket
 import json
+import time
 from nova import db
 from nova import exception
 from nova import flags
@@ -112,6 +114,23 @@ flags.DEFINE_integer('ovz_kmemsize_barrier_differential',
 flags.DEFINE_bool('ovz_use_bind_mount',
                   False,
                   'Use bind mounting instead of simfs')
+flags.DEFINE_float('ovz_host_snapshot_ttl',
+                   1.0,
+                   'Seconds a vzlist snapshot of the host containers is '
+                   'reused before vzlist is run again')
+flags.DEFINE_float('ovz_template_cache_max_gb',
+                   0,
+                   'Size in GB the image templates in ovz_image_template_dir '
+                   'may use before the least recently used are removed, '
+                   '0 for no limit')
+flags.DEFINE_bool('ovz_template_verify_checksum',
+                  True,
+                  'Verify downloaded image templates against the checksum '
+                  'reported by the image service')
+flags.DEFINE_integer('ovz_host_stats_interval',
+                     60,
+                     'Seconds the host capacity stats are cached before '
+                     '/proc is read again')
 
 LOG = logging.getLogger('nova.virt.openvz')
 
@@ -134,6 +153,12 @@ class OpenVzConnection(driver.ComputeDriver):
             }
         self.read_only = read_only
         self.vif_driver = utils.import_object(FLAGS.ovz_vif_driver)
+        self.host_snapshot = None
+        self.host_snapshot_time = 0
+        self.spawn_timings = []
+        self.host_stats = None
+        self.host_stats_time = 0
+        self.template_leases = {}
         LOG.debug(_('__init__ complete in OpenVzConnection'))
 
     @classmethod
@@ -203,39 +228,77 @@ class OpenVzConnection(driver.ComputeDriver):
         This fascilitates the regular status polls that happen within the
         manager code.
 
-        I execute the command:
-
-        vzlist --all -o name -H
+        I read the containers from the host snapshot and join them against
+        a single query for the instances of this host, instead of running
+        get_info on each of them.
 
         If I fail to run an exception is raised because a failure to run is
         disruptive to the driver's ability to support the instances on
         the host through nova's interface.
         """
+        containers = self._get_host_snapshot()
+        ctxt = context.get_admin_context()
+        instances = dict((instance['id'], instance) for instance in
+                         db.instance_get_all_by_host(ctxt, FLAGS.host))
 
-        # TODO(imsplitbit): need to ask around if this is the best way to do
-        # this.  This causes some redundant vzlist commands as get_info is run
-        # on every item returned from this command but it didn't make sense
-        # to re-implement get_info as get_info_all.
         infos = []
+        for name, meta in containers.iteritems():
+            instance = instances.get(int(meta['id']))
+            if instance is None:
+                try:
+                    instance = db.instance_get(ctxt, meta['id'])
+                except exception.NotFound:
+                    LOG.error(_('Instance %s Not Found') % name)
+                    continue
+            state = self._power_state_from_meta(instance, meta)
+            infos.append(driver.InstanceInfo(name, state))
+
+        return infos
+
+    def _get_host_snapshot(self, refresh=False):
+        """
+        Return the containers of this host keyed by name, each a dict with
+        its 'id', 'name' and 'state'.
+
+        I run the command:
+
+        vzlist --all -H -o ctid,name,status
+
+        at most once every ovz_host_snapshot_ttl seconds, and again after
+        this driver changed a container.  If I fail to run an exception is
+        raised.
+        """
+        now = time.time()
+        if not refresh and self.host_snapshot is not None and \
+           now - self.host_snapshot_time < FLAGS.ovz_host_snapshot_ttl:
+            return self.host_snapshot
+
         try:
-            # get a list of CT names which will be nova friendly.
-            # NOTE: This can be an issue if nova decides to change
-            # the format of names.  We would need to have a migration process
-            # to change the names in the name field of the CTs.
-            out, err = utils.execute('vzlist', '--all', '-o',
-                                     'name', '-H', run_as_root=True)
+            out, err = utils.execute('vzlist', '--all', '-H', '-o',
+                                     'ctid,name,status', run_as_root=True)
             if err:
                 LOG.error(_('Stderr output from vzlist: %s') % err)
         except ProcessExecutionError as err:
             LOG.error(_('Stderr output from vzlist: %s') % err)
             raise exception.Error(_('Problem listing Vzs'))
 
-        for name in out.splitlines():
-            name = name.split()[0]
-            status = self.get_info(name)
-            infos.append(driver.InstanceInfo(name, status['state']))
-
-        return infos
+        containers = {}
+        for line in out.splitlines():
+            fields = line.split()
+            # Containers without a name can't be looked up by get_info.
+            if len(fields) < 3 or fields[1] == '-':
+                continue
+            containers[fields[1]] = {'id': fields[0],
+                                     'name': fields[1],
+                                     'state': fields[2]}
+
+        self.host_snapshot = containers
+        self.host_snapshot_time = now
+        return containers
+
+    def _invalidate_host_snapshot(self):
+        """Make the next lookup run vzlist again after a container changed."""
+        self.host_snapshot = None
 
     def spawn(self, context, instance, network_info=None,
               block_device_mapping=None):
@@ -264,25 +327,49 @@ class OpenVzConnection(driver.ComputeDriver):
         LOG.debug(_('instance %s: is building') % instance['name'])
 
         # Get current usages and resource availablity.
-        self._get_cpuunits_usage()
+        self.get_host_stats()
 
         # Go through the steps of creating a container
         # TODO(imsplitbit): Need to add conditionals around this stuff to make
         # it more durable during failure. And roll back changes made leading
         # up to the error.
-        self._cache_image(context, instance)
-        self._create_vz(instance)
-        self._set_vz_os_hint(instance)
-        self._configure_vz(instance)
-        self._set_name(instance)
-        self.plug_vifs(instance, network_info)
-        self._set_hostname(instance)
-        self._set_instance_size(instance)
-        self._attach_volumes(instance)
-        self._set_onboot(instance)
-        self._start(instance)
-        self._initial_secure_host(instance)
-        self._gratuitous_arp_all_addresses(instance, network_info)
+        timings = []
+        self._timed_phase(timings, 'cache_image', self._cache_image,
+                          context, instance)
+        try:
+            self._timed_phase(timings, 'create', self._create_vz, instance)
+        finally:
+            self._release_template(instance['image_ref'])
+        # The base config is applied on its own because it resets the
+        # resource limits that are set below.
+        self._timed_phase(timings, 'configure', self._configure_vz, instance)
+
+        # Everything else stored in the container config is collected and
+        # saved with a single vzctl set.
+        batch = OVZSetBatch(instance['id'])
+        self._set_vz_os_hint(instance, batch=batch)
+        self._set_name(instance, batch=batch)
+        self._set_hostname(instance, batch=batch)
+        self._set_instance_size(instance, batch=batch)
+        self._set_onboot(instance, batch=batch)
+        self._timed_phase(timings, 'set', batch.apply)
+        self._invalidate_host_snapshot()
+        self._invalidate_host_stats()
+
+        self._timed_phase(timings, 'plug_vifs', self.plug_vifs,
+                          instance, network_info)
+        self._timed_phase(timings, 'attach_volumes', self._attach_volumes,
+                          instance)
+        self._timed_phase(timings, 'start', self._start, instance)
+        self._timed_phase(timings, 'secure_host', self._initial_secure_host,
+                          instance)
+        self._timed_phase(timings, 'garp', self._gratuitous_arp_all_addresses,
+                          instance, network_info)
+        self.spawn_timings = timings
+        LOG.info(_('instance %(name)s: spawn phases took %(phases)s') %
+                 {'name': instance['name'],
+                  'phases': ', '.join(['%s=%.2fs' % phase
+                                       for phase in timings])})
 
         # Begin making our looping async call
         timer = utils.LoopingCall(f=None)
@@ -309,6 +396,17 @@ class OpenVzConnection(driver.ComputeDriver):
         timer.f = _wait_for_boot
         return timer.start(interval=0.5, now=True)
 
+    def _timed_phase(self, timings, phase, func, *args, **kwargs):
+        """
+        Run func and append how long it took, in seconds, to timings as a
+        (phase, seconds) tuple.  The time is recorded even if func raises.
+        """
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.append((phase, time.time() - start))
+
     def _create_vz(self, instance, ostemplate='ubuntu'):
         """
         Attempt to load the image from openvz's image cache, upon failure
@@ -345,7 +443,7 @@ class OpenVzConnection(driver.ComputeDriver):
                                   instance['id'])
         return True
 
-    def _set_vz_os_hint(self, instance, ostemplate='ubuntu'):
+    def _set_vz_os_hint(self, instance, ostemplate='ubuntu', batch=None):
         """
         I exist as a stopgap because currently there are no os hints
         in the image managment of nova.  There are ways of hacking it in
@@ -370,6 +468,10 @@ class OpenVzConnection(driver.ComputeDriver):
         # of resolver, hostname and the like
 
         # TODO(imsplitbit): change the ostemplate default value to a flag
+        if batch is not None:
+            batch.add('--ostemplate', ostemplate)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'],
                                      '--save', '--ostemplate', ostemplate,
@@ -389,25 +491,168 @@ class OpenVzConnection(driver.ComputeDriver):
         image library to pull the image down the distro image into the openvz
         template cache.  This is the method that openvz wants to operate
         properly.
+
+        The template is leased until _release_template is called so it is
+        not evicted while vzctl create reads it.
+        """
+        image_ref = instance['image_ref']
+        self.template_leases[image_ref] = \
+            self.template_leases.get(image_ref, 0) + 1
+        try:
+            return self._fetch_template(context, image_ref,
+                                        instance['user_id'],
+                                        instance['project_id'])
+        except Exception:
+            self._release_template(image_ref)
+            raise
+
+    def _release_template(self, image_ref):
+        """Drop a lease taken by _cache_image."""
+        leases = self.template_leases.get(image_ref, 0) - 1
+        if leases > 0:
+            self.template_leases[image_ref] = leases
+        else:
+            self.template_leases.pop(image_ref, None)
+
+    def _template_path(self, image_ref):
+        return '%s/%s.tar.gz' % (FLAGS.ovz_image_template_dir, image_ref)
+
+    def _fetch_template(self, context, image_ref, user_id=None,
+                        project_id=None):
         """
+        Make sure the template for image_ref is in the template cache,
+        returning True if it had to be downloaded.
 
-        image_name = '%s.tar.gz' % instance['image_ref']
-        full_image_path = '%s/%s' % (FLAGS.ovz_image_template_dir, image_name)
+        Only one download of an image runs at a time; other builds of the
+        same image wait for it and then use the cached copy.  The image is
+        written to a temporary file, checked against the checksum from the
+        image service and renamed into place, so vzctl never sees a partial
+        template.
+        """
+        full_image_path = self._template_path(image_ref)
+
+        @utils.synchronized('ovz-template-%s' % image_ref)
+        def fetch_if_not_exists():
+            if os.path.exists(full_image_path):
+                # Mark the template as recently used for eviction.
+                os.utime(full_image_path, None)
+                return False
 
-        if not os.path.exists(full_image_path):
             # These objects are required to retrieve images from the object
             # store. This is known only to work with glance so far but as I
             # understand it. glance's interface matches that of the other
             # object stores.
-            user = manager.AuthManager().get_user(instance['user_id'])
-            project = manager.AuthManager().get_project(instance['project_id'])
+            user = project = None
+            if user_id:
+                user = manager.AuthManager().get_user(user_id)
+            if project_id:
+                project = manager.AuthManager().get_project(project_id)
 
             # Grab image and place it in the image cache
-            images.fetch(context, instance['image_ref'], full_image_path, user,
-                         project)
+            part_path = '%s.part' % full_image_path
+            try:
+                metadata = images.fetch(context, image_ref, part_path, user,
+                                        project)
+                self._verify_template(image_ref, part_path, metadata)
+                os.rename(part_path, full_image_path)
+            except Exception:
+                if os.path.exists(part_path):
+                    os.unlink(part_path)
+                raise
+            LOG.debug(_('Cached template %s') % full_image_path)
             return True
-        else:
-            return False
+
+        fetched = fetch_if_not_exists()
+        if fetched:
+            self._evict_templates()
+        return fetched
+
+    def _verify_template(self, image_ref, path, metadata):
+        """
+        Compare the md5 of a downloaded template with the checksum the image
+        service reported for it.  An ImageUnacceptable is raised if they
+        differ.  Images without a checksum are accepted as they are.
+        """
+        checksum = (metadata or {}).get('checksum')
+        if not FLAGS.ovz_template_verify_checksum or not checksum:
+            return
+
+        md5 = hashlib.md5()
+        template = open(path, 'rb')
+        try:
+            for chunk in iter(lambda: template.read(1024 * 1024), ''):
+                md5.update(chunk)
+        finally:
+            template.close()
+
+        if md5.hexdigest() != checksum:
+            LOG.error(_('Checksum of template %(path)s is %(actual)s, '
+                        'expected %(expected)s') %
+                      {'path': path, 'actual': md5.hexdigest(),
+                       'expected': checksum})
+            raise exception.ImageUnacceptable(
+                image_id=image_ref,
+                reason=_('checksum of the downloaded template does not match'))
+
+    @utils.synchronized('ovz-template-cache')
+    def _evict_templates(self):
+        """
+        Remove the least recently used image templates until the cache fits
+        in ovz_template_cache_max_gb.  Only templates named after an image
+        id are considered, so the OS templates OpenVz keeps in the same
+        directory are left alone, and templates leased by a build are never
+        removed.
+        """
+        if FLAGS.ovz_template_cache_max_gb <= 0:
+            return []
+
+        templates = []
+        total = 0
+        for filename in os.listdir(FLAGS.ovz_image_template_dir):
+            path = os.path.join(FLAGS.ovz_image_template_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            image_ref = filename[:-len('.tar.gz')]
+            if filename.endswith('.tar.gz') and image_ref.isdigit():
+                templates.append((stat.st_mtime, stat.st_size, image_ref,
+                                  path))
+
+        limit = FLAGS.ovz_template_cache_max_gb * 1024 * 1024 * 1024
+        evicted = []
+        for _mtime, size, image_ref, path in sorted(templates):
+            if total <= limit:
+                break
+            if self.template_leases.get(image_ref) or \
+               self.template_leases.get(int(image_ref)):
+                continue
+            try:
+                os.unlink(path)
+            except OSError as err:
+                LOG.error(_('Cannot evict template %(path)s: %(err)s') %
+                          {'path': path, 'err': err})
+                continue
+            LOG.debug(_('Evicted template %s') % path)
+            total -= size
+            evicted.append(image_ref)
+        return evicted
+
+    def prewarm_images(self, context, image_refs):
+        """
+        Download the templates of the given images ahead of a burst of
+        builds.  A failure to fetch one image is logged and the rest are
+        still fetched.
+        """
+        fetched = []
+        for image_ref in image_refs:
+            try:
+                if self._fetch_template(context, image_ref):
+                    fetched.append(image_ref)
+            except Exception:
+                LOG.exception(_('Failed to pre-warm image %s') % image_ref)
+        return fetched
 
     def _configure_vz(self, instance, config='basic'):
         """
@@ -441,7 +686,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Failed to add %s to OpenVz')
                                   % instance['id'])
 
-    def _set_onboot(self, instance):
+    def _set_onboot(self, instance, batch=None):
         """
         Method to set the onboot status of the instance. This is done
         so that openvz does not handle booting, and instead the compute
@@ -453,6 +698,10 @@ class OpenVzConnection(driver.ComputeDriver):
         
         If I fail to run an exception is raised.
         """
+        if batch is not None:
+            batch.add('--onboot', 'no')
+            return
+
         try:
             # Set the onboot status for the vz
             out, err = utils.execute('vzctl', 'set', instance['id'],
@@ -491,6 +740,7 @@ class OpenVzConnection(driver.ComputeDriver):
         except ProcessExecutionError as err:
             LOG.error(_('Stderr output from vzctl: %s') % err)
             raise exception.Error(_('Failed to start %d') % instance['id'])
+        self._invalidate_host_snapshot()
 
         # Set instance state as RUNNING
         db.instance_update(context.get_admin_context(), instance['id'],
@@ -525,6 +775,7 @@ class OpenVzConnection(driver.ComputeDriver):
             else:
                 LOG.error(_('Stderr output from vzctl: %s') % err)
                 raise exception.Error(_('Failed to stop %s') % instance['id'])
+        self._invalidate_host_snapshot()
 
         # Update instance state
         try:
@@ -535,7 +786,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Failed to update db for %s')
                                   % instance['id'])
 
-    def _set_hostname(self, instance, hostname=False):
+    def _set_hostname(self, instance, hostname=False, batch=None):
         """
         I exist to set the hostname of a given container.  The option to pass
         a hostname to the method was added with the intention to allow the
@@ -556,6 +807,10 @@ class OpenVzConnection(driver.ComputeDriver):
         if not hostname:
             hostname = instance['hostname']
 
+        if batch is not None:
+            batch.add('--hostname', hostname)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'],
                                      '--save', '--hostname', hostname,
@@ -626,7 +881,7 @@ class OpenVzConnection(driver.ComputeDriver):
             LOG.error(_('Stderr output from vzctl: %s') % err)
             LOG.error(_('Failed arping through VE'))
 
-    def _set_name(self, instance):
+    def _set_name(self, instance, batch=None):
         """
         I exist to store the name of an instance in the name field for
         openvz.  This is done to facilitate the get_info method which only
@@ -639,6 +894,9 @@ class OpenVzConnection(driver.ComputeDriver):
         If I fail to run an exception is raised.  This is due to the
         requirement of the get_info method to have the name field filled out.
         """
+        if batch is not None:
+            batch.add('--name', instance['name'])
+            return
 
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'],
@@ -652,37 +910,27 @@ class OpenVzConnection(driver.ComputeDriver):
             LOG.error(_('Stderr output from vzctl: %s') % err)
             raise exception.Error(_('Unable to save metadata for %s') %
                                   instance['id'])
+        self._invalidate_host_snapshot()
 
     def _find_by_name(self, instance_name):
         """
         This method exists to facilitate get_info.  The get_info method only
         takes an instance name as it's argument.
 
-        I run the command:
+        I look the name up in the host snapshot.
 
-        vzlist -H --all --name <name>
-
-        If I fail to run an exception is raised because if I cannot locate an
-        instance by it's name then the driver will fail to work.
+        If I cannot locate an instance by it's name a NotFound is raised
+        because then the driver will fail to work.
         """
 
         # The required method get_info only accepts a name so we need a way
         # to correlate name and id without maintaining another state/meta db
         try:
-            out, err = utils.execute('vzlist', '-H', '--all', '--name',
-                                     instance_name, run_as_root=True)
-            LOG.debug(_('Stdout output from vzlist: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from vzlist: %s') % err)
-        except ProcessExecutionError as err:
-            LOG.error(_('Stderr output from vzlist: %s') % err)
+            return self._get_host_snapshot()[instance_name]
+        except (KeyError, exception.Error):
             raise exception.NotFound('Unable to load metadata for %s' %
                                   instance_name)
 
-        # Break the output into usable chunks
-        out = out.split()
-        return {'name': out[4], 'id': out[0], 'state': out[2]}
-
     def _access_control(self, instance, host, mask=32, port=None,
                         protocol='tcp', access_type='allow'):
         """
@@ -774,12 +1022,20 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.InstanceUnacceptable(
                 _("Instance size reset FAILED"))
 
-    def _set_instance_size(self, instance, instance_type_id = None):
+    def _set_instance_size(self, instance, instance_type_id=None,
+                           batch=None):
         """
         Given that these parameters make up and instance's 'size' we are
         bundling them together to make resizing an instance on the host
         an easier task.
+
+        The parameters are added to batch when one is given, otherwise they
+        are collected into a new batch and saved with a single vzctl set.
         """
+        apply_batch = batch is None
+        if apply_batch:
+            batch = OVZSetBatch(instance['id'])
+
         if not instance_type_id:
             instance_type = instance_types.get_instance_type(
                 instance['instance_type_id'])
@@ -792,21 +1048,25 @@ class OpenVzConnection(driver.ComputeDriver):
         percent_of_resource = self._percent_of_resource(
             instance_type['memory_mb'])
 
-        self._set_vmguarpages(instance, instance_memory_pages)
-        self._set_privvmpages(instance, instance_memory_pages)
-        self._set_kmemsize(instance, instance_memory_bytes)
+        self._set_vmguarpages(instance, instance_memory_pages, batch=batch)
+        self._set_privvmpages(instance, instance_memory_pages, batch=batch)
+        self._set_kmemsize(instance, instance_memory_bytes, batch=batch)
         if FLAGS.ovz_use_cpuunit:
-            self._set_cpuunits(instance, percent_of_resource)
+            self._set_cpuunits(instance, percent_of_resource, batch=batch)
         if FLAGS.ovz_use_cpulimit:
-            self._set_cpulimit(instance, percent_of_resource)
+            self._set_cpulimit(instance, percent_of_resource, batch=batch)
         if FLAGS.ovz_use_cpus:
-            self._set_cpus(instance, instance_type['vcpus'])
+            self._set_cpus(instance, instance_type['vcpus'], batch=batch)
         if FLAGS.ovz_use_ioprio:
-            self._set_ioprio(instance, percent_of_resource)
+            self._set_ioprio(instance, percent_of_resource, batch=batch)
         if FLAGS.ovz_use_disk_quotas:
-            self._set_diskspace(instance, instance_type)
+            self._set_diskspace(instance, instance_type, batch=batch)
+
+        if apply_batch and batch.apply():
+            LOG.debug(_('Set the size of %(id)s in %(duration).2fs') %
+                      {'id': instance['id'], 'duration': batch.duration})
 
-    def _set_vmguarpages(self, instance, num_pages):
+    def _set_vmguarpages(self, instance, num_pages, batch=None):
         """
         Set the vmguarpages attribute for a container.  This number represents
         the number of 4k blocks of memory that are guaranteed to the container.
@@ -819,6 +1079,10 @@ class OpenVzConnection(driver.ComputeDriver):
         If I fail to run then an exception is raised because this affects the
         memory allocation for the container.
         """
+        if batch is not None:
+            batch.add('--vmguarpages', num_pages)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'],
                                       '--save', '--vmguarpages', num_pages,
@@ -831,7 +1095,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Cannot set vmguarpages for %s') %
                                   instance['id'])
 
-    def _set_privvmpages(self, instance, num_pages):
+    def _set_privvmpages(self, instance, num_pages, batch=None):
         """
         Set the privvmpages attribute for a container.  This represents the
         memory allocation limit.  Think of this as a bursting limit.  For now
@@ -845,6 +1109,10 @@ class OpenVzConnection(driver.ComputeDriver):
         If I fail to run an exception is raised as this is essential for the
         running container to operate properly within it's memory constraints.
         """
+        if batch is not None:
+            batch.add('--privvmpages', num_pages)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
                                      '--privvmpages', num_pages,
@@ -857,7 +1125,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Cannot set privvmpages for %s') %
                                   instance['id'])
 
-    def _set_kmemsize(self, instance, instance_memory):
+    def _set_kmemsize(self, instance, instance_memory, batch=None):
         """
         Set the kmemsize attribute for a container.  This represents the
         amount of the container's memory allocation that will be made
@@ -880,6 +1148,10 @@ class OpenVzConnection(driver.ComputeDriver):
             float(FLAGS.ovz_kmemsize_barrier_differential) / 100.0))
         kmemsize = '%d:%d' % (kmem_barrier, kmem_limit)
 
+        if batch is not None:
+            batch.add('--kmemsize', kmemsize)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
                                      '--kmemsize',
@@ -893,7 +1165,7 @@ class OpenVzConnection(driver.ComputeDriver):
                 _('Error setting kmemsize to %(kmemsize)s on %(id)s') %
                 {'kmemsize': kmemsize, 'id': instance['id']})
 
-    def _set_cpuunits(self, instance, percent_of_resource):
+    def _set_cpuunits(self, instance, percent_of_resource, batch=None):
         """
         Set the cpuunits setting for the container.  This is an integer
         representing the number of cpu fair scheduling counters that the
@@ -918,6 +1190,10 @@ class OpenVzConnection(driver.ComputeDriver):
         if units > self.utility['UNITS']:
             units = self.utility['UNITS']
 
+        if batch is not None:
+            batch.add('--cpuunits', units)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
                                      '--cpuunits', units, run_as_root=True)
@@ -929,7 +1205,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Cannot set cpuunits for %s') %
                                   instance['id'])
 
-    def _set_cpulimit(self, instance, percent_of_resource):
+    def _set_cpulimit(self, instance, percent_of_resource, batch=None):
         """
         This is a number in % equal to the amount of cpu processing power
         the container gets.  NOTE: 100% is 1 logical cpu so if you have 12
@@ -953,6 +1229,10 @@ class OpenVzConnection(driver.ComputeDriver):
         if cpulimit > self.utility['CPULIMIT']:
             cpulimit = self.utility['CPULIMIT']
 
+        if batch is not None:
+            batch.add('--cpulimit', cpulimit)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
                                      '--cpulimit', cpulimit, run_as_root=True)
@@ -964,7 +1244,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Unable to set cpulimit for %s') %
                                   instance['id'])
 
-    def _set_cpus(self, instance, vcpus, multiplier=2):
+    def _set_cpus(self, instance, vcpus, multiplier=2, batch=None):
         """
         The number of logical cpus that are made available to the container.
         I default to showing 2 cpus to each container at a minimum.
@@ -983,6 +1263,10 @@ class OpenVzConnection(driver.ComputeDriver):
         if vcpus > (self.utility['CPULIMIT'] / 100):
             vcpus = self.utility['CPULIMIT'] / 100
 
+        if batch is not None:
+            batch.add('--cpus', vcpus)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
                                      '--cpus', vcpus, run_as_root=True)
@@ -994,7 +1278,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Unable to set cpus for %s') %
                                   instance['id'])
 
-    def _set_ioprio(self, instance, percent_of_resource):
+    def _set_ioprio(self, instance, percent_of_resource, batch=None):
         """
         Set the IO priority setting for a given container.  This is represented
         by an integer between 0 and 7.  If no priority is given one will be
@@ -1011,6 +1295,10 @@ class OpenVzConnection(driver.ComputeDriver):
         """
         ioprio = int(float(FLAGS.ovz_ioprio_limit) * percent_of_resource)
 
+        if batch is not None:
+            batch.add('--ioprio', ioprio)
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
                                      '--ioprio', ioprio, run_as_root=True)
@@ -1022,7 +1310,7 @@ class OpenVzConnection(driver.ComputeDriver):
             raise exception.Error(_('Unable to set IO priority for %s') %
                 instance['id'])
 
-    def _set_diskspace(self, instance, instance_type):
+    def _set_diskspace(self, instance, instance_type, batch=None):
         """
         Implement OpenVz disk quotas for local disk space usage.
         This method takes a soft and hard limit.  This is also the amount
@@ -1047,6 +1335,10 @@ class OpenVzConnection(driver.ComputeDriver):
         soft = '%s%s' % (soft, FLAGS.ovz_disk_space_increment)
         hard = '%s%s' % (hard, FLAGS.ovz_disk_space_increment)
 
+        if batch is not None:
+            batch.add('--diskspace', '%s:%s' % (soft, hard))
+            return
+
         try:
             out, err = utils.execute('vzctl', 'set', instance['id'], '--save',
                                      '--diskspace', '%s:%s' % (soft, hard),
@@ -1286,6 +1578,7 @@ class OpenVzConnection(driver.ComputeDriver):
                 LOG.debug(_('Attempting to destroy container'))
                 out, err = utils.execute('vzctl', 'destroy', instance['id'],
                                      run_as_root=True)
+                self._invalidate_host_snapshot()
                 LOG.debug(_('Stdout output from vzctl: %s') % out)
                 if err:
                     LOG.error(_('Stderr output from vzctl: %s') % err)
@@ -1317,6 +1610,7 @@ class OpenVzConnection(driver.ComputeDriver):
 
         self._clean_orphaned_files(instance['id'])
         self._clean_orphaned_directories(instance['id'])
+        self._invalidate_host_stats()
 
     def _attach_volumes(self, instance):
         """
@@ -1421,6 +1715,18 @@ class OpenVzConnection(driver.ComputeDriver):
             LOG.error(_('Instance %s Not Found') % instance_name)
             raise exception.NotFound('Instance %s Not Found' % instance_name)
 
+        # TODO(imsplitbit): Need to add all metrics to this dict.
+        return {'state': self._power_state_from_meta(instance, meta),
+                'max_mem': 0,
+                'mem': 0,
+                'num_cpu': 0,
+                'cpu_time': 0}
+
+    def _power_state_from_meta(self, instance, meta):
+        """
+        Return the power state of an instance given its container metadata
+        from the host snapshot.
+        """
         # Store the assumed state as the default
         state = instance['power_state']
 
@@ -1440,13 +1746,7 @@ class OpenVzConnection(driver.ComputeDriver):
                 state = power_state.NOSTATE
             else:
                 state = power_state.SHUTDOWN
-
-        # TODO(imsplitbit): Need to add all metrics to this dict.
-        return {'state': state,
-                'max_mem': 0,
-                'mem': 0,
-                'num_cpu': 0,
-                'cpu_time': 0}
+        return state
 
     def get_diagnostics(self, instance_name):
         pass
@@ -1579,9 +1879,185 @@ class OpenVzConnection(driver.ComputeDriver):
 
     def update_available_resource(self, ctxt, host):
         """
-        Added because now nova requires this method
+        Record the capacity of this host in its compute_nodes row, the same
+        way the libvirt driver does.  The values come from get_host_stats.
+        """
+        try:
+            service_ref = db.service_get_all_compute_by_host(ctxt, host)[0]
+        except exception.NotFound:
+            raise exception.ComputeServiceUnavailable(host=host)
+
+        stats = self.get_host_stats(refresh=True)
+        values = {'vcpus': stats['cpulimit_total'] / 100,
+                  'memory_mb': stats['host_memory_total'],
+                  'local_gb': stats['disk_total'],
+                  'vcpus_used': 0,
+                  'memory_mb_used': stats['host_memory_allocated'],
+                  'local_gb_used': stats['disk_used'],
+                  'hypervisor_type': stats['hypervisor_type'],
+                  'hypervisor_version': 0,
+                  'cpu_info': ''}
+
+        compute_node_ref = service_ref['compute_node']
+        if not compute_node_ref:
+            LOG.info(_('Compute_service record created for %s ') % host)
+            values['service_id'] = service_ref['id']
+            db.compute_node_create(ctxt, values)
+        else:
+            LOG.info(_('Compute_service record updated for %s ') % host)
+            db.compute_node_update(ctxt, compute_node_ref[0]['id'], values)
+
+    def get_host_stats(self, refresh=False):
         """
-        return
+        Return the capacity of this host as the capabilities the compute
+        manager reports to the schedulers.  The stats are read again when
+        refresh is True or when they are older than ovz_host_stats_interval.
+
+        Memory is in MB and disk in GB so they compare directly with an
+        instance type.  host_memory_free is what remains after the memory
+        guaranteed to the containers (vmguarpages) is taken out.
+        """
+        now = time.time()
+        if refresh or self.host_stats is None or \
+           now - self.host_stats_time >= FLAGS.ovz_host_stats_interval:
+            self.host_stats = self._update_host_stats()
+            self.host_stats_time = now
+        return self.host_stats
+
+    def _invalidate_host_stats(self):
+        """Make the next get_host_stats read /proc again."""
+        self.host_stats = None
+
+    def _update_host_stats(self):
+        """
+        Collect the host stats from /proc/meminfo, /proc/cpuinfo,
+        /proc/user_beancounters, the container configs and the filesystem
+        holding the containers, without running any OpenVz tools.
+        """
+        LOG.debug(_('Updating host stats'))
+        meminfo = self._get_memory()
+        self._get_cpulimit()
+        if not self.utility['UNITS']:
+            self._get_cpuunits_capability()
+
+        allocated_pages = 0
+        beancounters = self._get_beancounters()
+        for ctid, resources in beancounters.iteritems():
+            if ctid != '0' and 'vmguarpages' in resources:
+                allocated_pages += resources['vmguarpages']['barrier']
+        memory_allocated = allocated_pages / 256
+
+        ctids = self._get_cpuunits_allocated()
+        cpuunits_allocated = sum(ctids.values())
+        self.utility['CTIDS'] = ctids
+        self.utility['TOTAL'] = cpuunits_allocated
+
+        disk = os.statvfs(FLAGS.ovz_ve_private_dir)
+        gigabyte = 1024 * 1024 * 1024
+        disk_total = disk.f_frsize * disk.f_blocks / gigabyte
+        disk_available = disk.f_frsize * disk.f_bavail / gigabyte
+
+        memory_total = self.utility['MEMORY_MB']
+        memory_free = (meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) +
+                       meminfo.get('Cached', 0)) / 1024
+        return {'hypervisor_type': 'openvz',
+                'host_memory_total': memory_total,
+                'host_memory_allocated': memory_allocated,
+                'host_memory_free': max(memory_total - memory_allocated, 0),
+                'host_memory_free_computed': memory_free,
+                'cpuunits_total': self.utility['UNITS'],
+                'cpuunits_allocated': cpuunits_allocated,
+                'cpuunits_free': max(self.utility['UNITS'] -
+                                     cpuunits_allocated, 0),
+                'cpulimit_total': self.utility['CPULIMIT'],
+                'disk_total': disk_total,
+                'disk_used': disk_total - disk_available,
+                'disk_available': disk_available,
+                'container_count': len([ctid for ctid in beancounters
+                                        if ctid != '0'])}
+
+    def _read_proc(self, path):
+        """
+        Read a file under /proc directly.  Some of them, like
+        /proc/user_beancounters, are only readable by root so I fall back to:
+
+        cat <path>
+
+        run as root.  If that fails too an exception is raised.
+        """
+        try:
+            proc_file = open(path, 'r')
+            try:
+                return proc_file.read()
+            finally:
+                proc_file.close()
+        except IOError:
+            LOG.debug(_('Cannot read %s directly, using sudo') % path)
+
+        try:
+            out, err = utils.execute('cat', path, run_as_root=True)
+            if err:
+                LOG.error(_('Stderr output from cat: %s') % err)
+            return out
+        except ProcessExecutionError as err:
+            LOG.error(_('Stderr output from cat: %s') % err)
+            raise exception.Error(_('Cannot read %s') % path)
+
+    def _get_beancounters(self):
+        """
+        Parse /proc/user_beancounters into a dict keyed by ctid of dicts
+        keyed by resource, each holding held, maxheld, barrier, limit and
+        failcnt.
+        """
+        beancounters = {}
+        ctid = None
+        for line in self._read_proc('/proc/user_beancounters').splitlines():
+            fields = line.split()
+            if not fields or fields[0] in ('Version:', 'uid'):
+                continue
+            if fields[0].endswith(':'):
+                ctid = fields.pop(0)[:-1]
+                beancounters[ctid] = {}
+            if ctid is None or len(fields) != 6:
+                continue
+            try:
+                values = [int(field) for field in fields[1:]]
+            except ValueError:
+                continue
+            beancounters[ctid][fields[0]] = dict(zip(
+                ('held', 'maxheld', 'barrier', 'limit', 'failcnt'), values))
+        return beancounters
+
+    def _get_cpuunits_allocated(self):
+        """
+        Read the CPUUNITS setting of every container from its config file in
+        ovz_config_dir.  This is what vzcpucheck -v adds up, without the fork.
+        """
+        ctids = {}
+        try:
+            filenames = os.listdir(FLAGS.ovz_config_dir)
+        except OSError as err:
+            LOG.error(_('Cannot list %(dir)s: %(err)s') %
+                      {'dir': FLAGS.ovz_config_dir, 'err': err})
+            return ctids
+
+        for filename in filenames:
+            ctid, _sep, ext = filename.partition('.')
+            if ext != 'conf' or not ctid.isdigit() or ctid == '0':
+                continue
+            try:
+                conf = open(os.path.join(FLAGS.ovz_config_dir, filename), 'r')
+                try:
+                    for line in conf:
+                        if line.startswith('CPUUNITS='):
+                            value = line.split('=', 1)[1].strip().strip('"\'')
+                            ctids[ctid] = int(value)
+                finally:
+                    conf.close()
+            except (IOError, ValueError) as err:
+                LOG.error(_('Cannot read cpuunits of %(ctid)s: %(err)s') %
+                          {'ctid': ctid, 'err': err})
+        return ctids
 
     def _calc_pages(self, instance_memory_mb, block_size=4096):
         """
@@ -1619,30 +2095,27 @@ class OpenVzConnection(driver.ComputeDriver):
         Linux specific code but because OpenVz only runs on linux this really
         isn't a problem.
 
-        I run the command:
-
-        cat /proc/meminfo
+        I read /proc/meminfo and return its values in kB keyed by name.
 
-        If I fail to run an exception is raised as the returned value of this
-        method is required for all resource isolation to work correctly.
+        If I fail to read it an exception is raised as the returned value of
+        this method is required for all resource isolation to work correctly.
         """
         try:
-            out, err = utils.execute('cat', '/proc/meminfo', run_as_root=True)
-            LOG.debug(_('Stdout output from cat: %s') % out)
-            if err:
-                LOG.error(_('Stderr output from cat: %s') % err)
-            for line in out.splitlines():
-                line = line.split()
-                if line[0] == 'MemTotal:':
-                    LOG.debug(_('Total memory for host %s MB') % line[1])
-                    self.utility['MEMORY_MB'] = int(line[1]) / 1024
-            return True
-
-        except ProcessExecutionError as err:
+            out = self._read_proc('/proc/meminfo')
+        except exception.Error:
             LOG.error(_('Cannot get memory info for host'))
-            LOG.error(_('Stderr output from cat: %s') % err)
             raise exception.Error(_('Cannot get memory info for host'))
 
+        meminfo = {}
+        for line in out.splitlines():
+            line = line.split()
+            if len(line) > 1 and line[1].isdigit():
+                meminfo[line[0].rstrip(':')] = int(line[1])
+        if 'MemTotal' in meminfo:
+            LOG.debug(_('Total memory for host %s kB') % meminfo['MemTotal'])
+            self.utility['MEMORY_MB'] = meminfo['MemTotal'] / 1024
+        return meminfo
+
     def _get_cpulimit(self):
         """
         Fetch the total possible cpu processing limit in percentage to be
@@ -1651,34 +2124,27 @@ class OpenVzConnection(driver.ComputeDriver):
         processors then the total cpulimit for the host node will be
         2400.
 
-        I run the command:
-
-        cat /proc/cpuinfo
+        I read /proc/cpuinfo.
 
-        If I fail to run an exception is raised because the returned value
+        If I fail to read it an exception is raised because the returned value
         of this method is essential in calculating the number of cores
         available on the host to be carved up for the guests.
         """
         proc_count = 0
         try:
-            out, err = utils.execute('cat', '/proc/cpuinfo', run_as_root=True)
-            LOG.debug(_('Stdout output from cat %s') % out)
-            if err:
-                LOG.error(_('Stderr output from cat: %s') % err)
-
-            for line in out.splitlines():
-                line = line.split()
-                if len(line) > 0:
-                    if line[0] == 'processor':
-                        proc_count += 1
+            out = self._read_proc('/proc/cpuinfo')
+        except exception.Error:
+            LOG.error(_('Cannot get host node cpulimit'))
+            raise
 
-            self.utility['CPULIMIT'] = proc_count * 100
-            return True
+        for line in out.splitlines():
+            line = line.split()
+            if len(line) > 0:
+                if line[0] == 'processor':
+                    proc_count += 1
 
-        except ProcessExecutionError as err:
-            LOG.error(_('Cannot get host node cpulimit'))
-            LOG.error(_('Stderr output from cat: %s') % err)
-            raise exception.Error(err)
+        self.utility['CPULIMIT'] = proc_count * 100
+        return True
 
     def _get_cpuunits_capability(self):
         """
@@ -1743,6 +2209,69 @@ class OpenVzConnection(driver.ComputeDriver):
         except ProcessExecutionError as err:
             LOG.error(_('Stderr output from vzcpucheck: %s') % err)
 
+
+class OVZSetBatch(object):
+    """
+    I collect the parameters of several 'vzctl set' calls for one container
+    so they can be saved with a single command.  Every separate call is a
+    sudo fork and a rewrite of the container config, which adds up during
+    spawn and resize.
+    """
+
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+        self.options = []
+        self.duration = None
+
+    def add(self, option, value):
+        """
+        Add an option to the batch.  If the option was already added its
+        value is replaced so the command never carries it twice.
+        """
+        for index, (name, _value) in enumerate(self.options):
+            if name == option:
+                self.options[index] = (option, value)
+                return
+        self.options.append((option, value))
+
+    def args(self):
+        args = []
+        for option, value in self.options:
+            args.extend([option, value])
+        return args
+
+    def apply(self):
+        """
+        Save every collected option with one command:
+
+        vzctl set <ctid> --save <option> <value> [<option> <value> ...]
+
+        If I fail to run an exception is raised because the options usually
+        include the resource limits of the container.  I return False without
+        running anything when the batch is empty.
+        """
+        if not self.options:
+            return False
+
+        start = time.time()
+        try:
+            out, err = utils.execute('vzctl', 'set', self.instance_id,
+                                     '--save', *self.args(),
+                                     run_as_root=True)
+            LOG.debug(_('Stdout output from vzctl: %s') % out)
+            if err:
+                LOG.error(_('Stderr output from vzctl: %s') % err)
+        except ProcessExecutionError as err:
+            LOG.error(_('Stderr output from vzctl: %s') % err)
+            raise exception.Error(
+                _('Cannot set %(options)s for %(id)s') %
+                {'options': ', '.join([name for name, _v in self.options]),
+                 'id': self.instance_id})
+        finally:
+            self.duration = time.time() - start
+        return True
+
+
 class OVZFile(object):
     """
     This is a generic file class for wrapping up standard file operations that
@@ -60,6 +60,7 @@ reactor thread if the VM.get_by_name_label or VM.get_record calls block.
 import json
 import random
 import sys
+import time
 import urlparse
 import xmlrpclib
 
@@ -83,6 +84,7 @@ LOG = logging.getLogger("nova.virt.xenapi")
 
 
 FLAGS = flags.FLAGS
+flags.DECLARE('host_state_interval', 'nova.compute.manager')
 
 flags.DEFINE_string('xenapi_connection_url',
                     None,
@@ -471,13 +473,17 @@ class HostState(object):
         super(HostState, self).__init__()
         self._session = session
         self._stats = {}
+        self._stats_time = time.time()
         self.update_status()
 
     def get_host_stats(self, refresh=False):
         """Return the current state of the host. If 'refresh' is
-        True, run the update first.
+        True, or the state is older than host_state_interval, run the
+        update first.
         """
-        if refresh:
+        now = time.time()
+        if refresh or now - self._stats_time >= FLAGS.host_state_interval:
+            self._stats_time = now
             self.update_status()
         return self._stats
 
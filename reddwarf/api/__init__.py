@@ -133,6 +133,11 @@ class APIRouter(wsgi.Router):
                             controller=management.create_resource(),
                             action="root_enabled_history", conditions=dict(method=["GET"]))
 
+            mapper.connect("/{project_id}/mgmt/caches",
+                            controller=management.create_resource(),
+                            action="cache_stats",
+                            conditions=dict(method=["GET"]))
+
             mapper.connect("/{project_id}/mgmt/storage",
                             controller=storage.create_resource(),
                             action="index", conditions=dict(method=["GET"]))
@@ -16,7 +16,10 @@
 Common shared code across DBaaS API
 """
 
+import urllib
+
 from nova import exception as nova_exception
+from nova import flags
 from nova import log as logging
 from nova.compute import power_state
 from nova.db.sqlalchemy.api import is_admin_context
@@ -28,6 +31,7 @@ from reddwarf.guest.db import models
 
 XML_NS_V10 = 'http://docs.openstack.org/database/api/v1.0'
 LOG = logging.getLogger('reddwarf.api.common')
+FLAGS = flags.FLAGS
 
 dbaas_mapping = {
     None: 'BUILD',
@@ -98,6 +102,49 @@ def instance_available(ctxt, instance_id, local_id, compute_api):
         LOG.debug(msg)
         raise exception.UnprocessableEntity(msg)
 
+
+def get_pagination_params(req, max_limit=None):
+    """Return the limit and the local id of the marker of a request.
+
+    The marker is the uuid of the last instance the client has seen. If the
+    limit is not given, 0 or greater than max_limit, max_limit is used.
+    """
+    max_limit = max_limit or FLAGS.osapi_max_limit
+    try:
+        limit = int(req.GET.get('limit', max_limit))
+    except ValueError:
+        raise exception.BadRequest("limit param must be an integer")
+    if limit < 0:
+        raise exception.BadRequest("limit param must be positive")
+    limit = min(max_limit, limit or max_limit)
+
+    marker = req.GET.get('marker', None)
+    if marker is not None:
+        try:
+            marker = dbapi.localid_from_uuid(marker)
+        except exception.NotFound:
+            raise exception.BadRequest("marker [%s] not found" % marker)
+    return limit, marker
+
+
+def build_next_links(req, items, limit):
+    """Return the links to the page following the given items.
+
+    There is no next page unless the page holds more than limit items, so
+    callers fetch one extra item which is dropped from items here.
+    """
+    if len(items) <= limit:
+        return []
+    del items[limit:]
+    params = dict(req.GET.items())
+    params['limit'] = limit
+    params['marker'] = items[-1]['id']
+    # Fixup the url to make sure we return https
+    url = str(req.path_url).replace('http:', 'https:')
+    href = "%s?%s" % (url, urllib.urlencode(sorted(params.items())))
+    return [{'rel': 'next', 'href': href}]
+
+
 def verify_admin_context(f):
     """
     Verify that the current context has administrative access,
@@ -193,32 +193,34 @@ class Controller(object):
         """ Returns a list of instance names and ids for a given user """
         LOG.info("Call to Instances index")
         LOG.debug("%s - %s", req.environ, req.body)
-        servers_response = self.server_controller.index(req)
-        server_list = servers_response['servers']
         context = req.environ['nova.context']
-
-        # Instances need the status for each instance in all circumstances,
-        # unlike servers.
-        server_states = dbapi.instance_state_get_all_filtered(context)
-        for server in server_list:
-            state = server_states[server['id']]
-            server['status'] = nova_common.status_from_state(state)
-
-        id_list = [server['id'] for server in server_list]
-        status_lookup = InstanceStatusLookup(id_list)
-        instances = [self.view.build_index(server, req, status_lookup)
-                        for server in server_list]
-        return {'instances': instances}
+        limit, marker = common.get_pagination_params(req)
+        summaries = dbapi.instance_summary_get_all_filtered(context,
+                                                            limit + 1, marker)
+        instances = [self.view.build_index_from_summary(summary, req)
+                        for summary in summaries]
+        links = common.build_next_links(req, instances, limit)
+        return self._build_list_response(instances, links)
 
     def detail(self, req):
         """ Returns a list of instance details for a given user """
         LOG.debug("%s - %s", req.environ, req.body)
-        server_list = self.server_controller.detail(req)['servers']
-        id_list = [server['id'] for server in server_list]
-        status_lookup = InstanceStatusLookup(id_list)
-        instances = [self.view.build_detail(server, req, status_lookup)
-                        for server in server_list]
-        return {'instances': instances}
+        context = req.environ['nova.context']
+        limit, marker = common.get_pagination_params(req)
+        summaries = dbapi.instance_summary_get_all_filtered(context,
+                                                            limit + 1, marker)
+        instances = [self.view.build_detail_from_summary(summary, req)
+                        for summary in summaries]
+        links = common.build_next_links(req, instances, limit)
+        return self._build_list_response(instances, links)
+
+    @staticmethod
+    def _build_list_response(instances, links):
+        """Builds the response of a listing, adding the next page links"""
+        response = {'instances': instances}
+        if links:
+            response['links'] = links
+        return response
 
     def show(self, req, id):
         """ Returns instance details by instance id """
@@ -288,12 +290,16 @@ class Controller(object):
                                                     % id)
 
         self.server_controller.delete(req, instance_id)
+        dbapi.localid_cache_invalidate(id)
+        self.guest_api.forget_routing_key(instance_id)
         #TODO(rnirmal): Use a deferred here to update status
         dbapi.guest_status_delete(instance_id)
         return webob.Response(status_int=202)
 
     def create(self, req, body):
         """ Creates a new Instance for a given user """
+        if body and 'instances' in body:
+            return self._create_batch(req, body)
         self._validate(body)
 
         LOG.info("Create Instance")
@@ -328,6 +334,77 @@ class Controller(object):
         instance['volume'] = {'size': volume_ref['size']}
         return { 'instance': instance }
 
+    def _create_batch(self, req, body):
+        """Creates several instances that are placed on hosts together.
+
+        The scheduler either finds room for every instance in the request or
+        none of them are started, in which case their volumes are deleted.
+        """
+        self._validate_batch(body)
+
+        LOG.info("Create a batch of %d Instances" % len(body['instances']))
+        LOG.debug("%s - %s", req.environ, body)
+
+        context = req.environ['nova.context']
+        self._setup_security_groups(context,
+                                    FLAGS.default_firewall_rule_name,
+                                    FLAGS.default_guest_mysql_port)
+
+        volumes = []
+        servers = []
+        try:
+            for instance in body['instances']:
+                volume_ref = self.create_volume(context,
+                                                {'instance': instance})
+                volumes.append(volume_ref)
+                server = self._create_server_dict(
+                    instance, volume_ref['id'], FLAGS.reddwarf_mysql_data_dir)
+                flavor_id = nova_common.get_id_from_href(server['flavorRef'])
+                servers.append({
+                    'display_name': server['name'],
+                    'display_description': server['name'],
+                    'metadata': server['metadata'],
+                    'instance_type':
+                        instance_types.get_instance_type_by_flavor_id(
+                            flavor_id)})
+            image_href = server['imageRef']
+            security_groups = [FLAGS.default_firewall_rule_name]
+            created = self.compute_api.create_batch(context, None,
+                                            image_href, servers,
+                                            strategy=body.get('strategy'),
+                                            security_group=security_groups)
+        except nova_exception.FlavorNotFound:
+            self._delete_volumes(context, volumes)
+            raise exception.BadRequest("Invalid flavorRef provided.")
+        except exception.OutOfInstanceMemory:
+            self._delete_volumes(context, volumes)
+            raise exception.UnprocessableEntity("Not enough memory is left "
+                                                "to place all %d instances."
+                                                % len(body['instances']))
+        except quota.QuotaError as qe:
+            LOG.error(qe)
+            self._delete_volumes(context, volumes)
+            raise exception.OverLimit(str(qe))
+        except Exception:
+            self._delete_volumes(context, volumes)
+            raise
+
+        local_ids = [inst['id'] for inst in created]
+        for local_id in local_ids:
+            dbapi.guest_status_create(str(local_id))
+        status_lookup = InstanceStatusLookup(local_ids)
+        instances = []
+        for inst, server, volume_ref in zip(created, servers, volumes):
+            inst['instance_type'] = server['instance_type']
+            inst['image_ref'] = image_href
+            server_view = self.server_controller._build_view(req, inst,
+                                                             is_detail=True)
+            instance = self.view.build_single(server_view['server'], req,
+                                              status_lookup, create=True)
+            instance['volume'] = {'size': volume_ref['size']}
+            instances.append(instance)
+        return {'instances': instances}
+
     def create_volume(self, context, body):
         """Creates the volume for the instance and returns its ID."""
         volume_size = body['instance']['volume']['size']
@@ -339,6 +416,15 @@ class Controller(object):
                                       name=name,
                                       description=description)
 
+    def _delete_volumes(self, context, volumes):
+        """Deletes the volumes of instances that could not be created."""
+        for volume_ref in volumes:
+            try:
+                self.volume_api.delete(context, volume_ref['id'])
+            except Exception as e:
+                LOG.error("Could not delete volume %s: %s"
+                          % (volume_ref['id'], e))
+
     def _try_create_server(self, req, body):
         """Handle the call to create a server through the openstack servers api.
 
@@ -437,8 +523,10 @@ class Controller(object):
         root_enabled = None
         volume_info = None
         try:
-            root_enabled = self.guest_api.is_root_enabled(context, id)
-            volume_info = self.guest_api.get_volume_info(context, id)
+            summary = self.guest_api.get_summary(context, id,
+                                    fields=('root_enabled', 'volume_info'))
+            root_enabled = summary['root_enabled']
+            volume_info = summary['volume_info']
         except Exception as err:
             LOG.error(err)
             LOG.error("Guest not responding on instance %s" % id)
@@ -483,6 +571,23 @@ class Controller(object):
                                        "specified" % e)
         Controller._validate_volume_size(volume_size)
 
+    @staticmethod
+    def _validate_batch(body):
+        """Validate every instance in a batch create request"""
+        instances = body['instances']
+        if not isinstance(instances, list) or not instances:
+            raise exception.BadRequest("Required element/key - 'instances' "
+                                       "must be a non-empty list")
+        strategy = body.get('strategy')
+        if strategy is not None and strategy not in ('spread', 'pack'):
+            raise exception.BadRequest("The placement 'strategy' must be "
+                                       "either 'spread' or 'pack'.")
+        for instance in instances:
+            Controller._validate({'instance': instance})
+            if not instance.get('name'):
+                raise exception.BadRequest("Required element/key - 'name' "
+                                           "was not specified")
+
     @staticmethod
     def _validate_resize_instance(body):
         """ Validate that the resize body has the attributes for flavorRef """
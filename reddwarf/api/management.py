@@ -18,6 +18,7 @@ import webob
 from nova import exception as nova_exception
 from nova import flags
 from nova import log as logging
+from nova import utils
 
 from nova.api.openstack import servers
 from nova.api.openstack import wsgi
@@ -87,6 +88,12 @@ def create_resource(version='1.0'):
                 'root_enabled_history': ['id',
                                          'root_enabled_at',
                                          'root_enabled_by'],
+                'localid': ['hits',
+                            'misses',
+                            'evictions',
+                            'expired',
+                            'size',
+                            'max_size'],
             },
     }
 
@@ -132,17 +139,26 @@ class Controller(object):
         except nova_exception.InstanceNotFound:
             LOG.error("Could not find an instance with id %s" % id)
             raise exception.NotFound("No instance with id %s" % id)
+        self.guest_api.remember_routing_key(instance_ref)
 
         status_lookup = InstanceStatusLookup([instance_id])
         status = status_lookup.get_status_from_server(server)
 
-        # Lookup additional volume information
+        # Fetch the volume, database and user details from the guest at once
+        summary = None
         volume_info = None
-        try:
-            if status.is_sql_running:
-                volume_info = self.guest_api.get_volume_info(context, server['id'])
-        except exception.GuestError as err:
-            LOG.warn("Skipping Volume information as guest is not yet available")
+        if status.is_sql_running:
+            try:
+                summary = self.guest_api.get_summary(context, instance_id,
+                                fields=('volume_info', 'databases', 'users'))
+            except Exception as err:
+                msg = "Unable to retrieve information from the guest"
+                LOG.error(err)
+                raise exception.InstanceFault(msg)
+            volume_info = summary['volume_info']
+            if volume_info is None:
+                LOG.warn("Skipping Volume information as guest is not yet "
+                         "available")
 
         instance = self.instance_view.build_mgmt_single(server,
                                                         instance_ref,
@@ -151,7 +167,7 @@ class Controller(object):
                                                         volume_info)
         try:
             instance = self._get_guest_info(context, instance_id, status,
-                                            instance)
+                                            instance, summary)
 
         except Exception as err:
             msg = "Unable to retrieve information from the guest"
@@ -175,7 +191,9 @@ class Controller(object):
                 deleted = False
 
         context = req.environ['nova.context']
-        instances, flavors, ips = dbapi.instances_mgmt_index(context, deleted)
+        limit, marker = common.get_pagination_params(req)
+        instances = dbapi.instances_mgmt_index(context, deleted,
+                                               limit + 1, marker)
         result = []
         for instance in instances:
             details = {
@@ -186,50 +204,60 @@ class Controller(object):
                 'created_at': instance['created_at'],
                 'deleted_at': instance['deleted_at'],
                 'deleted': instance['deleted'],
+                'ips': instance['ips'],
+                'volumes': instance['volumes'],
             }
-            # Associate the flavor.
-            # TODO(ed-): Should probably make the relational database do all the data relating.
-            flavor = [f for f in flavors if f['id'] == instance['instance_type_id']]
-            if len(flavor) > 0:
-                flavor = flavor[0]
-                details['flavorid'] = flavor['flavorid']
-
-            # Now associate the IPs.
-            # TODO(ed-): A join would be preferable.
-            instance_ips = filter((lambda ip: ip['instance_id'] == instance['id']), ips)
-            details['ips'] = [{
-                'address': ip['address'],
-                'virtual_interface_id': ip['virtual_interface_id'],
-                } for ip in instance_ips]
-
-            # Associate storage
-            if instance['volumes']:
-                details['volumes'] = [{
-                    'size': volume['size'],
-                    'mountpoint': volume['mountpoint']
-                } for volume in instance['volumes']]
-            else:
-                details['volumes'] = []
-
+            if instance['flavorid'] is not None:
+                details['flavorid'] = instance['flavorid']
             result.append(details)
 
-        return {"instances": result}
-
-    def _get_guest_info(self, context, id, status, instance):
-        """Get all the guest details and add it to the response"""
+        links = common.build_next_links(req, result, limit)
+        if req.best_match_content_type() == 'application/json':
+            return self._stream_json_index(result, links)
+        response = {"instances": result}
+        if links:
+            response['links'] = links
+        return response
+
+    @staticmethod
+    def _stream_json_index(instances, links):
+        """Returns a response serializing the instances one at a time"""
+        def app_iter():
+            yield '{"instances": ['
+            for index, instance in enumerate(instances):
+                if index:
+                    yield ', '
+                yield utils.dumps(instance)
+            yield ']'
+            if links:
+                yield ', "links": %s' % utils.dumps(links)
+            yield '}'
+        return webob.Response(app_iter=app_iter(),
+                              content_type='application/json')
+
+    def _get_guest_info(self, context, id, status, instance, summary=None):
+        """Get all the guest details and add it to the response
+
+        Databases or users the guest failed to report in time are None.
+        """
         dbs = []
         users = []
         if status.is_sql_running:
-            db_list = self.guest_api.list_databases(context, id)
-
+            if summary is None:
+                summary = self.guest_api.get_summary(context, id,
+                                        fields=('databases', 'users'))
+            db_list = summary['databases']
             LOG.debug("DBS: %r" % db_list)
-            dbs = [{
-                    'name': db['_name'],
-                    'collate': db['_collate'],
-                    'character_set': db['_character_set']
-                    } for db in db_list]
-            users = self.guest_api.list_users(context, id)
-            users = [{'name': user['_name']} for user in users]
+            dbs = None
+            if db_list is not None:
+                dbs = [{
+                        'name': db['_name'],
+                        'collate': db['_collate'],
+                        'character_set': db['_character_set']
+                        } for db in db_list]
+            users = None
+            if summary['users'] is not None:
+                users = [{'name': user['_name']} for user in summary['users']]
 
         root_access = dbapi.get_root_enabled_history(context, id)
 
@@ -255,6 +283,13 @@ class Controller(object):
             LOG.error(err)
             raise exception.InstanceFault("Error determining root access history")
 
+    @common.verify_admin_context
+    def cache_stats(self, req):
+        """ Returns the counters of the caches kept by this API server. """
+        LOG.info("Get the cache stats")
+        LOG.debug("%s - %s", req.environ, req.body)
+        return {'caches': {'localid': dbapi.localid_cache_stats()}}
+
     @common.verify_admin_context
     def action(self, req, id, body):
         """Multi-purpose method used to take actions on an instance."""
@@ -61,6 +61,19 @@ class InstanceStatus(object):
         lookup = InstanceStatusLookup([local_id])
         return lookup.get_status_from_id(context, local_id)
 
+    @staticmethod
+    def from_summary(summary):
+        """Creates an InstanceStatus from a compact instance summary row.
+
+        The rows come from dbapi.instance_summary_get_all_filtered, which
+        already carries the guest state, so no further lookup is needed.
+
+        """
+        server_status = common.status_from_state(summary['vm_state'],
+                                                 summary['power_state'])
+        return InstanceStatus(guest_state=summary['guest_state'],
+                              server_status=server_status)
+
     @property
     def is_sql_running(self):
         responsive = [
@@ -16,12 +16,14 @@ import os
 
 
 from nova import log as logging
+from nova import utils
 from nova.api.openstack import common as nova_common
 from nova.compute import power_state
 from nova.exception import InstanceNotFound
 from nova.notifier import api as notifier
 
 from reddwarf.api import common
+from reddwarf.api.status import InstanceStatus
 from reddwarf.api.views import flavors
 
 
@@ -69,6 +71,28 @@ class ViewBuilder(object):
             instance['volume'] = dbvolume
         return instance
 
+    def _build_basic_from_summary(self, summary, req):
+        """Build the very basic information from an instance summary"""
+        instance = {}
+        instance['id'] = summary['uuid']
+        instance['name'] = summary['name']
+        instance['status'] = InstanceStatus.from_summary(summary).status
+        instance['links'] = self._build_links(req, instance)
+        return instance
+
+    def _build_detail_from_summary(self, summary, req, instance):
+        """Build out a more detailed view from an instance summary"""
+        if summary['flavorid'] is not None:
+            flavor_view = flavors.ViewBuilder(_base_url(req), _project_id(req))
+            instance['flavor'] = {'id': str(summary['flavorid'])}
+            instance['flavor']['links'] = \
+                flavor_view._build_links(instance['flavor'])
+        instance['created'] = utils.isotime(summary['created_at'])
+        instance['updated'] = utils.isotime(summary['updated_at'])
+        if summary['volume_size'] is not None:
+            instance['volume'] = {'size': summary['volume_size']}
+        return instance
+
     @staticmethod
     def _build_links(req, instance):
         """Build the links for the instance"""
@@ -102,6 +126,16 @@ class ViewBuilder(object):
         instance = self._build_detail(server, req, instance)
         return instance
 
+    def build_index_from_summary(self, summary, req):
+        """Build the response for an instance index call from a summary"""
+        return self._build_basic_from_summary(summary, req)
+
+    def build_detail_from_summary(self, summary, req):
+        """Build the response for an instance detail call from a summary"""
+        instance = self._build_basic_from_summary(summary, req)
+        instance = self._build_detail_from_summary(summary, req, instance)
+        return instance
+
     def build_single(self, server, req, status_lookup, create=False,
                      root_enabled=False, volume_info=None):
         """
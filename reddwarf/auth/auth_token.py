@@ -43,10 +43,13 @@ HTTP_X_AUTHORIZATION: the client identity being passed in
 """
 
 import base64
+import hashlib
 import json
+import socket
+import time
 
-from beaker.cache import CacheManager
 from datetime import datetime
+from eventlet import event
 from eventlet import wsgi
 from eventlet.green import httplib
 from paste.deploy import loadapp
@@ -56,15 +59,130 @@ from nova import flags
 from nova.api.openstack import faults
 
 from reddwarf import exception
+from reddwarf import utils
 
 FLAGS = flags.FLAGS
 flags.DEFINE_integer('reddwarf_auth_cache_expire_time', 60*5,
                      'Time in seconds for the cache to expire user tokens')
+flags.DEFINE_integer('reddwarf_auth_negative_cache_expire_time', 30,
+                     'Time in seconds for the cache to remember tokens the '
+                     'auth service rejected')
+flags.DEFINE_integer('reddwarf_auth_cache_max_size', 10000,
+                     'Maximum number of tokens kept in the in-process cache')
+flags.DEFINE_integer('reddwarf_auth_pool_size', 10,
+                     'Maximum number of idle connections kept open to the '
+                     'auth service')
+flags.DEFINE_integer('reddwarf_auth_stats_interval', 5 * 60,
+                     'Seconds between logging the token cache and validation '
+                     'statistics')
 
 LOG = logging.getLogger(__name__)
 
 PROTOCOL_NAME = "Token Authentication"
 
+# Responses from the auth service that mean the token itself is bad, as
+# opposed to the auth service failing, and so are worth remembering.
+REJECTED_STATUSES = (401, 403, 404)
+
+
+class TokenCache(utils.LRUCache):
+    """A bounded in-process cache of token validation results."""
+
+    def set_value(self, key, value, expiretime=None):
+        """Caches value under key for expiretime seconds."""
+        if expiretime is None:
+            expiretime = FLAGS.reddwarf_auth_cache_expire_time
+        self.set(key, value, ttl=expiretime)
+
+
+# The in-process cache is shared by every AuthProtocol in the process, the
+# way the named beaker cache used to be.
+_MEMORY_CACHE = None
+
+
+def get_memory_cache():
+    """Returns the token cache shared by this process."""
+    global _MEMORY_CACHE
+    if _MEMORY_CACHE is None:
+        _MEMORY_CACHE = TokenCache(FLAGS.reddwarf_auth_cache_max_size)
+    return _MEMORY_CACHE
+
+
+class MemcachedTokenCache(object):
+    """Token validation results shared by all API workers via memcached."""
+
+    def __init__(self, servers):
+        if servers:
+            import memcache
+        else:
+            from nova import fakememcache as memcache
+        self.client = memcache.Client(servers, debug=0)
+
+    @staticmethod
+    def _key(key):
+        # Tokens and tenants may hold characters memcached keys cannot.
+        return "reddwarf-auth-%s" % hashlib.md5(key).hexdigest()
+
+    def get(self, key):
+        """Returns the cached value for key, or None."""
+        value = self.client.get(self._key(key))
+        if value is None:
+            return None
+        data, status = json.loads(value)
+        return data, status
+
+    def set_value(self, key, value, expiretime=None):
+        """Caches value under key for expiretime seconds."""
+        if expiretime is None:
+            expiretime = FLAGS.reddwarf_auth_cache_expire_time
+        self.client.set(self._key(key), json.dumps(value), time=expiretime)
+
+
+class ConnectionPool(object):
+    """Keeps keep-alive connections to the auth service open for reuse."""
+
+    def __init__(self, protocol, host, port, max_idle):
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.idle = []
+        self.created = 0
+
+    def _connect(self):
+        self.created += 1
+        return get_connection(self.protocol, self.host, self.port)
+
+    def request(self, method, path, body=None, headers=None):
+        """Sends a request, returning the response status and body.
+
+        A pooled connection the auth service has since closed fails on first
+        use, so the request is retried once on a new connection.
+        """
+        headers = headers or {}
+        while True:
+            reused = bool(self.idle)
+            conn = self.idle.pop() if reused else self._connect()
+            try:
+                conn.request(method, path, body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            if response.will_close or len(self.idle) >= self.max_idle:
+                conn.close()
+            else:
+                self.idle.append(conn)
+            return response.status, data
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+
 class AuthProtocol(object):
     """Auth Middleware that handles authenticating client calls"""
 
@@ -100,6 +218,10 @@ class AuthProtocol(object):
             self.service_auth_path = "/v2.0/tokens"
             self._expound_claims = self._expound_claims_2_0
 
+        self.pool = ConnectionPool(self.auth_protocol, self.auth_host,
+                                   self.auth_port,
+                                   FLAGS.reddwarf_auth_pool_size)
+
         # Credentials used to verify this component with the Auth service since
         # validating tokens is a privileged call
         service_user = conf.get('service_user')
@@ -109,10 +231,28 @@ class AuthProtocol(object):
         self.basic_auth = base64.b64encode("%(service_user)s:%(service_pass)s"
                                            % locals())
 
-        # Create cache manager
+        # Create the token cache, either in process or shared via memcached
         self.cache_type = conf.get('cache_type', 'memory')
-        cm = CacheManager(type=self.cache_type)
-        self.cache = cm.get_cache('dbaas')
+        if self.cache_type == 'memcached':
+            self.cache = MemcachedTokenCache(FLAGS.memcached_servers)
+        else:
+            self.cache = get_memory_cache()
+
+        # Validations in progress, so concurrent requests presenting the same
+        # token wait for one call to the auth service instead of each making
+        # their own.
+        self.in_flight = {}
+        self.stats = {
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'rejections_cached': 0,
+            'validations': 0,
+            'validations_coalesced': 0,
+            'validation_errors': 0,
+            'validation_seconds': 0.0,
+            'validation_seconds_max': 0.0,
+        }
+        self.stats_logged = time.time()
 
     def __call__(self, env, start_response):
         """ Handle incoming request. Authenticate. And send downstream. """
@@ -133,35 +273,27 @@ class AuthProtocol(object):
         cache_key = "%s/%s" % (claims,tenant)
 
         # this request is presenting claims. Let's validate them
-        #TODO(cp16net) what happens with 1000s of users being cached?
-        if self.cache.has_key(cache_key):
-            # get the cached values
-            data, status = self.cache.get_value(cache_key)
-            valid = self._validate_status(status)
-
-            if not valid:
-                # Keystone rejected claim
-                return self._reject_claims(env, start_response)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            data, status = cached
         else:
-            # need to get the values and then cache them if valid
+            self.stats['cache_misses'] += 1
             try:
-                data, status = self._validate_token(claims, tenant)
+                data, status = self._coalesced_validate(claims, tenant,
+                                                        cache_key)
             except :
                 msg = ("Authorization Service is not available at this "
                        "time for (tenant=%s)." % tenant)
                 LOG.error(msg)
                 return faults.Fault(exception.ServiceUnavailable(msg)) \
                                     (env, start_response)
+        self._log_stats()
 
-            valid = self._validate_status(status)
-            if not valid:
-                # rejected claim because claims are not valid
-                return self._reject_claims(env, start_response)
-            else:
-                # claim is valid so cache the result from validation
-                cache_key = "%s/%s" % (claims,tenant)
-                self.cache.set_value(cache_key, (data, status),
-                                     expiretime=FLAGS.reddwarf_auth_cache_expire_time)
+        valid = self._validate_status(status)
+        if not valid:
+            # Keystone rejected claim
+            return self._reject_claims(env, start_response)
 
         self._decorate_request("X_IDENTITY_STATUS", "Confirmed", env,
                                proxy_headers)
@@ -175,6 +307,66 @@ class AuthProtocol(object):
 
         return self.app(env, start_response)
 
+    def _coalesced_validate(self, claims, tenant, cache_key):
+        """Validate the claims once for all requests presenting them.
+
+        The result is cached: accepted tokens for the cache expire time and
+        tokens the auth service rejected for the shorter negative expire time.
+        """
+        waiter = self.in_flight.get(cache_key)
+        if waiter is not None:
+            self.stats['validations_coalesced'] += 1
+            return waiter.wait()
+
+        waiter = self.in_flight[cache_key] = event.Event()
+        try:
+            start = time.time()
+            try:
+                data, status = self._validate_token(claims, tenant)
+            finally:
+                elapsed = time.time() - start
+                self.stats['validations'] += 1
+                self.stats['validation_seconds'] += elapsed
+                self.stats['validation_seconds_max'] = max(
+                    elapsed, self.stats['validation_seconds_max'])
+            if self._validate_status(status):
+                expiretime = FLAGS.reddwarf_auth_cache_expire_time
+                self.cache.set_value(cache_key, (data, status),
+                                     expiretime=expiretime)
+            elif status in REJECTED_STATUSES:
+                self.stats['rejections_cached'] += 1
+                expiretime = FLAGS.reddwarf_auth_negative_cache_expire_time
+                self.cache.set_value(cache_key, (data, status),
+                                     expiretime=expiretime)
+        except Exception as e:
+            self.stats['validation_errors'] += 1
+            waiter.send_exception(e)
+            raise
+        else:
+            waiter.send((data, status))
+            return data, status
+        finally:
+            del self.in_flight[cache_key]
+
+    def get_stats(self):
+        """Returns the token cache and validation counters."""
+        stats = dict(self.stats)
+        lookups = stats['cache_hits'] + stats['cache_misses']
+        stats['cache_hit_rate'] = (float(stats['cache_hits']) / lookups
+                                   if lookups else 0.0)
+        stats['validation_seconds_avg'] = (
+            stats['validation_seconds'] / stats['validations']
+            if stats['validations'] else 0.0)
+        stats['connections_created'] = self.pool.created
+        return stats
+
+    def _log_stats(self):
+        now = time.time()
+        if now - self.stats_logged < FLAGS.reddwarf_auth_stats_interval:
+            return
+        self.stats_logged = now
+        LOG.info("Token auth stats: %s" % self.get_stats())
+
     def _retrieve_tenant(self, env):
         # Retrieve the tenant/accountid from the url
         path_info = env.get('PATH_INFO', '/')
@@ -207,15 +399,12 @@ class AuthProtocol(object):
                    'Accept': 'application/json'}
         request_body = {'passwordCredentials': {'username': username,
                                                 'password': password}}
-        conn = get_connection(self.auth_protocol, self.auth_host,
-                              self.auth_port)
-        conn.request("POST", self.service_auth_path, json.dumps(request_body),
-                     headers=headers)
-        response = conn.getresponse()
-        data = response.read()
+        status, data = self.pool.request("POST", self.service_auth_path,
+                                         json.dumps(request_body),
+                                         headers=headers)
         try:
-            if not data or not self._validate_status(response.status):
-                if response.status == 302:
+            if not data or not self._validate_status(status):
+                if status == 302:
                     # Can be ignored because the service relies on basic auth
                     return ""
                 msg = "Error authenticating service with user(%s)" % username
@@ -250,15 +439,11 @@ class AuthProtocol(object):
                    'X-Auth-Token': self.admin_token,
                    'Authorization': 'Basic %s' % self.basic_auth}
 
-        conn = get_connection(self.auth_protocol, self.auth_host,
-                              self.auth_port)
-        conn.request("GET", "%s/%s?belongsTo=%s&type=%s" %
-                     (self.validate_token_path, claims, tenant, self.auth_type),
-                     headers=headers)
-        response = conn.getresponse()
-        data = response.read()
-        conn.close()
-        return data, response.status
+        status, data = self.pool.request("GET", "%s/%s?belongsTo=%s&type=%s" %
+                                         (self.validate_token_path, claims,
+                                          tenant, self.auth_type),
+                                         headers=headers)
+        return data, status
 
     def _validate_status(self, status):
         """Check status is in list of OK http statuses"""
@@ -12,11 +12,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import sys
+
 from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import rpc
 from nova import context
+from nova import utils
+from nova.rpc.common import RemoteError
 from nova.compute import api as nova_compute_api
 from nova.compute import instance_types
 from nova.compute import task_states
@@ -24,6 +28,7 @@ from nova.compute import vm_states
 from nova.scheduler import api as scheduler_api
 from reddwarf import exception as reddwarf_exception
 from reddwarf.db import api as dbapi
+from reddwarf.guest import api as guest_api
 
 
 FLAGS = flags.FLAGS
@@ -36,6 +41,79 @@ class API(nova_compute_api.API):
 
     def __init__(self, *args, **kwargs):
         super(API, self).__init__(*args, **kwargs)
+        self.guest_api = guest_api.API()
+
+    def create_batch(self, context, instance_type, image_href, servers,
+                     strategy=None, security_group='default',
+                     block_device_mapping=None, **kwargs):
+        """Creates instances that the scheduler places in a single pass.
+
+        Each dict in servers holds the arguments of one instance, such as its
+        display_name, metadata or its own instance_type, while the keyword
+        arguments are shared by all of them.  The scheduler reserves memory
+        for the whole batch or fails it, and the instance dicts are returned
+        with their hosts.  The instance rows of a failed batch are deleted.
+
+        """
+        block_device_mapping = block_device_mapping or []
+        instances = []
+        LOG.debug(_("Going to run a batch of %s instances..."), len(servers))
+        try:
+            for num, server in enumerate(servers):
+                options = dict(kwargs, **server)
+                inst_type = options.pop('instance_type', instance_type)
+                _count, base_options, image = self._check_create_parameters(
+                                       context, inst_type, image_href,
+                                       security_group=security_group,
+                                       **options)
+                instance = self.create_db_entry_for_new_instance(context,
+                                        inst_type, image,
+                                        base_options, security_group,
+                                        block_device_mapping, num=num)
+                instances.append(dict(instance.iteritems()))
+
+            instance_ids = [instance['id'] for instance in instances]
+            hosts = rpc.call(context, FLAGS.scheduler_topic,
+                             {"method": "run_instances",
+                              "args": {"topic": FLAGS.compute_topic,
+                                       "instance_ids": instance_ids,
+                                       "strategy": strategy,
+                                       "availability_zone":
+                                            kwargs.get('availability_zone'),
+                                       "admin_password":
+                                            kwargs.get('admin_password'),
+                                       "injected_files":
+                                            kwargs.get('injected_files'),
+                                       "requested_networks":
+                                            kwargs.get('requested_networks')}})
+        except RemoteError as e:
+            exc_info = sys.exc_info()
+            self._destroy_batch(context, instances)
+            if e.exc_type in ('OutOfInstanceMemory', 'NoValidHost'):
+                memory_mb = sum(instance['memory_mb']
+                                for instance in instances)
+                raise reddwarf_exception.OutOfInstanceMemory(
+                    instance_memory_mb=memory_mb)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        except Exception:
+            with utils.save_and_reraise_exception():
+                self._destroy_batch(context, instances)
+        for instance, host in zip(instances, hosts):
+            instance['host'] = host
+        return instances
+
+    def _destroy_batch(self, context, instances):
+        """Deletes the instance rows of a batch that was not started."""
+        for instance in instances:
+            LOG.debug(_("Deleting instance %s of a failed batch."),
+                      instance['id'])
+            self.db.instance_destroy(context, instance['id'])
+
+    def update(self, context, instance_id, **kwargs):
+        """Updates the instance, dropping its guest routing key if renamed."""
+        if 'hostname' in kwargs:
+            self.guest_api.forget_routing_key(instance_id)
+        return super(API, self).update(context, instance_id, **kwargs)
 
     @scheduler_api.reroute_compute("resize_in_place")
     def resize_in_place(self, ctxt, instance_id, new_instance_type_id):
@@ -53,14 +131,42 @@ class API(nova_compute_api.API):
             raise exception.CannotResizeToSameSize()
         host = instance_ref['host']
         admin_ctxt = context.get_admin_context()
-        host_mem_used = dbapi.instance_get_memory_sum_by_host(admin_ctxt, host)
-        if host_mem_used + diff_size > FLAGS.max_instance_memory_mb:
-            raise reddwarf_exception.OutOfInstanceMemory()
+        reservation = self._reserve_memory(admin_ctxt, host, diff_size)
+        if reservation is False:
+            host_mem_used = dbapi.instance_get_memory_sum_by_host(admin_ctxt,
+                                                                  host)
+            if host_mem_used + diff_size > FLAGS.max_instance_memory_mb:
+                raise reddwarf_exception.OutOfInstanceMemory(
+                    instance_memory_mb=new_size)
+            reservation = None
         self.update(ctxt, instance_id, vm_state=vm_states.RESIZING)
-        params={'new_instance_type_id': new_instance_type_id}
+        params = {'new_instance_type_id': new_instance_type_id,
+                  'reservation': reservation}
         self._cast_compute_message("resize_in_place", ctxt, instance_id,
                                    params=params)
 
+    def _reserve_memory(self, ctxt, host, memory_mb):
+        """Reserves memory for a resize in the scheduler's capacity ledger.
+
+        Returns the reservation, which the compute host releases once the
+        resize is over, or None if no memory has to be reserved. Returns
+        False if the scheduler does not keep a ledger, in which case the
+        caller has to check the host's memory itself.
+
+        """
+        if memory_mb <= 0:
+            return None
+        try:
+            return rpc.call(ctxt, FLAGS.scheduler_topic,
+                            {'method': 'reserve_memory',
+                             'args': {'host': host,
+                                      'memory_mb': memory_mb}})
+        except RemoteError as e:
+            if e.exc_type == 'OutOfInstanceMemory':
+                raise reddwarf_exception.OutOfInstanceMemory(
+                    instance_memory_mb=memory_mb)
+            raise
+
     def resize_volume(self, ctxt, volume_id):
         """
         Rescan and resize the attached volume filesystem once the actual volume
@@ -22,6 +22,7 @@ from eventlet.timeout import Timeout
 from nova import flags
 from nova import log as logging
 from nova import exception as nova_exception
+from nova import rpc
 
 from nova.compute import instance_types
 from nova.compute import power_state
@@ -39,6 +40,8 @@ from reddwarf.db import api as dbapi
 from reddwarf import exception
 from reddwarf.guest import status as guest_status
 from reddwarf.utils import poll_until
+from reddwarf.utils import wait_until
+from reddwarf.utils import WaitRegistry
 
 
 flags.DEFINE_integer('reddwarf_guest_initialize_time_out', 10 * 60,
@@ -53,6 +56,10 @@ flags.DEFINE_integer('reddwarf_instance_suspend_time_out', 3 * 60,
 flags.DEFINE_integer('reddwarf_volume_time_out', 10 * 60,
                      'Time in seconds for an instance to wait for a volume '
                      'to be provisioned before aborting.')
+flags.DEFINE_integer('reddwarf_max_poll_interval', 30,
+                     'Longest time in seconds to sleep between two checks of '
+                     'a volume or guest status when no notification of a '
+                     'change arrives.')
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger(__name__)
@@ -105,7 +112,7 @@ class ReddwarfInstanceInitializer(object):
 
     def __init__(self, compute_manager, db, context, instance_id,
                  volume_id=None, volume=None, volume_mount_point=None,
-                 databases=None, users=None):
+                 databases=None, users=None, waiters=None):
         """Creates a new instance."""
         self.db = db
         self.context = context
@@ -117,6 +124,7 @@ class ReddwarfInstanceInitializer(object):
         self.users = users
         self.compute_manager = compute_manager
         self.volume_api = volume_api.API()
+        self.waiters = waiters
 
     def _abort_guest_install(self):
         """Sets the guest state to FAIL continuously until an instance is known
@@ -168,6 +176,7 @@ class ReddwarfInstanceInitializer(object):
         try:
             instance_ref = self.db.instance_get(self.context, self.instance_id)
             memory_mb = instance_ref['memory_mb']
+            guest_api.remember_routing_key(instance_ref)
             guest_api.prepare(self.context, self.instance_id, memory_mb,
                               self.databases, self.users)
             return True
@@ -184,9 +193,12 @@ class ReddwarfInstanceInitializer(object):
     def wait_for_guest(self, guest_api):
         """Wait for the guest to come up and abort if it fails or times out."""
         try:
-            poll_until(lambda : dbapi.guest_status_get(self.instance_id),
-                       lambda status : status.state == power_state.RUNNING,
+            wait_until(lambda: dbapi.guest_status_get(self.instance_id),
+                       lambda status: status.state == power_state.RUNNING,
+                       waiters=self.waiters,
+                       key=('guest', self.instance_id),
                        sleep_time=2,
+                       max_sleep_time=FLAGS.reddwarf_max_poll_interval,
                        time_out=FLAGS.reddwarf_guest_initialize_time_out)
             LOG.info("Guest is now running on instance %s" % self.instance_id)
             return True
@@ -260,7 +272,10 @@ class ReddwarfInstanceInitializer(object):
                 LOG.error("STATUS: %s" % status)
                 raise exception.VolumeProvisioningError(
                     volume_id=self.volume_id)
-        poll_until(volume_is_available, sleep_time=1, time_out=time_out)
+        wait_until(volume_is_available, waiters=self.waiters,
+                   key=('volume', self.volume_id), sleep_time=1,
+                   max_sleep_time=FLAGS.reddwarf_max_poll_interval,
+                   time_out=time_out)
 
 class ReddwarfComputeManager(ComputeManager):
     """Manages the running Reddwarf instances."""
@@ -269,8 +284,25 @@ class ReddwarfComputeManager(ComputeManager):
         super(ReddwarfComputeManager, self).__init__(*args, **kwargs)
         self.guest_api = guest.API()
         self.compute_manager = super(ReddwarfComputeManager, self)
+        self.waiters = WaitRegistry()
 
-    def resize_in_place(self, context, instance_id, new_instance_type_id):
+    def volume_status_changed(self, context, volume_id, status):
+        """Wakes up the provisioning steps waiting on the volume."""
+        LOG.debug("Volume %s is now %s." % (volume_id, status))
+        self.waiters.notify(('volume', volume_id))
+
+    def guest_status_changed(self, context, instance_id, state):
+        """Wakes up the provisioning steps waiting on the guest."""
+        LOG.debug("Guest of instance %s is now %s." % (instance_id, state))
+        self.waiters.notify(('guest', instance_id))
+
+    def prewarm_images(self, context, image_refs):
+        """Downloads image templates ahead of a burst of builds."""
+        LOG.audit(_("Pre-warming images %s"), image_refs, context=context)
+        return self.driver.prewarm_images(context, image_refs)
+
+    def resize_in_place(self, context, instance_id, new_instance_type_id,
+                        reservation=None):
         """Changes the size of instance.
 
         First, the MySQL app is stopped. the driver is asked to resize the
@@ -284,6 +316,9 @@ class ReddwarfComputeManager(ComputeManager):
         If the guest fails, the vm_state is still set to active but because
         the guest status is bad the overall status from the API will be reported
         correctly.
+
+        The memory reservation taken by the API is handed back to the
+        scheduler at the end, as used memory if the instance was resized.
         """
         method = 'resize_in_place'
         if not hasattr(self.driver, method):
@@ -326,9 +361,24 @@ class ReddwarfComputeManager(ComputeManager):
                               err_values=err_values)
             raise
         finally:
-            self._instance_update(context, instance_id,
-                    instance_type_id=actual_instance_type_id,
-                    vm_state=updated_vm_state, task_state=None)
+            values = {'instance_type_id': actual_instance_type_id,
+                      'vm_state': updated_vm_state,
+                      'task_state': None}
+            if updated_memory_size is not None:
+                values['memory_mb'] = updated_memory_size
+            self._instance_update(context, instance_id, **values)
+            if reservation:
+                self._release_memory(context, reservation,
+                                     updated_memory_size is not None)
+
+    def _release_memory(self, context, reservation, used):
+        """Sends a resize reservation back to the scheduler that holds it."""
+        queue = self.db.queue_get_for(context, FLAGS.scheduler_topic,
+                                      reservation['scheduler'])
+        rpc.cast(context, queue,
+                 {'method': 'release_memory',
+                  'args': {'reservation_id': reservation['id'],
+                           'used': used}})
 
     def restart(self, context, instance_id):
         """Call agent to restart MySQL."""
@@ -356,7 +406,8 @@ class ReddwarfComputeManager(ComputeManager):
         metadata = ReddwarfInstanceMetaData(self.db, context, instance_id)
         instance = ReddwarfInstanceInitializer(self.compute_manager, self.db,
             context, instance_id, metadata.volume_id, metadata.volume,
-            metadata.volume_mount_point, metadata.databases, metadata.users)
+            metadata.volume_mount_point, metadata.databases, metadata.users,
+            self.waiters)
         # If any steps return False, cancel subsequent steps.
         (instance.initialize_volume(self.volume_api,
                                     self.volume_client, self.host) and
@@ -435,9 +486,12 @@ class ReddwarfComputeManager(ComputeManager):
         resizing has been completed.
         """
         try:
-            poll_until(lambda: self.db.volume_get(context, volume_id),
+            wait_until(lambda: self.db.volume_get(context, volume_id),
                        lambda volume: volume['status'] == 'resized',
+                       waiters=self.waiters,
+                       key=('volume', volume_id),
                        sleep_time=2,
+                       max_sleep_time=FLAGS.reddwarf_max_poll_interval,
                        time_out=FLAGS.reddwarf_volume_time_out)
             self.volume_api.update(context, volume_id, {'status': 'rescanning'})
             self.volume_client.resize_fs(context, volume_id)
@@ -18,11 +18,13 @@ API Interface for reddwarf datastore operations
 
 import datetime
 
+from sqlalchemy import and_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import func
 from sqlalchemy.sql import text
+from sqlalchemy.sql.expression import desc
 
 from nova import exception as nova_exception
 from nova import flags
@@ -39,14 +41,22 @@ from nova.db.sqlalchemy.models import Service
 from nova.db.sqlalchemy.models import Volume
 from nova.db.sqlalchemy.session import get_session
 from nova.compute import power_state
+from nova.compute import vm_states
 
 from reddwarf import exception
+from reddwarf import utils
 from reddwarf.db import models
 from reddwarf.guest.status import GuestStatus
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('localid_cache_size', 10000,
+                     'Maximum number of uuid to local id mappings cached')
+flags.DEFINE_integer('localid_cache_ttl', 3600,
+                     'Seconds a cached uuid to local id mapping is kept')
 LOG = logging.getLogger('reddwarf.db.api')
 
+LOCALID_CACHE = None
+
 def guest_status_create(instance_id):
     """Create a new guest status for the instance
 
@@ -112,6 +122,64 @@ def guest_status_update(instance_id, status):
                         'state_description': status.description})
 
 
+def guest_status_update_many(statuses):
+    """Update the state of many guests at once
+
+    Guests are grouped by their new state so that a single multi-row UPDATE
+    is issued per distinct state. Rows already in the requested state are
+    left untouched.
+
+    :param statuses: dictionary mapping instance ids to GuestStatus values
+    :returns: the number of rows actually changed
+    """
+    by_status = {}
+    for instance_id, status in statuses.items():
+        by_status.setdefault(status.code, (status, []))[1].append(instance_id)
+    rows = 0
+    session = get_session()
+    with session.begin():
+        for status, instance_ids in by_status.values():
+            rows += session.query(models.GuestStatus).\
+                    filter(models.GuestStatus.instance_id.in_(instance_ids)).\
+                    filter(models.GuestStatus.state != status.code).\
+                    update({'state': status.code,
+                            'state_description': status.description},
+                           synchronize_session=False)
+    return rows
+
+
+def guest_status_get_deleted_before(latest_time, marker=None, limit=None):
+    """Get soft deleted guest statuses, ordered by instance id
+
+    :param latest_time: only rows deleted before this time are returned
+    :param marker: only rows with a greater instance id are returned
+    :param limit: maximum number of rows returned
+    """
+    session = get_session()
+    query = session.query(models.GuestStatus).\
+                    filter_by(deleted=True).\
+                    filter(models.GuestStatus.deleted_at < latest_time)
+    if marker is not None:
+        query = query.filter(models.GuestStatus.instance_id > marker)
+    query = query.order_by(models.GuestStatus.instance_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def guest_status_purge(instance_id):
+    """Remove a soft deleted guest status for good
+
+    :param instance_id: instance id for the guest
+    """
+    session = get_session()
+    with session.begin():
+        session.query(models.GuestStatus).\
+                filter_by(instance_id=instance_id).\
+                filter_by(deleted=True).\
+                delete()
+
+
 def guest_status_delete(instance_id):
     """Set the specified instance state as deleted
 
@@ -145,24 +213,81 @@ def show_instances_on_host(context, id):
     return result
 
 @require_admin_context
-def instances_mgmt_index(context, deleted=None):
+def instances_mgmt_index(context, deleted=None, limit=None, marker=None):
+    """Returns a page of instances, newest first, for the management index.
+
+    The flavor is joined in by the instance query. The fixed IPs and volumes
+    of the page are then loaded with one query each and attached through
+    dictionaries keyed by instance id. Each row is a dictionary with the keys
+    id, uuid, project_id, host, vm_state, created_at, deleted_at, deleted,
+    flavorid, ips and volumes.
+
+    :param deleted: only return instances with this deleted flag if given
+    :param limit: maximum number of instances to return
+    :param marker: local id of the last instance of the previous page
+    """
     session = get_session()
-    instances = session.query(Instance)
+    query = session.query(Instance.id,
+                          Instance.uuid,
+                          Instance.project_id,
+                          Instance.host,
+                          Instance.vm_state,
+                          Instance.created_at,
+                          Instance.deleted_at,
+                          Instance.deleted,
+                          InstanceTypes.flavorid).\
+                    outerjoin((InstanceTypes,
+                               Instance.instance_type_id == InstanceTypes.id))
     if deleted is not None:
-        instances = instances.filter_by(deleted=deleted)
-
-    # Join to get the flavor types.
-    # TODO(ed-): The join works, but the model doesn't hand over the columns.
-    #instances = instances.join((InstanceTypes,
-    #    Instance.instance_type_id == InstanceTypes.id))
-
-    # Fetch the instance_types, or "flavors"
-    flavors = session.query(InstanceTypes)
-
-    # Fetch the IPs for mapping.
-    ips = session.query(FixedIp).filter(FixedIp.instance_id != None)
-
-    return instances.all(), flavors.all(), ips.all()
+        query = query.filter(Instance.deleted == deleted)
+    if marker is not None:
+        query = query.filter(Instance.id < marker)
+    query = query.order_by(desc(Instance.id))
+    if limit is not None:
+        query = query.limit(limit)
+
+    instances = []
+    ips_by_instance = {}
+    volumes_by_instance = {}
+    for row in query.all():
+        ips_by_instance[row[0]] = []
+        volumes_by_instance[row[0]] = []
+        instances.append({'id': row[0],
+                          'uuid': row[1],
+                          'project_id': row[2],
+                          'host': row[3],
+                          'vm_state': row[4],
+                          'created_at': row[5],
+                          'deleted_at': row[6],
+                          'deleted': row[7],
+                          'flavorid': row[8],
+                          'ips': ips_by_instance[row[0]],
+                          'volumes': volumes_by_instance[row[0]]})
+    if not instances:
+        return instances
+
+    instance_ids = ips_by_instance.keys()
+    ips = session.query(FixedIp.instance_id,
+                        FixedIp.address,
+                        FixedIp.virtual_interface_id).\
+                  filter(FixedIp.instance_id.in_(instance_ids))
+    for instance_id, address, virtual_interface_id in ips:
+        ips_by_instance[instance_id].append({
+            'address': address,
+            'virtual_interface_id': virtual_interface_id,
+            })
+
+    volumes = session.query(Volume.instance_id,
+                            Volume.size,
+                            Volume.mountpoint).\
+                      filter(Volume.instance_id.in_(instance_ids)).\
+                      filter(Volume.deleted == False)
+    for instance_id, size, mountpoint in volumes:
+        volumes_by_instance[instance_id].append({
+            'size': size,
+            'mountpoint': mountpoint,
+            })
+    return instances
 
 @require_admin_context
 def instance_get_by_state_and_updated_before(context, state, time):
@@ -178,6 +303,32 @@ def instance_get_by_state_and_updated_before(context, state, time):
     return result
 
 
+@require_admin_context
+def instance_get_building_before(context, latest_time, marker=None,
+                                 limit=None):
+    """Finds instances still building that were created before some time."""
+    session = get_session()
+    query = session.query(Instance).\
+                    filter_by(deleted=False).\
+                    filter_by(vm_state=vm_states.BUILDING).\
+                    filter(Instance.created_at < latest_time)
+    if marker is not None:
+        query = query.filter(Instance.id > marker)
+    query = query.order_by(Instance.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+@require_admin_context
+def instance_get_all_live(context):
+    """Returns every instance that is not deleted, without its relations."""
+    session = get_session()
+    return session.query(Instance).\
+                   filter_by(deleted=False).\
+                   all()
+
+
 @require_admin_context
 def instance_get_memory_sum_by_host(context, hostname):
     session = get_session()
@@ -218,15 +369,20 @@ def volume_get_by_state_and_updated_before(context, state, time):
     return result
 
 @require_admin_context
-def volume_get_orphans(context, latest_time):
-    session = get_session()
-    result = session.query(Volume).\
-                     filter_by(deleted=False).\
-                     filter_by(instance_id=None).\
-                     filter(Volume.status=='available').\
-                     filter(Volume.updated_at < latest_time).\
-                     all()                     
-    return result
+def volume_get_orphans(context, latest_time, marker=None, limit=None):
+    """Finds available volumes without an instance, ordered by id."""
+    session = get_session()
+    query = session.query(Volume).\
+                    filter_by(deleted=False).\
+                    filter_by(instance_id=None).\
+                    filter(Volume.status == 'available').\
+                    filter(Volume.updated_at < latest_time)
+    if marker is not None:
+        query = query.filter(Volume.id > marker)
+    query = query.order_by(Volume.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
 
 def get_root_enabled_history(context, id):
     """
@@ -345,23 +501,50 @@ def config_delete(key):
                 delete()
 
 
+def _get_localid_cache():
+    global LOCALID_CACHE
+    if LOCALID_CACHE is None:
+        LOCALID_CACHE = utils.LRUCache(FLAGS.localid_cache_size,
+                                       ttl=FLAGS.localid_cache_ttl)
+    return LOCALID_CACHE
+
+
 def localid_from_uuid(uuid):
     """
     Given an instance's uuid, retrieve the local instance_id for compatibility
     with nova. When nova uses uuids exclusively, this function will not be
     needed.
+
+    The mapping never changes for the life of an instance, so results are
+    kept in a process local cache until the instance is deleted.
     """
+    cache = _get_localid_cache()
+    local_id = cache.get(uuid)
+    if local_id is not None:
+        return local_id
     LOG.debug("Retrieving local id for instance %s" % uuid)
     session = get_session()
     try:
-        result = session.query(Instance).filter_by(uuid=uuid).one()
-        return result['id']
+        result = session.query(Instance.id).filter_by(uuid=uuid).one()
     except NoResultFound:
         LOG.debug("No such instance found.")
         raise exception.NotFound()
+    local_id = result[0]
+    cache.set(uuid, local_id)
+    return local_id
+
+
+def localid_cache_invalidate(uuid):
+    """Forget the cached local id of the instance, e.g. once it's deleted."""
+    _get_localid_cache().delete(uuid)
 
 
-def rsdns_record_create(name, id):
+def localid_cache_stats():
+    """Returns the hit, miss and eviction counters of the local id cache."""
+    return _get_localid_cache().get_stats()
+
+
+def rsdns_record_create(name, id, content=None, type=None):
     """
     Stores a record name / ID pair in the table rsdns_records.
     """
@@ -369,7 +552,9 @@ def rsdns_record_create(name, id):
               % (id, name))
     record = models.RsDnsRecord()
     record.update({'name': name,
-                   'id': id})
+                   'id': id,
+                   'content': content,
+                   'type': type})
 
     session = get_session()
     try:
@@ -395,6 +580,31 @@ def rsdns_record_get(name):
     return result
 
 
+def rsdns_record_find(name=None, content=None):
+    """
+    Fetches the dns records matching a name and / or content.
+    """
+    session = get_session()
+    query = session.query(models.RsDnsRecord).\
+                    filter_by(deleted=False)
+    if name is not None:
+        query = query.filter_by(name=name)
+    if content is not None:
+        query = query.filter_by(content=content)
+    return query.order_by(models.RsDnsRecord.name).all()
+
+
+def rsdns_record_update(name, values):
+    """
+    Changes the stored id, content or type of a dns record.
+    """
+    session = get_session()
+    with session.begin():
+        session.query(models.RsDnsRecord).\
+                filter_by(name=name).\
+                update(values)
+
+
 def rsdns_record_delete(name):
     """
     Deletes a dns record.
@@ -406,6 +616,61 @@ def rsdns_record_delete(name):
                 delete()
 
 
+def rsdns_record_get_created_before(latest_time, marker=None, limit=None):
+    """
+    Fetches the dns records created before some time, ordered by name.
+    """
+    session = get_session()
+    query = session.query(models.RsDnsRecord).\
+                    filter_by(deleted=False).\
+                    filter(models.RsDnsRecord.created_at < latest_time)
+    if marker is not None:
+        query = query.filter(models.RsDnsRecord.name > marker)
+    query = query.order_by(models.RsDnsRecord.name)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def rsdns_job_create_many(job_id, callback_url, entries):
+    """
+    Stores the records an asynchronous RSDNS create job is working on.
+    """
+    LOG.debug("Storing RSDNS job %s for %d records." % (job_id, len(entries)))
+    session = get_session()
+    with session.begin():
+        for entry in entries:
+            job = models.RsDnsJob()
+            job.update({'name': entry.name,
+                        'job_id': job_id,
+                        'callback_url': callback_url,
+                        'content': entry.content,
+                        'type': entry.type})
+            job.save(session=session)
+
+
+def rsdns_job_get_all():
+    """
+    Fetches the records of all unfinished RSDNS create jobs.
+    """
+    session = get_session()
+    return session.query(models.RsDnsJob).\
+                   filter_by(deleted=False).\
+                   order_by(models.RsDnsJob.created_at).\
+                   all()
+
+
+def rsdns_job_delete(job_id):
+    """
+    Forgets a finished RSDNS create job.
+    """
+    session = get_session()
+    with session.begin():
+        session.query(models.RsDnsJob).\
+                filter_by(job_id=job_id).\
+                delete()
+
+
 def rsdns_record_list():
     """
     Stores a record name / ID pair in the table rsdns_records.
@@ -460,17 +725,75 @@ def fixed_ip_get_by_instance_for_network(context, instance_id, bridge_name):
 
 
 @require_context
-def instance_state_get_all_filtered(context):
-    """Returns a dictionary mapping instance IDs to their state."""
-    session = get_session()
-    query = session.query(nova_models.Instance).filter_by(deleted=False)
+def instance_summary_get_all_filtered(context, limit=None, marker=None):
+    """Returns compact rows describing the visible instances.
+
+    Only the columns needed to list instances are loaded, with the flavor,
+    volume size and guest state joined in by the same query. Each row is a
+    dictionary with the keys id, uuid, name, vm_state, power_state,
+    task_state, created_at, updated_at, flavorid, volume_size and
+    guest_state. Newest instances come first.
 
+    :param limit: maximum number of rows to return
+    :param marker: local id of the last instance of the previous page
+    """
+    session = get_session()
+    # NOTE: the page is cut from the instance ids alone, since a limit on the
+    # joined rows would count an instance once for every volume it has.
+    ids = session.query(Instance.id).filter(Instance.deleted == False)
     if not context.is_admin:
         if context.project_id:
-            results = query.filter_by(project_id=context.project_id).all()
+            ids = ids.filter(Instance.project_id == context.project_id)
         else:
-            results = query.filter_by(user_id=context.user_id).all()
-    else:
-        results = query.all()
+            ids = ids.filter(Instance.user_id == context.user_id)
+    if marker is not None:
+        ids = ids.filter(Instance.id < marker)
+    ids = ids.order_by(desc(Instance.id))
+    if limit is not None:
+        ids = ids.limit(limit)
+    ids = ids.subquery()
+
+    query = session.query(Instance.id,
+                          Instance.uuid,
+                          Instance.display_name,
+                          Instance.vm_state,
+                          Instance.power_state,
+                          Instance.task_state,
+                          Instance.created_at,
+                          Instance.updated_at,
+                          InstanceTypes.flavorid,
+                          Volume.size,
+                          models.GuestStatus.state).\
+                    join((ids, Instance.id == ids.c.id)).\
+                    outerjoin((InstanceTypes,
+                               Instance.instance_type_id ==
+                               InstanceTypes.id)).\
+                    outerjoin((Volume,
+                               and_(Volume.instance_id == Instance.id,
+                                    Volume.deleted == False))).\
+                    outerjoin((models.GuestStatus,
+                               and_(models.GuestStatus.instance_id ==
+                                    Instance.id,
+                                    models.GuestStatus.deleted == False))).\
+                    order_by(desc(Instance.id))
+
+    results = []
+    seen = set()
+    for row in query.all():
+        if row[0] in seen:
+            # More than one volume is attached; the first one is reported.
+            continue
+        seen.add(row[0])
+        results.append({'id': row[0],
+                        'uuid': row[1],
+                        'name': row[2],
+                        'vm_state': row[3],
+                        'power_state': row[4],
+                        'task_state': row[5],
+                        'created_at': row[6],
+                        'updated_at': row[7],
+                        'flavorid': row[8],
+                        'volume_size': row[9],
+                        'guest_state': row[10]})
+    return results
 
-    return dict((result['id'], result['power_state']) for result in results)
@@ -0,0 +1,42 @@
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+dns_jobs = Table('rsdns_jobs', meta,
+               Column('created_at', DateTime(timezone=False)),
+               Column('updated_at', DateTime(timezone=False)),
+               Column('deleted_at', DateTime(timezone=False)),
+               Column('deleted', Boolean(create_constraint=True, name=None)),
+               Column('name', String(length=255), primary_key=True),
+               Column('job_id', String(length=64), index=True),
+               Column('callback_url', String(length=255)),
+               Column('content', String(length=255)),
+               Column('type', String(length=16)))
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    dns_jobs.create()
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    dns_jobs.drop()
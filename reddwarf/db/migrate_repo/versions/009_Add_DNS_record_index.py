@@ -0,0 +1,42 @@
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column
+from sqlalchemy import Index
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+
+meta = MetaData()
+
+c_content = Column('content', String(length=255), nullable=True)
+c_type = Column('type', String(length=16), nullable=True)
+
+
+def upgrade(migrate_engine):
+    records_table = Table('rsdns_records', meta, autoload=True,
+                          autoload_with=migrate_engine)
+    meta.bind = migrate_engine
+    records_table.create_column(c_content)
+    records_table.create_column(c_type)
+    Index('rsdns_records_content_idx', records_table.c.content).create()
+
+
+def downgrade(migrate_engine):
+    records_table = Table('rsdns_records', meta, autoload=True,
+                          autoload_with=migrate_engine)
+    meta.bind = migrate_engine
+    Index('rsdns_records_content_idx', records_table.c.content).drop()
+    records_table.drop_column(c_content)
+    records_table.drop_column(c_type)
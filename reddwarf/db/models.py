@@ -68,10 +68,26 @@ class Config(BASE, NovaBase):
 
 class RsDnsRecord(BASE, NovaBase):
     """
-    A simple pairing between a DNS record ID and its name.
+    A simple pairing between a DNS record ID and its name, along with the
+    content and type last seen for it so lookups can skip RSDNS.
     """
     __tablename__ = 'rsdns_records'
 
     name = Column(String(length=255), primary_key=True)
     id = Column('id', String(length=64))
+    content = Column(String(length=255))
+    type = Column(String(length=16))
+
+
+class RsDnsJob(BASE, NovaBase):
+    """
+    A DNS record whose asynchronous create job has not finished yet.
+    """
+    __tablename__ = 'rsdns_jobs'
+
+    name = Column(String(length=255), primary_key=True)
+    job_id = Column(String(length=64))
+    callback_url = Column(String(length=255))
+    content = Column(String(length=255))
+    type = Column(String(length=16))
     
\ No newline at end of file
@@ -69,3 +69,11 @@ class API(base.Base):
                  {'method': 'delete_instance_entry',
                   'args': {'instance': self.convert_instance(instance),
                            'content': content}})
+
+    def delete_entry(self, context, name, type):
+        """Make an asynchronous call to delete an entry by its name."""
+        LOG.debug("Deleting entry %s of type %s" % (name, type))
+        rpc.cast(context, FLAGS.dns_topic,
+                 {'method': 'delete_entry',
+                  'args': {'name': name,
+                           'type': type}})
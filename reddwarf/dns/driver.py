@@ -33,10 +33,40 @@ class DnsDriver(object):
         """Creates the entry in the driver at the given dns zone."""
         pass
 
+    def create_entries(self, entries):
+        """Starts creating several entries at once.
+
+        Returns a tuple of the entries already created and a list of
+        (entry, error) pairs for those that failed.  Entries in neither are
+        still being created and are reported by poll_jobs later.
+
+        """
+        created = []
+        failed = []
+        for entry in entries:
+            try:
+                self.create_entry(entry)
+                created.append(entry)
+            except Exception as e:
+                failed.append((entry, e))
+        return created, failed
+
+    def has_pending_jobs(self):
+        """Returns True if entries are still being created."""
+        return False
+
+    def poll_jobs(self):
+        """Checks on the entries being created, same as create_entries."""
+        return [], []
+
     def delete_entry(self, name, type, dns_zone=None):
         """Deletes an entry with the given name and type from a dns zone."""
         pass
 
+    def reconcile(self):
+        """Brings any local copy of the records in line with the zone."""
+        pass
+
     def get_entries_by_content(self, content, dns_zone=None):
         """Retrieves all entries in a dns_zone with a matching content field"""
         pass
@@ -0,0 +1,209 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Dns Driver that keeps its records in a local hosts file.
+
+It needs no network, and can be told to wait on each call, so the DNS path
+can be load tested without a real DNS service.  The file is in the format
+read by dnsmasq's addn-hosts option; records other than A and AAAA are kept
+in it as comments.
+"""
+
+import hashlib
+import os
+import random
+
+from eventlet import greenthread
+
+from nova import flags
+from nova import log as logging
+
+from reddwarf.dns.driver import DnsDriver
+from reddwarf.dns.driver import DnsEntry
+from reddwarf.dns.driver import DnsEntryNotFound
+from reddwarf.dns.driver import DnsZone
+
+
+flags.DEFINE_string('dns_local_hosts_file', '$state_path/dns_hosts',
+                    'File the local DNS driver keeps its records in.')
+flags.DEFINE_string('dns_local_domain_name', 'dbaas.local',
+                    'Domain name of the local DNS driver\'s only zone.')
+flags.DEFINE_integer('dns_local_ttl', 300,
+                     'TTL for the local DNS entries.')
+flags.DEFINE_float('dns_local_latency', 0.0,
+                   'Seconds each call to the local DNS driver waits, to '
+                   'stand in for a remote DNS service.')
+flags.DEFINE_float('dns_local_latency_jitter', 0.0,
+                   'Up to this many seconds are added at random to '
+                   'dns_local_latency on each call.')
+
+FLAGS = flags.FLAGS
+LOG = logging.getLogger('reddwarf.dns.local.driver')
+
+ADDRESS_TYPES = ('A', 'AAAA')
+
+
+class LocalDnsZone(DnsZone):
+
+    def __init__(self, name):
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    def __eq__(self, other):
+        return isinstance(other, LocalDnsZone) and self.name == other.name
+
+
+class LocalDnsDriver(DnsDriver):
+    """Keeps DNS records in a hosts file on the local disk."""
+
+    def __init__(self, path=None, latency=None, jitter=None):
+        self.path = path or FLAGS.dns_local_hosts_file
+        self.latency = FLAGS.dns_local_latency if latency is None else latency
+        self.jitter = (FLAGS.dns_local_latency_jitter if jitter is None
+                       else jitter)
+        self.default_dns_zone = LocalDnsZone(FLAGS.dns_local_domain_name)
+        self.entries = {}
+        self._load()
+
+    _sleep = staticmethod(greenthread.sleep)
+
+    def _wait(self):
+        delay = self.latency
+        if self.jitter > 0:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0:
+            self._sleep(delay)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as hosts_file:
+            for line in hosts_file:
+                entry = self._parse(line)
+                if entry is not None:
+                    self.entries[(entry.name, entry.type)] = entry
+        LOG.debug("Loaded %d DNS entries from %s."
+                  % (len(self.entries), self.path))
+
+    def _parse(self, line):
+        fields = line.split()
+        if len(fields) == 5 and fields[0] == '#':
+            # A record that cannot be written as a host: "# type name data ttl"
+            type, name, content, ttl = fields[1:]
+        elif len(fields) == 5 and fields[2] == '#':
+            # A host: "data name # type ttl"
+            content, name, _hash, type, ttl = fields
+        else:
+            return None
+        return DnsEntry(name=name, content=content, type=type, ttl=int(ttl),
+                        dns_zone=self.default_dns_zone)
+
+    def _format(self, entry):
+        ttl = entry.ttl or 0
+        if entry.type in ADDRESS_TYPES:
+            return "%s %s # %s %d\n" % (entry.content, entry.name, entry.type,
+                                        ttl)
+        return "# %s %s %s %d\n" % (entry.type, entry.name, entry.content, ttl)
+
+    def _save(self):
+        """Rewrites the file, renaming it into place so it is never partial."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as hosts_file:
+            for key in sorted(self.entries):
+                hosts_file.write(self._format(self.entries[key]))
+        os.rename(temp_path, self.path)
+
+    def _add(self, entry):
+        key = (entry.name, entry.type)
+        if key in self.entries:
+            raise RuntimeError("An entry named %s of type %s already exists."
+                               % (entry.name, entry.type))
+        self.entries[key] = DnsEntry(name=entry.name, content=entry.content,
+                                     type=entry.type, ttl=entry.ttl,
+                                     dns_zone=self.default_dns_zone)
+
+    def create_entry(self, entry):
+        self._wait()
+        self._add(entry)
+        self._save()
+
+    def create_entries(self, entries):
+        """Creates all the entries with one wait and one write of the file."""
+        self._wait()
+        created = []
+        failed = []
+        for entry in entries:
+            try:
+                self._add(entry)
+                created.append(entry)
+            except Exception as e:
+                failed.append((entry, e))
+        if created:
+            self._save()
+        return created, failed
+
+    def delete_entry(self, name, type, dns_zone=None):
+        self._wait()
+        if (name, type) not in self.entries:
+            raise DnsEntryNotFound("No entry found for name %s of type %s."
+                                   % (name, type))
+        del self.entries[(name, type)]
+        self._save()
+
+    def get_entries(self, name=None, content=None):
+        self._wait()
+        return [entry for key, entry in sorted(self.entries.items())
+                if (name is None or entry.name == name) and
+                   (content is None or entry.content == content)]
+
+    def get_entries_by_content(self, content, dns_zone=None):
+        return self.get_entries(content=content)
+
+    def get_entries_by_name(self, name, dns_zone=None):
+        return self.get_entries(name=name)
+
+    def get_dns_zones(self, name=None):
+        if name is None or name == self.default_dns_zone.name:
+            return [self.default_dns_zone]
+        return []
+
+    def modify_content(self, *args, **kwargs):
+        raise NotImplementedError("Not implemented for local DNS.")
+
+    def rename_entry(self, *args, **kwargs):
+        raise NotImplementedError("Not implemented for local DNS.")
+
+
+class LocalDnsInstanceEntryFactory(object):
+    """Names instances the same way as RsDnsInstanceEntryFactory."""
+
+    def __init__(self):
+        self.default_dns_zone = LocalDnsZone(FLAGS.dns_local_domain_name)
+
+    def create_entry(self, instance):
+        id = instance.get("uuid", "")
+        if not id:
+            id = str(instance['id'])
+        hostname = ("%s.%s" % (hashlib.sha1(id).hexdigest(),
+                               self.default_dns_zone.name))
+        return DnsEntry(name=hostname, content=None, type="A",
+                        ttl=FLAGS.dns_local_ttl,
+                        dns_zone=self.default_dns_zone)
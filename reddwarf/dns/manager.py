@@ -19,18 +19,34 @@
 Dns manager.
 """
 
+from eventlet import greenthread
+
 from nova import flags
 from nova import log as logging
 from nova import utils
 from nova.manager import Manager
+from nova.notifier import api as notifier
 
 from reddwarf import dns # import for flag values
 
 FLAGS = flags.FLAGS
+flags.DEFINE_float('dns_batch_delay', 0.5,
+                   'Seconds new entries are gathered before they are sent to '
+                   'the DNS driver together. Zero sends each one right '
+                   'away.')
+flags.DEFINE_integer('dns_job_poll_interval', 2,
+                     'Seconds between checks on the entries being created.')
+flags.DEFINE_integer('dns_reconcile_interval', 10 * 60,
+                     'Seconds between reconciling the driver\'s record index '
+                     'with the DNS service. Zero turns it off.')
 
 LOG = logging.getLogger('reddwarf.dns.manager')
 
 
+def publisher_id(host=None):
+    return notifier.publisher_id("dns", host)
+
+
 class DnsManager(Manager):
     """Handles associating DNS to and from IPs."""
 
@@ -42,8 +58,32 @@ class DnsManager(Manager):
         if not dns_instance_entry_factory:
             dns_instance_entry_factory = FLAGS.dns_instance_entry_factory
         self.entry_factory = utils.import_object(dns_instance_entry_factory)
+        self.queued_entries = []
+        self.flusher = None
+        self.poller = None
+        self.last_reconcile = None
         super(DnsManager, self).__init__(*args, **kwargs)
 
+    def init_host(self):
+        """Resumes checking on entries left being created by a restart."""
+        if self.driver.has_pending_jobs():
+            self._start_polling()
+
+    def periodic_tasks(self, context=None):
+        """Reconciles the driver's record index every so often."""
+        super(DnsManager, self).periodic_tasks(context)
+        if FLAGS.dns_reconcile_interval <= 0:
+            return
+        if self.last_reconcile is not None and \
+           not utils.is_older_than(self.last_reconcile,
+                                   FLAGS.dns_reconcile_interval):
+            return
+        self.last_reconcile = utils.utcnow()
+        try:
+            self.driver.reconcile()
+        except Exception as e:
+            LOG.error("Error when reconciling DNS records: %s" % e)
+
     def create_instance_entry(self, context, instance, content):
         """Connects a new instance with a DNS entry.
 
@@ -57,7 +97,57 @@ class DnsManager(Manager):
         if entry:
             entry.content = content
             LOG.debug("Modified entry address %s." % str(entry))
-            self.driver.create_entry(entry)
+            self.queued_entries.append(entry)
+            if FLAGS.dns_batch_delay <= 0:
+                self._flush()
+            elif self.flusher is None:
+                self.flusher = greenthread.spawn_after(FLAGS.dns_batch_delay,
+                                                       self._flush)
+
+    def _flush(self):
+        """Sends all queued entries to the driver at once."""
+        entries, self.queued_entries = self.queued_entries, []
+        self.flusher = None
+        LOG.debug("Creating %d DNS entries." % len(entries))
+        try:
+            created, failed = self.driver.create_entries(entries)
+        except Exception as e:
+            LOG.error("Error when creating DNS entries: %s" % e)
+            created, failed = [], [(entry, e) for entry in entries]
+        self._notify(created, failed)
+        if self.driver.has_pending_jobs():
+            self._start_polling()
+
+    def _start_polling(self):
+        if self.poller is None:
+            self.poller = greenthread.spawn(self._poll_jobs)
+
+    def _poll_jobs(self):
+        """Checks on all entries being created until none are left."""
+        try:
+            while self.driver.has_pending_jobs():
+                greenthread.sleep(FLAGS.dns_job_poll_interval)
+                try:
+                    created, failed = self.driver.poll_jobs()
+                except Exception as e:
+                    LOG.error("Error when checking on DNS entries: %s" % e)
+                    continue
+                self._notify(created, failed)
+        finally:
+            self.poller = None
+
+    def _notify(self, created, failed):
+        for entry in created:
+            notifier.notify(publisher_id(self.host), 'reddwarf.dns.create.end',
+                            notifier.INFO,
+                            {'name': entry.name, 'content': entry.content,
+                             'type': entry.type})
+        for entry, error in failed:
+            LOG.error("Unable to create DNS entry %s: %s" % (entry, error))
+            notifier.notify(publisher_id(self.host),
+                            'reddwarf.dns.create.error', notifier.ERROR,
+                            {'name': entry.name, 'content': entry.content,
+                             'type': entry.type, 'error': str(error)})
 
     def delete_instance_entry(self, context, instance, content):
         """Removes a DNS entry associated to an instance."""
@@ -66,3 +156,8 @@ class DnsManager(Manager):
         if entry:
             entry.content = content
             self.driver.delete_entry(entry.name, entry.type)
+
+    def delete_entry(self, context, name, type):
+        """Removes a DNS entry that is no longer tied to an instance."""
+        LOG.debug("Deleting entry %s of type %s" % (name, type))
+        self.driver.delete_entry(name, type)
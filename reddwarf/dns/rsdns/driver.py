@@ -21,9 +21,11 @@ Dns Driver that uses Rackspace DNSaaS.
 
 import hashlib
 
+from datetime import timedelta
 from novaclient.exceptions import NotFound
 from rsdns.client import DNSaas
 from rsdns.client.future import RsDnsError
+from rsdns.client.records import FutureRecord
 
 from nova import flags
 from nova import log as logging
@@ -51,6 +53,15 @@ flags.DEFINE_string('dns_management_base_url', None,
                     'The management URL for DNS.')
 flags.DEFINE_integer('dns_ttl', 300, 'TTL for the DNS entries')
 flags.DEFINE_integer('dns_domain_id', None, 'DNS domain id from RSDNS')
+flags.DEFINE_integer('dns_job_time_out', 60 * 2,
+                     'Seconds an RSDNS create job may run before its records '
+                     'are given up on.')
+flags.DEFINE_integer('dns_max_records_per_job', 20,
+                     'Maximum number of records created by one RSDNS request.')
+flags.DEFINE_boolean('dns_use_record_index', True,
+                     'Look up records of the default zone in the '
+                     'rsdns_records table instead of listing the zone '
+                     'through RSDNS.')
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger('reddwarf.dns.rsdns.driver')
@@ -87,6 +98,9 @@ def create_client_with_flag_values():
                   management_base_url=FLAGS.dns_management_base_url)
 
 
+_default_zones = {}
+
+
 def find_default_zone(dns_client, raise_if_zone_missing=True):
     """Using the domain_name from the FLAG values, creates a zone.
 
@@ -94,13 +108,23 @@ def find_default_zone(dns_client, raise_if_zone_missing=True):
     In testing it's difficult to keep up with it because the database keeps
     getting wiped... maybe later we could go back to storing it as a FLAG value
 
+    The zone is only looked up once per domain name, and not at all if the
+    dns_domain_id flag is set.
+
     """
     domain_name = FLAGS.dns_domain_name
+    if FLAGS.dns_domain_id is not None:
+        return RsDnsZone(id=FLAGS.dns_domain_id, name=domain_name)
+    if domain_name in _default_zones:
+        return _default_zones[domain_name]
+    domains = None
     try:
         domains = dns_client.domains.list(name=domain_name)
         for domain in domains:
             if domain.name == domain_name:
-                return RsDnsZone(id=domain.id, name=domain_name)
+                zone = RsDnsZone(id=domain.id, name=domain_name)
+                _default_zones[domain_name] = zone
+                return zone
     except NotFound:
         pass
     if not raise_if_zone_missing:
@@ -142,7 +166,9 @@ class RsDnsDriver(object):
                 elif len(future.resource) > 1:
                     LOG.error("More than one DNS record created. Ignoring.")
                 actual_record = future.resource[0]
-                dbapi.rsdns_record_create(name=name, id=actual_record.id)
+                dbapi.rsdns_record_create(name=name, id=actual_record.id,
+                                          content=entry.content,
+                                          type=entry.type)
                 LOG.debug("Added RS DNS entry.")
             except exception.PollTimeOut as pto:
                 LOG.error("Failed to create DNS entry before time_out!")
@@ -154,10 +180,124 @@ class RsDnsDriver(object):
             LOG.error("Error when creating a DNS record!")
             raise
 
+    def create_entries(self, entries):
+        """Submits the entries in as few RSDNS create jobs as possible.
+
+        Nothing is waited on; the jobs are kept in the rsdns_jobs table until
+        poll_jobs sees them finish.
+
+        """
+        failed = []
+        by_zone = {}
+        for entry in entries:
+            dns_zone = entry.dns_zone or self.default_dns_zone
+            if dns_zone.id == None:
+                failed.append((entry, TypeError("The entry's dns_zone must "
+                                                "have an ID specified.")))
+                continue
+            by_zone.setdefault(dns_zone.id, []).append(entry)
+        size = FLAGS.dns_max_records_per_job
+        for zone_id, zone_entries in by_zone.items():
+            for start in range(0, len(zone_entries), size):
+                chunk = zone_entries[start:start + size]
+                records = [{'type': entry.type,
+                            'name': entry.name,
+                            'data': entry.content,
+                            'ttl': entry.ttl} for entry in chunk]
+                try:
+                    future = self.dns_client.records.create_many(zone_id,
+                                                                 records)
+                    dbapi.rsdns_job_create_many(future.jobId,
+                                                future.callbackUrl, chunk)
+                    LOG.debug("Submitted RSDNS job %s for %d entries."
+                              % (future.jobId, len(chunk)))
+                except Exception as e:
+                    LOG.error("Error when creating %d DNS records: %s"
+                              % (len(chunk), e))
+                    failed.extend((entry, e) for entry in chunk)
+        return [], failed
+
+    def has_pending_jobs(self):
+        return len(dbapi.rsdns_job_get_all()) > 0
+
+    def poll_jobs(self):
+        """Checks every unfinished create job once.
+
+        Returns the entries created since the last poll and (entry, error)
+        pairs for the entries whose job failed or timed out.
+
+        """
+        jobs = {}
+        for job in dbapi.rsdns_job_get_all():
+            jobs.setdefault(job.job_id, []).append(job)
+        created = []
+        failed = []
+        time_out = timedelta(seconds=FLAGS.dns_job_time_out)
+        now = utils.utcnow()
+        for job_id, rows in jobs.items():
+            entries = [DnsEntry(name=row.name, content=row.content,
+                                type=row.type, ttl=FLAGS.dns_ttl,
+                                dns_zone=self.default_dns_zone)
+                       for row in rows]
+            future = FutureRecord(self.dns_client.records, jobId=job_id,
+                                  callbackUrl=rows[0].callback_url,
+                                  status='RUNNING')
+            try:
+                records = future.resource
+            except RsDnsError as rde:
+                LOG.error("RSDNS job %s failed: %s" % (job_id, rde))
+                failed.extend((entry, rde) for entry in entries)
+                dbapi.rsdns_job_delete(job_id)
+                continue
+            except Exception as e:
+                # The job may still finish; try again on the next poll.
+                LOG.error("Error when checking RSDNS job %s: %s"
+                          % (job_id, e))
+                records = None
+            if records is None:
+                if now - rows[0].created_at > time_out:
+                    LOG.error("RSDNS job %s timed out." % job_id)
+                    failed.extend((entry, exception.PollTimeOut())
+                                  for entry in entries)
+                    dbapi.rsdns_job_delete(job_id)
+                continue
+            ids = dict((record.name, record.id) for record in records)
+            for entry in entries:
+                try:
+                    if entry.name not in ids:
+                        raise exception.RsDnsRecordNotCreated(name=entry.name,
+                            reason="missing from the finished job")
+                    dbapi.rsdns_record_create(name=entry.name,
+                                              id=ids[entry.name],
+                                              content=entry.content,
+                                              type=entry.type)
+                    created.append(entry)
+                except Exception as e:
+                    failed.append((entry, e))
+            dbapi.rsdns_job_delete(job_id)
+        return created, failed
+
+    def _use_index(self, dns_zone):
+        return FLAGS.dns_use_record_index and dns_zone == self.default_dns_zone
+
     def delete_entry(self, name, type, dns_zone=None):
         dns_zone = dns_zone or self.default_dns_zone
         long_name = name
         db_record = dbapi.rsdns_record_get(name)
+        if self._use_index(dns_zone) and db_record.type:
+            # The index already says what the record is, so skip fetching it.
+            if db_record.type != type:
+                LOG.error("Tried to delete DNS record with name=%s and type "
+                          "%s, but the index has it as type %s."
+                          % (name, type, db_record.type))
+                raise exception.RsDnsRecordNotFound(name)
+            try:
+                self.dns_client.records.delete(domain_id=dns_zone.id,
+                                               record_id=db_record.id)
+            except NotFound:
+                LOG.warn("DNS record %s was already gone from RSDNS." % name)
+            dbapi.rsdns_record_delete(name)
+            return
         record = self.dns_client.records.get(domain_id=dns_zone.id,
                                              record_id=db_record.id)
         if record.name != name or record.type != 'A':
@@ -172,6 +312,12 @@ class RsDnsDriver(object):
 
     def get_entries(self, name=None, content=None, dns_zone=None):
         dns_zone = dns_zone or self.default_dns_zone
+        if self._use_index(dns_zone):
+            return [DnsEntry(name=row.name, content=row.content,
+                             type=row.type, ttl=FLAGS.dns_ttl,
+                             dns_zone=dns_zone)
+                    for row in dbapi.rsdns_record_find(name=name,
+                                                       content=content)]
         long_name = name  # self.converter.name_to_long_name(name)
         records = self.dns_client.records.list(domain_id=dns_zone.id,
                                                record_name=long_name,
@@ -190,6 +336,45 @@ class RsDnsDriver(object):
         return [self.converter.domain_to_dns_zone(domain)
                 for domain in domains]
 
+    def reconcile(self):
+        """Brings the record index in line with the default zone in RSDNS.
+
+        Only records reddwarf already indexed are looked at: those gone from
+        RSDNS are dropped and changed ones are updated.  Records it did not
+        create are never added, as the zone may be shared and the reaper
+        deletes indexed records no instance owns.  Returns the number of
+        records removed and updated.
+
+        """
+        dns_zone = self.default_dns_zone
+        # NOTE: the index is read before the zone is listed, so a record
+        # indexed by a job while the listing runs is left for the next pass
+        # instead of being dropped as missing from RSDNS.
+        rows = dbapi.rsdns_record_find()
+        records = {}
+        for record in self.dns_client.records.list(domain_id=dns_zone.id):
+            if record.name in records:
+                LOG.warn("More than one DNS record named %s; indexing the "
+                         "first." % record.name)
+                continue
+            records[record.name] = record
+        counts = {'removed': 0, 'updated': 0}
+        for row in rows:
+            record = records.get(row.name)
+            if record is None:
+                LOG.warn("DNS record %s is no longer in RSDNS." % row.name)
+                dbapi.rsdns_record_delete(row.name)
+                counts['removed'] += 1
+            elif (row.id, row.content, row.type) != \
+                 (str(record.id), record.data, record.type):
+                dbapi.rsdns_record_update(row.name,
+                                          {'id': record.id,
+                                           'content': record.data,
+                                           'type': record.type})
+                counts['updated'] += 1
+        LOG.info("Reconciled the DNS record index with RSDNS: %s" % counts)
+        return counts
+
     def modify_content(self, *args, **kwargs):
         raise NotImplementedError("Not implemented for RS DNS.")
 
@@ -97,6 +97,10 @@ class DuplicateConfigEntry(nova_exception.NovaException):
     message = _("Configuration %(key)s already exists.")
 
 
+class RsDnsRecordNotCreated(nova_exception.NovaException):
+    message = _("RsDnsRecord with name= %(name)s was not created: %(reason)s")
+
+
 class DuplicateRecordEntry(nova_exception.NovaException):
     message = _("Record with name %(name) or id=%(id) already exists.")
 
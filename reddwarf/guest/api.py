@@ -19,19 +19,100 @@
 Handles all request to the Platform or Guest VM
 """
 
+import time
+
+import eventlet
 
 from nova import flags
 from nova import log as logging
 from nova import rpc
 from nova.db import api as dbapi
+from nova.rpc.common import RemoteError
+from nova.rpc.common import Timeout
 from nova.db import base
 
 from reddwarf import rpc as reddwarf_rpc
 from reddwarf import exception
+from reddwarf import utils
 
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('guest_routing_key_cache_size', 10000,
+                     'Maximum number of guest routing keys cached')
+flags.DEFINE_integer('guest_routing_key_cache_ttl', 3600,
+                     'Seconds a cached guest routing key is kept')
+flags.DEFINE_integer('guest_summary_timeout', 10,
+                     'Seconds to wait for the guest details of an instance')
+flags.DEFINE_integer('guest_call_timeout', 60,
+                     'Seconds to wait for the guest to answer a call')
+flags.DEFINE_integer('guest_long_call_timeout', 10 * 60,
+                     'Seconds to wait for the guest to answer a call that '
+                     'restarts MySQL or updates the agent')
 LOG = logging.getLogger('nova.guest.api')
 
+ROUTING_KEYS = None
+# Instances whose agent predates the get_summary call.
+LEGACY_GUESTS = None
+SUMMARY_FIELDS = ('root_enabled', 'volume_info', 'databases', 'users')
+
+
+def _get_routing_keys():
+    global ROUTING_KEYS
+    if ROUTING_KEYS is None:
+        ROUTING_KEYS = utils.LRUCache(FLAGS.guest_routing_key_cache_size,
+                                      ttl=FLAGS.guest_routing_key_cache_ttl)
+    return ROUTING_KEYS
+
+
+def _get_legacy_guests():
+    global LEGACY_GUESTS
+    if LEGACY_GUESTS is None:
+        LEGACY_GUESTS = utils.LRUCache(FLAGS.guest_routing_key_cache_size,
+                                       ttl=FLAGS.guest_routing_key_cache_ttl)
+    return LEGACY_GUESTS
+
+
+def _wait_all(calls, timeout):
+    """Run the calls concurrently, waiting at most timeout seconds.
+
+    Returns a dict of the results keyed like calls. A call that fails or is
+    still running at the deadline has a result of None.
+    """
+    pool = eventlet.GreenPool(len(calls))
+    threads = dict((key, pool.spawn(call)) for key, call in calls.items())
+    results = dict.fromkeys(calls)
+    with eventlet.Timeout(max(timeout, 0), False):
+        for key, thread in threads.items():
+            try:
+                results[key] = thread.wait()
+            except Exception as e:
+                LOG.error("Guest call for %s failed: %s" % (key, e))
+    for key, thread in threads.items():
+        if not thread.dead:
+            LOG.warn("Guest call for %s missed the deadline." % key)
+            thread.kill()
+    return results
+
+
+def _is_unknown_method(error):
+    """Whether a RemoteError is a guest's answer to a method it lacks.
+
+    The python agent raises NotFound, while the C++ agent answers every
+    failure as a std::exception, so the reply text is what tells them apart.
+    """
+    value = str(error.value)
+    return (error.exc_type == 'NotFound' or
+            'No such method' in value or
+            'Method not available' in value)
+
+
+def _routing_key_from_hostname(hostname):
+    return "guest.%s" % hostname.split(".")[0]
+
+
+def routing_key_cache_stats():
+    """Returns the hit and miss counters of the routing key cache."""
+    return _get_routing_keys().get_stats()
+
 
 class API(base.Base):
     """API for interacting with the guest manager."""
@@ -41,8 +122,74 @@ class API(base.Base):
 
     def _get_routing_key(self, context, id):
         """Create the routing key based on the container id"""
-        instance_ref = dbapi.instance_get(context, id)
-        return "guest.%s" % instance_ref['hostname'].split(".")[0]
+        routing_key = _get_routing_keys().get(id)
+        if routing_key is None:
+            instance_ref = dbapi.instance_get(context, id)
+            routing_key = _routing_key_from_hostname(instance_ref['hostname'])
+            _get_routing_keys().set(id, routing_key)
+        return routing_key
+
+    def remember_routing_key(self, instance_ref):
+        """Cache the routing key of an instance the caller already loaded"""
+        if instance_ref.get('hostname'):
+            _get_routing_keys().set(instance_ref['id'],
+                _routing_key_from_hostname(instance_ref['hostname']))
+
+    def forget_routing_key(self, id):
+        """Drop the cached routing key of a deleted or renamed instance"""
+        _get_routing_keys().delete(id)
+
+    def _call(self, context, id, msg, timeout=None):
+        """Call the guest, waiting at most timeout seconds for its reply.
+
+        :raises nova.rpc.common.Timeout: if the guest does not answer in time.
+        """
+        if timeout is None:
+            timeout = FLAGS.guest_call_timeout
+        return rpc.call(context, self._get_routing_key(context, id), msg,
+                        timeout=timeout)
+
+    def get_summary(self, context, id, fields=SUMMARY_FIELDS, timeout=None):
+        """Get the root, volume, database and user details of the guest.
+
+        The details are fetched with a single get_summary call. Older agents
+        that lack it are sent the individual calls concurrently instead. The
+        whole lookup is bounded by guest_summary_timeout, and a detail that
+        could not be fetched in time is None in the returned dict.
+        """
+        if timeout is None:
+            timeout = FLAGS.guest_summary_timeout
+        deadline = time.time() + timeout
+        if _get_legacy_guests().get(id) is None:
+            LOG.debug("Getting the guest summary for Instance %s", id)
+            try:
+                summary = self._call(context, id,
+                                     {"method": "get_summary",
+                                      "args": {"fields": list(fields)}},
+                                     timeout=timeout)
+                return dict((field, summary.get(field)) for field in fields)
+            except Timeout:
+                LOG.warn("Guest summary for Instance %s missed the deadline."
+                         % id)
+                return dict.fromkeys(fields)
+            except RemoteError as e:
+                if not _is_unknown_method(e):
+                    LOG.error(e)
+                    return dict.fromkeys(fields)
+                LOG.debug("Guest of Instance %s has no get_summary call." % id)
+                _get_legacy_guests().set(id, True)
+        remaining = deadline - time.time()
+        calls = {
+            'root_enabled': lambda: self.is_root_enabled(context, id,
+                                                         timeout=remaining),
+            'volume_info': lambda: self.get_volume_info(context, id,
+                                                        timeout=remaining),
+            'databases': lambda: self.list_databases(context, id,
+                                                     timeout=remaining),
+            'users': lambda: self.list_users(context, id, timeout=remaining),
+        }
+        return _wait_all(dict((field, calls[field]) for field in fields),
+                         remaining)
 
     def create_user(self, context, id, users):
         """Make an asynchronous call to create a new database user"""
@@ -52,11 +199,22 @@ class API(base.Base):
                   "args": {"users": users}
                  })
 
-    def list_users(self, context, id):
+    def create_users_and_databases(self, context, id, databases=None,
+                                   users=None):
+        """Make a synchronous call to create databases and users in one
+           batch, returning the statement count and timings"""
+        LOG.debug("Creating databases and users for Instance %s", id)
+        return self._call(context, id,
+                 {"method": "create_users_and_databases",
+                  "args": {"databases": databases,
+                           "users": users}
+                 }, timeout=FLAGS.guest_long_call_timeout)
+
+    def list_users(self, context, id, timeout=None):
         """Make an asynchronous call to list database users"""
         LOG.debug("Listing Users for Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "list_users"})
+        return self._call(context, id, {"method": "list_users"},
+                          timeout=timeout)
 
     def delete_user(self, context, id, user):
         """Make an asynchronous call to delete an existing database user"""
@@ -76,11 +234,11 @@ class API(base.Base):
                   "args": {"databases": databases}
                  })
 
-    def list_databases(self, context, id):
+    def list_databases(self, context, id, timeout=None):
         """Make an asynchronous call to list database users"""
         LOG.debug("Listing Users for Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "list_databases"})
+        return self._call(context, id, {"method": "list_databases"},
+                          timeout=timeout)
 
     def delete_database(self, context, id, database):
         """Make an asynchronous call to delete an existing database
@@ -96,28 +254,25 @@ class API(base.Base):
         """Make a synchronous call to enable the root user for
            access from anywhere"""
         LOG.debug("Enable root user for Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "enable_root"})
+        return self._call(context, id, {"method": "enable_root"})
 
     def disable_root(self, context, id):
         """Make a synchronous call to disable the root user for
            access from anywhere"""
         LOG.debug("Disable root user for Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "disable_root"})
+        return self._call(context, id, {"method": "disable_root"})
 
-    def is_root_enabled(self, context, id):
+    def is_root_enabled(self, context, id, timeout=None):
         """Make a synchronous call to check if root access is
            available for the container"""
         LOG.debug("Check root access for Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "is_root_enabled"})
+        return self._call(context, id, {"method": "is_root_enabled"},
+                          timeout=timeout)
 
     def get_diagnostics(self, context, id):
         """Make a synchronous call to get diagnostics for the container"""
         LOG.debug("Check diagnostics on Instance %s", id)
-        return rpc.call(context, self._get_routing_key(context, id),
-                 {"method": "get_diagnostics"})
+        return self._call(context, id, {"method": "get_diagnostics"})
 
     def prepare(self, context, id, memory_mb, databases=None, users=None):
         """Make an asynchronous call to prepare the guest
@@ -133,19 +288,19 @@ class API(base.Base):
     def restart(self, context, id):
         """Restart the MySQL server."""
         LOG.debug(_("Sending the call to restart MySQL on the Guest."))
-        rpc.call(context, self._get_routing_key(context, id),
+        self._call(context, id,
                  {"method": "restart",
                   "args": {}
-                 })
+                 }, timeout=FLAGS.guest_long_call_timeout)
 
     def start_mysql_with_conf_changes(self, context, id, updated_memory_size):
         """Start the MySQL server."""
         LOG.debug(_("Sending the call to start MySQL on the Guest."))
         try:
-            rpc.call(context, self._get_routing_key(context, id),
+            self._call(context, id,
                     {"method": "start_mysql_with_conf_changes",
                      "args": {'updated_memory_size':updated_memory_size}
-                    })
+                    }, timeout=FLAGS.guest_long_call_timeout)
         except Exception as e:
             LOG.error(e)
             raise exception.GuestError(original_message=str(e))
@@ -154,28 +309,29 @@ class API(base.Base):
         """Stop the MySQL server."""
         LOG.debug(_("Sending the call to stop MySQL on the Guest."))
         try:
-            rpc.call(context, self._get_routing_key(context, id),
+            self._call(context, id,
                     {"method": "stop_mysql",
                      "args": {}
-                    })
+                    }, timeout=FLAGS.guest_long_call_timeout)
         except Exception as e:
             LOG.error(e)
             raise exception.GuestError(original_message=str(e))
 
     def update_guest(self, context, id):
         """Make a synchronous call to update the guest agent."""
-        rpc.call(context, self._get_routing_key(context, id),
+        self._call(context, id,
                 {"method": "update_guest",
                  "args": {}
-            })
+            }, timeout=FLAGS.guest_long_call_timeout)
 
-    def get_volume_info(self, context, id):
+    def get_volume_info(self, context, id, timeout=None):
         """Make a synchronous call to get volume info for the container"""
         LOG.debug("Check Volume Info on Instance %s", id)
         try:
-            return rpc.call(context, self._get_routing_key(context, id),
-                            {"method": "get_filesystem_stats",
-                             "args": {"fs_path": "/var/lib/mysql"}})
+            return self._call(context, id,
+                              {"method": "get_filesystem_stats",
+                               "args": {"fs_path": "/var/lib/mysql"}},
+                              timeout=timeout)
         except Exception as e:
             LOG.error(e)
             raise exception.GuestError(original_message=str(e))
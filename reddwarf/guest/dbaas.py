@@ -28,6 +28,7 @@ handles RPC calls relating to Platform specific operations.
 
 import os
 import re
+import time
 import uuid
 
 from datetime import date
@@ -36,23 +37,52 @@ from sqlalchemy import exc
 from sqlalchemy import interfaces
 from sqlalchemy.sql.expression import text
 
+from nova import context
 from nova import flags
 from nova import log as logging
+from nova import rpc
+from nova.db import api as nova_db
 from nova.exception import ProcessExecutionError
 
 from reddwarf.db import api as dbapi
 from reddwarf.guest import utils as guest_utils, utils
 from reddwarf.guest.db import models
 from reddwarf.guest import status as guest_status
+from reddwarf.reaper import api as reaper_api
 
 ADMIN_USER_NAME = "os_admin"
 LOG = logging.getLogger('nova.guest.dbaas')
 FLAGS = flags.FLAGS
+flags.DEFINE_string('guest_status_report_mode', 'db',
+                    'How the guest reports the MySQL status. "db" writes '
+                    'every periodic tick to the database, "rpc" only sends '
+                    'changes and heartbeats to the reaper, which writes '
+                    'them in bulk.')
+flags.DEFINE_integer('guest_status_heartbeat_interval', 10 * 60,
+                     'Seconds between unchanged status reports sent as '
+                     'heartbeats when guest_status_report_mode is "rpc".')
+flags.DEFINE_boolean('guest_sql_echo', False,
+                     'Log every statement the guest agent runs on MySQL.')
+flags.DEFINE_integer('guest_status_min_interval', 5,
+                     'Seconds between MySQL status probes right after the '
+                     'status changed. Also used as the periodic interval of '
+                     'the guest service.')
+flags.DEFINE_integer('guest_status_max_interval', 60,
+                     'Longest time in seconds between MySQL status probes, '
+                     'reached while the status stays the same.')
 FLUSH = text("""FLUSH PRIVILEGES;""")
+PING = text("""SELECT 1;""")
+DEFAULT_PID_FILE = "/var/run/mysqld/mysqld.pid"
+# Client errors meaning mysqld did not answer at all. Any other error, like
+# an access denied, still shows the server is up.
+MYSQL_DOWN_ERRORS = (2002, 2003, 2006, 2013)
 
 ENGINE = None
+PROBE_ENGINE = None
 MYSQLD_ARGS = None
 PREPARING = False
+STATUS_REPORTER = None
+STATUS_SCHEDULE = None
 
 
 def generate_random_password():
@@ -73,7 +103,8 @@ def get_engine():
         if not err:
             ENGINE = create_engine("mysql://%s:%s@localhost:3306" %
                                    (ADMIN_USER_NAME, pwd.strip()),
-                                   pool_recycle=7200, echo=True,
+                                   pool_recycle=7200,
+                                   echo=FLAGS.guest_sql_echo,
                                    listeners=[KeepAliveConnection()])
         else:
             LOG.error(_(err))
@@ -96,30 +127,284 @@ def load_mysqld_options():
         return None
 
 
+def get_mysqld_pid_file():
+    """Return the pid file of mysqld, asking mysqld for it only once."""
+    global MYSQLD_ARGS
+    if MYSQLD_ARGS is None:
+        MYSQLD_ARGS = load_mysqld_options() or {}
+    return MYSQLD_ARGS.get('pid-file', DEFAULT_PID_FILE)
+
+
+def ping_mysql():
+    """Return True if mysqld answers a query on a pooled connection.
+
+    The admin engine is used once it exists. Until then, an anonymous engine
+    is used, so that the admin engine isn't created before prepare writes
+    the admin password.
+    """
+    global PROBE_ENGINE
+    engine = ENGINE
+    if not engine:
+        if not PROBE_ENGINE:
+            PROBE_ENGINE = create_engine("mysql://localhost:3306",
+                                         pool_recycle=7200,
+                                         echo=FLAGS.guest_sql_echo,
+                                         listeners=[KeepAliveConnection()])
+        engine = PROBE_ENGINE
+    try:
+        conn = engine.connect()
+        try:
+            conn.execute(PING)
+        finally:
+            conn.close()
+        return True
+    except exc.DBAPIError as e:
+        args = getattr(e.orig, 'args', None)
+        return bool(args) and args[0] not in MYSQL_DOWN_ERRORS
+    except exc.SQLAlchemyError as e:
+        LOG.debug("Could not ping MySQL: %s" % e)
+        return False
+
+
+def _is_mysqld(pid):
+    """Return True if the process with the given pid is mysqld."""
+    try:
+        with open("/proc/%s/stat" % pid) as stat:
+            # The second field is the command name within parenthesis.
+            return stat.read().split(" ", 2)[1] == "(mysqld)"
+    except (IOError, IndexError):
+        return False
+
+
+def mysqld_is_running():
+    """Return True if a mysqld process exists, checked through /proc."""
+    try:
+        with open(get_mysqld_pid_file()) as pid_file:
+            if _is_mysqld(int(pid_file.read().strip())):
+                return True
+    except (IOError, ValueError):
+        pass
+    for pid in os.listdir("/proc"):
+        if pid.isdigit() and _is_mysqld(pid):
+            return True
+    return False
+
+
+def get_status_schedule():
+    """Return the schedule of the MySQL status probes."""
+    global STATUS_SCHEDULE
+    if not STATUS_SCHEDULE:
+        STATUS_SCHEDULE = StatusProbeSchedule(FLAGS.guest_status_min_interval,
+                                              FLAGS.guest_status_max_interval)
+    return STATUS_SCHEDULE
+
+
+class StatusProbeSchedule(object):
+    """Decides when the MySQL status is probed next.
+
+    The interval doubles each time the same status is seen again, up to
+    max_interval, and drops back to min_interval when the status changes.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min_interval
+        self.last_status = None
+        self.next_probe = 0
+
+    def is_due(self, now=None):
+        if now is None:
+            now = time.time()
+        return now >= self.next_probe
+
+    def record(self, status, now=None):
+        """Schedule the next probe after seeing the given status."""
+        if now is None:
+            now = time.time()
+        if status == self.last_status:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = self.min_interval
+        self.last_status = status
+        self.next_probe = now + self.interval
+
+
+def get_status_reporter():
+    """Return the status reporter for the configured report mode."""
+    global STATUS_REPORTER
+    if not STATUS_REPORTER:
+        STATUS_REPORTER = GuestStatusReporter(FLAGS.guest_status_report_mode)
+    return STATUS_REPORTER
+
+
+def _validate_databases(databases):
+    """Deserialize the databases, raising ValueError if any is invalid."""
+    mydbs = []
+    errors = []
+    for item in databases:
+        mydb = models.MySQLDatabase()
+        try:
+            mydb.name = item.get('_name')
+            mydb.character_set = item.get('_character_set')
+            mydb.collate = item.get('_collate')
+        except ValueError as e:
+            errors.append(str(e))
+        mydbs.append(mydb)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return mydbs
+
+
+def _validate_users(users):
+    """Deserialize the users, raising ValueError if any is invalid."""
+    myusers = []
+    errors = []
+    for item in users:
+        user = models.MySQLUser()
+        try:
+            user.name = item.get('_name')
+            user.password = item.get('_password')
+            for database in item.get('_databases', []):
+                user.databases = database.get('_name')
+        except ValueError as e:
+            errors.append(str(e))
+        myusers.append(user)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return myusers
+
+
+class GuestStatusReporter(object):
+    """Reports the status of the guest, skipping unchanged reports.
+
+    In "db" mode every report is written to the database, and the compute
+    host is told about changes so provisioning doesn't wait for its next
+    poll. In "rpc" mode only changes, plus a heartbeat every
+    guest_status_heartbeat_interval seconds, are sent to the reaper.
+    """
+
+    def __init__(self, mode='db', heartbeat_interval=None):
+        if mode not in ('db', 'rpc'):
+            raise ValueError("Unknown guest status report mode %s." % mode)
+        self.mode = mode
+        self.heartbeat_interval = heartbeat_interval or \
+                                  FLAGS.guest_status_heartbeat_interval
+        self.last_status = None
+        self.last_report_time = None
+        self.reports_sent = 0
+        self.reports_skipped = 0
+        self.compute_host = None
+
+    def _notify_compute(self, instance_id, status):
+        """Tell the compute host waiting on this guest its status changed."""
+        ctxt = context.get_admin_context()
+        try:
+            if not self.compute_host:
+                instance = nova_db.instance_get(ctxt, instance_id)
+                self.compute_host = instance['host']
+            topic = nova_db.queue_get_for(ctxt, FLAGS.compute_topic,
+                                          self.compute_host)
+            rpc.cast(ctxt, topic, {'method': 'guest_status_changed',
+                                   'args': {'instance_id': instance_id,
+                                            'state': status.code}})
+        except Exception as e:
+            LOG.error("Could not notify compute of the status change: %s"
+                      % e)
+
+    def report(self, instance_id, status):
+        """Report the status, returning False if it was skipped."""
+        if self.mode == 'db':
+            dbapi.guest_status_update(instance_id, status)
+            if status != self.last_status:
+                self._notify_compute(instance_id, status)
+                self.last_status = status
+            self.reports_sent += 1
+            return True
+        now = time.time()
+        heartbeat = status == self.last_status
+        if heartbeat and \
+           now - self.last_report_time < self.heartbeat_interval:
+            self.reports_skipped += 1
+            return False
+        reaper_api.API().report_guest_status(context.get_admin_context(),
+                                             instance_id, status,
+                                             heartbeat=heartbeat)
+        self.last_status = status
+        self.last_report_time = now
+        self.reports_sent += 1
+        return True
+
+
 class DBaaSAgent(object):
     """ Database as a Service Agent Controller """
 
     def create_user(self, users):
         """Create users and grant them privileges for the
            specified databases"""
+        return self.create_users_and_databases(users=users)
+
+    def create_users_and_databases(self, databases=None, users=None):
+        """Create databases and users, granting the users their databases.
+
+        The whole batch is validated before anything is created. All the
+        users are then created with one statement and each database is
+        granted to all of its users with one statement, on a single
+        connection that flushes the privileges once. Returns the number of
+        statements run and the time in seconds each phase took.
+        """
+        start = time.time()
+        timings = {}
+        mydbs = _validate_databases(databases or [])
+        myusers = _validate_users(users or [])
+        timings['validate'] = time.time() - start
+        statements = 0
         host = "%"
         client = LocalSqlClient(get_engine())
         with client:
-            for item in users:
-                user = models.MySQLUser()
-                user.deserialize(item)
+            phase_start = time.time()
+            for mydb in mydbs:
+                t = text("""CREATE DATABASE IF NOT EXISTS
+                            `%s` CHARACTER SET = %s COLLATE = %s;"""
+                         % (mydb.name, mydb.character_set, mydb.collate))
+                client.execute(t)
+                statements += 1
+            timings['databases'] = time.time() - phase_start
+
+            phase_start = time.time()
+            if myusers:
                 # TODO(cp16net):Should users be allowed to create users
                 # 'os_admin' or 'debian-sys-maint'
-                t = text("""CREATE USER `%s`@:host IDENTIFIED BY '%s';"""
-                         % (user.name, user.password))
+                specs = ["`%s`@:host IDENTIFIED BY '%s'"
+                         % (user.name, user.password) for user in myusers]
+                t = text("CREATE USER %s;" % ", ".join(specs))
                 client.execute(t, host=host)
+                statements += 1
+            timings['users'] = time.time() - phase_start
+
+            phase_start = time.time()
+            grantees = {}
+            for user in myusers:
                 for database in user.databases:
-                    mydb = models.MySQLDatabase()
-                    mydb.deserialize(database)
-                    t = text("""
-                            GRANT ALL PRIVILEGES ON `%s`.* TO `%s`@:host;"""
-                            % (mydb.name, user.name))
-                    client.execute(t, host=host)
+                    names = grantees.setdefault(database['_name'], [])
+                    names.append(user.name)
+            for dbname, names in grantees.items():
+                t = text("GRANT ALL PRIVILEGES ON `%s`.* TO %s;"
+                         % (dbname, ", ".join("`%s`@:host" % name
+                                              for name in names)))
+                client.execute(t, host=host)
+                statements += 1
+            timings['grants'] = time.time() - phase_start
+            phase_start = time.time()
+        timings['commit'] = time.time() - phase_start
+        timings['total'] = time.time() - start
+        LOG.debug("Created %d databases and %d users with %d statements in "
+                  "%.3fs." % (len(mydbs), len(myusers), statements,
+                              timings['total']))
+        return {'databases': len(mydbs),
+                'users': len(myusers),
+                'statements': statements,
+                'timings': timings}
 
     def list_users(self):
         """List users that have access to the database"""
@@ -151,15 +436,7 @@ class DBaaSAgent(object):
 
     def create_database(self, databases):
         """Create the list of specified databases"""
-        client = LocalSqlClient(get_engine())
-        with client:
-            for item in databases:
-                mydb = models.MySQLDatabase()
-                mydb.deserialize(item)
-                t = text("""CREATE DATABASE IF NOT EXISTS
-                            `%s` CHARACTER SET = %s COLLATE = %s;"""
-                         % (mydb.name, mydb.character_set, mydb.collate))
-                client.execute(t)
+        return self.create_users_and_databases(databases=databases)
 
     def list_databases(self):
         """List databases the user created on this mysql instance"""
@@ -255,6 +532,33 @@ class DBaaSAgent(object):
             LOG.debug("result = " + str(result))
             return result.rowcount != 0
 
+    def get_filesystem_stats(self, fs_path):
+        """Return the total, free and used bytes of the filesystem."""
+        stats = os.statvfs(fs_path)
+        total = stats.f_blocks * stats.f_bsize
+        free = stats.f_bfree * stats.f_bsize
+        return {'total': total, 'free': free, 'used': total - free}
+
+    def get_summary(self, fields=None):
+        """Return the root, volume, database and user details in one call.
+
+        Only the requested fields are gathered.
+        """
+        getters = {
+            'root_enabled': self.is_root_enabled,
+            'volume_info':
+                lambda: self.get_filesystem_stats("/var/lib/mysql"),
+            'databases': self.list_databases,
+            'users': self.list_users,
+        }
+        if fields is None:
+            fields = ('root_enabled', 'volume_info', 'databases', 'users')
+        summary = {}
+        for field in fields:
+            getter = getters.get(field)
+            summary[field] = getter() if getter else None
+        return summary
+
     def prepare(self, databases):
         """Makes ready DBAAS on a Guest container."""
         global PREPARING
@@ -268,33 +572,32 @@ class DBaaSAgent(object):
         PREPARING = False
 
     def update_status(self):
-        """Update the status of the MySQL service"""
-        global MYSQLD_ARGS
-        global PREPARING
+        """Update the status of the MySQL service when a probe is due"""
+        schedule = get_status_schedule()
+        if not schedule.is_due():
+            return
         instance_id = guest_utils.get_instance_id()
+        status = self._get_actual_status()
+        schedule.record(status)
+        get_status_reporter().report(instance_id, status)
 
-        if PREPARING:
-            dbapi.guest_status_update(instance_id, guest_status.BUILDING)
-            return
+    def _get_actual_status(self):
+        """Find the current status of the MySQL service"""
+        global PREPARING
 
-        try:
-            out, err = utils.execute("/usr/bin/mysqladmin", "ping", run_as_root=True)
-            dbapi.guest_status_update(instance_id, guest_status.RUNNING)
-        except ProcessExecutionError as e:
-            try:
-                out, err = utils.execute("ps", "-C", "mysqld", "h")
-                pid = out.split()[0]
-                # TODO(rnirmal): Need to create new statuses for instances where
-                # the mysql service is up, but unresponsive
-                dbapi.guest_status_update(instance_id, guest_status.BLOCKED)
-            except ProcessExecutionError as e:
-                if not MYSQLD_ARGS:
-                    MYSQLD_ARGS = load_mysqld_options()
-                pid_file = MYSQLD_ARGS.get('pid-file', '/var/run/mysqld/mysqld.pid')
-                if os.path.exists(pid_file):
-                    dbapi.guest_status_update(instance_id, guest_status.CRASHED)
-                else:
-                    dbapi.guest_status_update(instance_id, guest_status.SHUTDOWN)
+        if PREPARING:
+            return guest_status.BUILDING
+
+        if ping_mysql():
+            return guest_status.RUNNING
+        if mysqld_is_running():
+            # TODO(rnirmal): Need to create new statuses for instances where
+            # the mysql service is up, but unresponsive
+            return guest_status.BLOCKED
+        if os.path.exists(get_mysqld_pid_file()):
+            return guest_status.CRASHED
+        else:
+            return guest_status.SHUTDOWN
 
 
 class LocalSqlClient(object):
@@ -0,0 +1,66 @@
+#    Copyright 2011 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Handles all requests to the Reaper Manager.
+"""
+
+
+from nova import flags
+from nova import log as logging
+from nova import rpc
+from nova.db import base
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('reaper_topic', 'reaper',
+                    'the topic reaper nodes listen on')
+
+LOG = logging.getLogger('reddwarf.reaper.api')
+
+
+class API(base.Base):
+    """API for interacting with the reaper manager."""
+
+    def __init__(self, **kwargs):
+        super(API, self).__init__(**kwargs)
+
+    def report_guest_status(self, context, instance_id, status,
+                            heartbeat=False):
+        """Make an asynchronous call to report the state of a guest.
+
+        :param instance_id: local id of the instance the guest runs on.
+        :param status: the GuestStatus being reported.
+        :param heartbeat: True if the status has not changed since the last
+                          report and is only being sent as a keep alive.
+
+        """
+        LOG.debug("Reporting status %s for instance %s (heartbeat=%s)"
+                  % (status.description, instance_id, heartbeat))
+        rpc.cast(context, FLAGS.reaper_topic,
+                 {'method': 'report_guest_status',
+                  'args': {'instance_id': instance_id,
+                           'state': status.code,
+                           'heartbeat': heartbeat}})
+
+    def get_guest_status_stats(self, context):
+        """Make a synchronous call to fetch the status collector counters."""
+        return rpc.call(context, FLAGS.reaper_topic,
+                        {'method': 'get_guest_status_stats',
+                         'args': {}})
+
+    def get_reaper_stats(self, context):
+        """Make a synchronous call to fetch the reaper counters and report."""
+        return rpc.call(context, FLAGS.reaper_topic,
+                        {'method': 'get_reaper_stats',
+                         'args': {}})
@@ -0,0 +1,84 @@
+#    Copyright 2011 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Collects guest status reports and writes them to the database in bulk.
+"""
+
+from nova import log as logging
+
+from reddwarf.db import api as reddwarf_db
+from reddwarf.guest.status import GuestStatus
+
+
+LOG = logging.getLogger('reddwarf.reaper.collector')
+
+
+class GuestStatusCollector(object):
+    """Merges status reports sent by the guests between two flushes.
+
+    Only the most recent report for each instance is kept, and a flush writes
+    all of them with one multi-row UPDATE per distinct state.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.received = 0
+        self.stats = {
+            'reports_received': 0,
+            'heartbeats_received': 0,
+            'reports_merged': 0,
+            'flushes': 0,
+            'writes_performed': 0,
+            'writes_avoided': 0,
+        }
+
+    def report(self, instance_id, state, heartbeat=False):
+        """Record the latest state reported for an instance."""
+        status = GuestStatus.from_code(state)
+        self.received += 1
+        self.stats['reports_received'] += 1
+        if heartbeat:
+            self.stats['heartbeats_received'] += 1
+        if instance_id in self.pending:
+            self.stats['reports_merged'] += 1
+        self.pending[instance_id] = status
+
+    def flush(self):
+        """Write all pending reports, returning the number of rows changed."""
+        if not self.pending:
+            return 0
+        pending, received = self.pending, self.received
+        self.pending, self.received = {}, 0
+        try:
+            rows = reddwarf_db.guest_status_update_many(pending)
+        except Exception:
+            # Put the reports back unless a newer one arrived meanwhile.
+            for instance_id, status in pending.items():
+                self.pending.setdefault(instance_id, status)
+            self.received += received
+            raise
+        self.stats['flushes'] += 1
+        self.stats['writes_performed'] += rows
+        # Merged reports and reports that matched the stored state were both
+        # absorbed here instead of each costing an UPDATE.
+        self.stats['writes_avoided'] += received - rows
+        LOG.debug("Flushed %d guest status reports, %d rows changed."
+                  % (len(pending), rows))
+        return rows
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = len(self.pending)
+        return stats
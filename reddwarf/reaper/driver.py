@@ -15,13 +15,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 from datetime import timedelta
+from eventlet import greenpool
 
+from nova import db
 from nova import flags
 from nova import log as logging
 from nova import volume
 from nova import utils
+from nova.compute import power_state
+from nova.compute import vm_states
 from reddwarf.db import api as reddwarf_db
+from reddwarf.dns import api as dns_api
+from reddwarf.guest import status as guest_status
 
 
 FLAGS = flags.FLAGS
@@ -31,6 +39,31 @@ LOG = logging.getLogger(__name__)
 flags.DEFINE_integer('reddwarf_reaper_orphan_volume_expiration_time',
                      60 * 60 * 24 * 7,
                      'Time until reaper will destroy orphaned volumes.')
+flags.DEFINE_integer('reddwarf_reaper_guest_status_expiration_time',
+                     60 * 60 * 24 * 7,
+                     'Time until reaper will purge deleted guest statuses.')
+flags.DEFINE_integer('reddwarf_reaper_dns_record_expiration_time',
+                     60 * 60,
+                     'Time until reaper will delete dns records that belong '
+                     'to no instance.')
+flags.DEFINE_integer('reddwarf_reaper_build_grace_time', 60 * 10,
+                     'Time past reddwarf_guest_initialize_time_out until '
+                     'reaper will fail instances still building.')
+flags.DEFINE_integer('reddwarf_reaper_page_size', 100,
+                     'Number of resources of each kind the reaper looks at '
+                     'in one run.')
+flags.DEFINE_integer('reddwarf_reaper_workers', 4,
+                     'Number of resources the reaper cleans up at once.')
+flags.DEFINE_integer('reddwarf_reaper_deletes_per_minute', 30,
+                     'Maximum number of volumes and dns records the reaper '
+                     'deletes per minute, 0 for no limit.')
+flags.DEFINE_boolean('reddwarf_reaper_dry_run', False,
+                     'Only report what the reaper would clean up.')
+flags.DEFINE_string('reddwarf_reaper_dns_record_type', 'A',
+                    'Type of the dns records created for instances.')
+flags.DECLARE('reddwarf_guest_initialize_time_out',
+              'reddwarf.compute.manager')
+flags.DECLARE('dns_instance_entry_factory', 'reddwarf.dns')
 
 
 class ReaperDriver(object):
@@ -39,27 +72,225 @@ class ReaperDriver(object):
         pass
 
 
+class DeleteRateLimiter(object):
+    """Spreads deletes out to no more than a number per minute.
+
+    Deletes beyond the limit are not waited for but left to a later run, so
+    the periodic task never stalls.
+    """
+
+    def __init__(self, per_minute, timer=time.time):
+        self.per_minute = per_minute
+        self.timer = timer
+        self.allowance = float(per_minute)
+        self.last_check = timer()
+
+    def acquire(self):
+        """Takes one delete from the allowance, returning False if empty."""
+        if not self.per_minute:
+            return True
+        now = self.timer()
+        self.allowance = min(float(self.per_minute),
+                             self.allowance +
+                             (now - self.last_check) * self.per_minute / 60.0)
+        self.last_check = now
+        if self.allowance < 1:
+            return False
+        self.allowance -= 1
+        return True
+
+
 class ReddwarfReaperDriver(object):
     """
     Searches for failed resources.
+
+    Each kind of leaked resource is looked at one page per run, picking up
+    after the last resource of the previous page.  The clean up work is
+    shared out to a small pool of green threads, and the volume and dns
+    deletes are held to reddwarf_reaper_deletes_per_minute.
     """
     def __init__(self, orphan_time_out=None):
         self.volume_api = volume.API()
+        self.dns_api = dns_api.API()
         self.orphan_time_out = orphan_time_out or \
             FLAGS.reddwarf_reaper_orphan_volume_expiration_time
+        self.pool = greenpool.GreenPool(FLAGS.reddwarf_reaper_workers)
+        self.limiter = DeleteRateLimiter(
+            FLAGS.reddwarf_reaper_deletes_per_minute)
+        # (name, find, key, describe, reap, rate limited)
+        self.categories = [
+            ('orphaned_volumes', self.find_orphaned_volumes,
+             lambda volume_ref: volume_ref['id'],
+             self.describe_volume, self.reap_volume, True),
+            ('deleted_guest_statuses', self.find_deleted_guest_statuses,
+             lambda status: status['instance_id'],
+             lambda status: "guest status of instance %s"
+                            % status['instance_id'],
+             self.reap_guest_status, False),
+            ('stale_dns_records', self.find_stale_dns_records,
+             lambda record: record['name'],
+             lambda record: "dns record %s (id=%s)"
+                            % (record['name'], record['id']),
+             self.reap_dns_record, True),
+            ('stuck_builds', self.find_stuck_builds,
+             lambda instance: instance['id'],
+             lambda instance: "instance %s building since %s"
+                              % (instance['id'], instance['created_at']),
+             self.reap_stuck_build, False),
+        ]
+        self.markers = {}
+        self.stats = {}
+        self.reports = {}
+        for category in self.categories:
+            self.stats[category[0]] = {
+                'found': 0,
+                'reaped': 0,
+                'failed': 0,
+                'deferred': 0,
+                'would_reap': 0,
+                'runs': 0,
+                'last_run_seconds': 0.0,
+            }
+            self.reports[category[0]] = []
 
-    def clean_up_volumes(self, context):
+    @staticmethod
+    def _before(seconds):
+        return utils.utcnow() - timedelta(seconds=seconds)
+
+    def find_orphaned_volumes(self, context, marker, limit):
         """Finds all volumes which are not associated to an instance."""
-        expiration_time = self.orphan_time_out
-        latest_valid_time = utils.utcnow() - timedelta(seconds=expiration_time)
-        LOG.debug("Preparing to delete orphaned volumes updated before %s" %
+        latest_valid_time = self._before(self.orphan_time_out)
+        LOG.debug("Looking for orphaned volumes updated before %s" %
                   latest_valid_time)
-        volumes = reddwarf_db.volume_get_orphans(context, latest_valid_time)
-        if volumes:
-            for volume_ref in volumes:
-                self.volume_api.delete(context, volume_ref['id'])
-                LOG.warn("Deleting an orphaned volume, %s with description %s" %
-                         (volume_ref['id'], volume_ref['display_description']))
+        return reddwarf_db.volume_get_orphans(context, latest_valid_time,
+                                              marker=marker, limit=limit)
+
+    @staticmethod
+    def describe_volume(volume_ref):
+        return ("orphaned volume %s with description %s"
+                % (volume_ref['id'], volume_ref['display_description']))
+
+    def reap_volume(self, context, volume_ref):
+        LOG.warn("Deleting an orphaned volume, %s with description %s" %
+                 (volume_ref['id'], volume_ref['display_description']))
+        self.volume_api.delete(context, volume_ref['id'])
+
+    def find_deleted_guest_statuses(self, context, marker, limit):
+        """Finds guest statuses deleted along with their instance."""
+        latest_valid_time = self._before(
+            FLAGS.reddwarf_reaper_guest_status_expiration_time)
+        return reddwarf_db.guest_status_get_deleted_before(
+            latest_valid_time, marker=marker, limit=limit)
+
+    def reap_guest_status(self, context, status):
+        reddwarf_db.guest_status_purge(status['instance_id'])
+
+    def find_stale_dns_records(self, context, marker, limit):
+        """Finds dns records whose instance is gone."""
+        factory = utils.import_object(FLAGS.dns_instance_entry_factory)
+        live_names = set()
+        # NOTE: the factories are handed the instance refs they get when an
+        # entry is created, as some of them name the entry after the ref.
+        for instance_ref in reddwarf_db.instance_get_all_live(context):
+            entry = factory.create_entry(instance_ref)
+            if entry is None:
+                # Instances do not get dns entries.
+                return []
+            live_names.add(entry.name)
+        latest_valid_time = self._before(
+            FLAGS.reddwarf_reaper_dns_record_expiration_time)
+        records = reddwarf_db.rsdns_record_get_created_before(
+            latest_valid_time, marker=marker, limit=limit)
+        if len(records) >= limit:
+            # Most records on a page are live, so the next page starts after
+            # the last record looked at rather than the last stale one.
+            self.markers['stale_dns_records'] = records[-1]['name']
+        return [record for record in records
+                if record['name'] not in live_names]
+
+    def reap_dns_record(self, context, record):
+        LOG.warn("Deleting dns record %s, which belongs to no instance."
+                 % record['name'])
+        self.dns_api.delete_entry(context, record['name'],
+                                  FLAGS.reddwarf_reaper_dns_record_type)
+
+    def find_stuck_builds(self, context, marker, limit):
+        """Finds instances building for longer than a guest may take."""
+        latest_valid_time = self._before(
+            FLAGS.reddwarf_guest_initialize_time_out +
+            FLAGS.reddwarf_reaper_build_grace_time)
+        return reddwarf_db.instance_get_building_before(
+            context, latest_valid_time, marker=marker, limit=limit)
+
+    def reap_stuck_build(self, context, instance):
+        LOG.warn("Failing instance %s, which is still building since %s."
+                 % (instance['id'], instance['created_at']))
+        db.instance_update(context, instance['id'],
+                           {'power_state': power_state.FAILED,
+                            'vm_state': vm_states.ERROR})
+        reddwarf_db.guest_status_update(instance['id'], guest_status.FAILED)
+
+    def _reap_one(self, context, name, reap, item, description):
+        try:
+            reap(context, item)
+            self.stats[name]['reaped'] += 1
+        except Exception as e:
+            self.stats[name]['failed'] += 1
+            LOG.error("Unable to clean up %s: %s" % (description, e))
+
+    def reap(self, context, name, find, key, describe, reap, rate_limited):
+        """Cleans up one page of a kind of leaked resource."""
+        stats = self.stats[name]
+        start = time.time()
+        limit = FLAGS.reddwarf_reaper_page_size
+        marker = self.markers.pop(name, None)
+        items = find(context, marker, limit)
+        stats['found'] += len(items)
+        stats['runs'] += 1
+        report = []
+        last_done = None
+        deferred = False
+        for item in items:
+            description = describe(item)
+            if FLAGS.reddwarf_reaper_dry_run:
+                stats['would_reap'] += 1
+                report.append(description)
+                LOG.info("Would clean up %s." % description)
+            elif rate_limited and not self.limiter.acquire():
+                stats['deferred'] += len(items) - len(report)
+                deferred = True
+                break
+            else:
+                report.append(description)
+                self.pool.spawn_n(self._reap_one, context, name, reap, item,
+                                  description)
+            last_done = key(item)
+        self.pool.waitall()
+        # The next run picks up after the last resource handled, unless this
+        # page was the last one and was handled completely.
+        if deferred:
+            resume = last_done if last_done is not None else marker
+            self.markers.pop(name, None)
+            if resume is not None:
+                self.markers[name] = resume
+        elif last_done is not None and len(items) >= limit:
+            self.markers.setdefault(name, last_done)
+        self.reports[name] = report
+        stats['last_run_seconds'] = time.time() - start
+        return report
+
+    def get_stats(self):
+        """Returns the counters and last report for each kind of resource."""
+        stats = {}
+        for name, counters in self.stats.items():
+            stats[name] = dict(counters)
+            stats[name]['last_report'] = list(self.reports[name])
+        stats['dry_run'] = FLAGS.reddwarf_reaper_dry_run
+        return stats
 
     def periodic_tasks(self, context):
-        self.clean_up_volumes(context)
+        for category in self.categories:
+            try:
+                self.reap(context, *category)
+            except Exception as e:
+                LOG.error("Unable to look for %s: %s" % (category[0], e))
@@ -22,6 +22,7 @@ from nova import log as logging
 from nova import manager
 from nova import utils
 from reddwarf.reaper import driver
+from reddwarf.reaper.collector import GuestStatusCollector
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('reaper_driver', 'nova.reaper.driver.ReaperDriver',
@@ -42,6 +43,7 @@ class ReaperManager(manager.SchedulerDependentManager):
         except ImportError as e:
             LOG.error("Unable to load the Reaper driver: %s" % e)
             sys.exit(1)
+        self.status_collector = GuestStatusCollector()
 
     def init_host(self):
         pass
@@ -49,4 +51,24 @@ class ReaperManager(manager.SchedulerDependentManager):
     def periodic_tasks(self, context=None):
         """Tasks to be run at a periodic interval."""
         super(ReaperManager, self).periodic_tasks(context)
+        try:
+            self.status_collector.flush()
+        except Exception as e:
+            LOG.error("Unable to flush guest status reports: %s" % e)
         self.driver.periodic_tasks(context)
+
+    def report_guest_status(self, context, instance_id, state,
+                            heartbeat=False):
+        """Queue a status reported by a guest for the next bulk write."""
+        self.status_collector.report(instance_id, state, heartbeat)
+
+    def get_guest_status_stats(self, context):
+        """Return the counters of the guest status collector."""
+        return self.status_collector.get_stats()
+
+    def get_reaper_stats(self, context):
+        """Return what the driver has cleaned up, or would in a dry run."""
+        get_stats = getattr(self.driver, 'get_stats', None)
+        if get_stats is None:
+            return {}
+        return get_stats()
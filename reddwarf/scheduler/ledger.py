@@ -0,0 +1,153 @@
+#    Copyright 2011 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Keeps track of the instance memory used on each compute host in the scheduler.
+"""
+
+import itertools
+import time
+
+from nova import flags
+from nova import log as logging
+
+from reddwarf.db import api as db_api
+from reddwarf.exception import OutOfInstanceMemory
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('reddwarf_ledger_resync_interval', 20,
+                     'Seconds between reloading the memory used on each host '
+                     'from the database. Keep it well under '
+                     'service_down_time, as host liveness is judged from the '
+                     'service rows loaded with it.')
+flags.DEFINE_integer('reddwarf_reservation_ttl', 5 * 60,
+                     'Seconds a memory reservation that is neither committed '
+                     'nor rolled back is held before it is released.')
+
+LOG = logging.getLogger('reddwarf.scheduler.ledger')
+
+
+class CapacityLedger(object):
+    """The memory used and reserved on each compute host.
+
+    The used memory is loaded from the database every resync interval and
+    raised by each placement in between, so placing an instance only looks at
+    this in-memory table.  Reservations are taken and released without
+    yielding to other green threads, so two placements can never both take
+    the last of a host's memory.
+
+    """
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self.hosts = {}
+        self.reservations = {}
+        self.last_resync = None
+        self._ids = itertools.count(1)
+
+    def resync(self, context, force=False):
+        """Reload the used memory and services from the database if due."""
+        now = self.timer()
+        if not force and self.last_resync is not None and \
+           now - self.last_resync < FLAGS.reddwarf_ledger_resync_interval:
+            return False
+        hosts = {}
+        for service, memory_mb in db_api.service_get_all_compute_memory(
+                context):
+            previous = self.hosts.get(service['host'], {})
+            hosts[service['host']] = {
+                'service': service,
+                'used': memory_mb or 0,
+                'capacity': previous.get('capacity',
+                                         FLAGS.max_instance_memory_mb)}
+        self.hosts = hosts
+        self.last_resync = now
+        LOG.debug("Loaded the memory used on %d compute hosts." % len(hosts))
+        return True
+
+    def update_capabilities(self, host, capabilities):
+        """Cap a host at the instance memory it reported it can hold."""
+        if host not in self.hosts:
+            return
+        capacity = FLAGS.max_instance_memory_mb
+        reported = capabilities.get('host_memory_total')
+        if reported:
+            capacity = min(capacity, reported)
+        self.hosts[host]['capacity'] = capacity
+
+    def _expire(self):
+        now = self.timer()
+        for key, reservation in self.reservations.items():
+            if reservation['expires'] <= now:
+                LOG.warn("Reservation %s of %d MB on %s expired." %
+                         (key, reservation['memory_mb'], reservation['host']))
+                del self.reservations[key]
+
+    def reserved(self, host):
+        """Returns the memory held by live reservations on a host."""
+        return sum(reservation['memory_mb']
+                   for reservation in self.reservations.values()
+                   if reservation['host'] == host)
+
+    def free(self, host):
+        """Returns the instance memory still available on a host."""
+        state = self.hosts[host]
+        return state['capacity'] - state['used'] - self.reserved(host)
+
+    def hosts_by_usage(self):
+        """Returns (service, free memory) for each host, least used first."""
+        self._expire()
+        usage = [(state['used'] + self.reserved(host), host)
+                 for host, state in self.hosts.iteritems()]
+        return [(self.hosts[host]['service'], self.free(host))
+                for _used, host in sorted(usage)]
+
+    def reserve(self, host, memory_mb, ttl=None):
+        """Holds memory on a host, returning the id of the reservation.
+
+        :raises OutOfInstanceMemory: if the host does not have memory_mb free.
+
+        """
+        self._expire()
+        if host not in self.hosts or self.free(host) < memory_mb:
+            raise OutOfInstanceMemory(instance_memory_mb=memory_mb)
+        if ttl is None:
+            ttl = FLAGS.reddwarf_reservation_ttl
+        key = self._ids.next()
+        self.reservations[key] = {'host': host,
+                                  'memory_mb': memory_mb,
+                                  'expires': self.timer() + ttl}
+        return key
+
+    def commit(self, key):
+        """Turns a reservation into memory used by the host."""
+        reservation = self.reservations.pop(key, None)
+        if reservation is None:
+            LOG.warn("Reservation %s was already released." % key)
+            return
+        state = self.hosts.get(reservation['host'])
+        if state is not None:
+            state['used'] += reservation['memory_mb']
+
+    def rollback(self, key):
+        """Releases a reservation without using its memory."""
+        self.reservations.pop(key, None)
+
+    def get_stats(self):
+        self._expire()
+        return dict((host, {'used': state['used'],
+                            'reserved': self.reserved(host),
+                            'capacity': state['capacity']})
+                    for host, state in self.hosts.iteritems())
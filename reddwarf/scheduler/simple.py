@@ -22,6 +22,7 @@ Simple Scheduler
 """
 
 from nova import db
+from nova import exception
 from nova import flags
 from nova import utils
 from nova import log as logging
@@ -31,8 +32,8 @@ from nova.notifier import api as notifier
 from nova.scheduler import driver
 from nova.scheduler import chance
 
-from reddwarf.db import api as db_api
 from reddwarf.exception import OutOfInstanceMemory
+from reddwarf.scheduler.ledger import CapacityLedger
 
 FLAGS = flags.FLAGS
 flags.DEFINE_integer("max_cores", 16,
@@ -43,6 +44,10 @@ flags.DEFINE_integer("max_networks", 1000,
                      "maximum number of networks to allow per host")
 flags.DEFINE_integer("max_instance_memory_mb", 1024 * 15,
                      "maximum amount of memory a host can use on instances")
+flags.DEFINE_string("reddwarf_batch_strategy", "spread",
+                    "How a batch of instances is laid out: 'spread' puts each "
+                    "on the host with the most free memory, 'pack' on the "
+                    "host with the least free memory it still fits on.")
 
 LOG = logging.getLogger('nova.scheduler.simple')
 
@@ -163,20 +168,140 @@ class SimpleScheduler(chance.ChanceScheduler):
 class MemoryScheduler(SimpleScheduler):
     """Implements Naive Scheduler to find a host with the most free memory."""
 
+    def __init__(self, *args, **kwargs):
+        super(MemoryScheduler, self).__init__(*args, **kwargs)
+        self.ledger = CapacityLedger()
+
+    def _refresh_ledger(self, context):
+        """Brings the ledger up to date with the database and host reports."""
+        self.ledger.resync(context)
+        if self.zone_manager:
+            for host, services in self.zone_manager.service_states.items():
+                if 'compute' in services:
+                    self.ledger.update_capabilities(host, services['compute'])
+
     def _schedule_based_on_resources(self, context, instance_ref):
-        results = db_api.service_get_all_compute_memory(context)
-        for result in results:
-            (service, memory_mb) = result
-            needed_memory = memory_mb + instance_ref['memory_mb']
-            if needed_memory <= FLAGS.max_instance_memory_mb and \
-               self.service_is_up(service):
-                LOG.debug("Scheduling instance %s" % 
+        self._refresh_ledger(context)
+        memory_mb = instance_ref['memory_mb']
+        for service, free_memory in self.ledger.hosts_by_usage():
+            if free_memory < memory_mb or not self.service_is_up(service):
+                continue
+            reservation = self.ledger.reserve(service['host'], memory_mb)
+            try:
+                LOG.debug("Scheduling instance %s" %
                           instance_ref['display_name'])
-                return self._schedule_now_on_host(context, service['host'],
+                host = self._schedule_now_on_host(context, service['host'],
                                                   instance_ref['id'])
+            except Exception:
+                self.ledger.rollback(reservation)
+                raise
+            self.ledger.commit(reservation)
+            return host
         LOG.debug("Error scheduling %s" % instance_ref['display_name'])
         raise driver.NoValidHost(_("Insufficient memory on all hosts."))
 
+    def _plan_batch(self, instance_refs, strategy):
+        """Picks a host for each instance, largest instances first.
+
+        Only the free memory copied out of the ledger is drawn down, so a
+        plan that does not fit leaves the ledger untouched.
+
+        """
+        free = dict((service['host'], free_memory)
+                    for service, free_memory in self.ledger.hosts_by_usage()
+                    if self.service_is_up(service))
+        pick = min if strategy == 'pack' else max
+        plan = []
+        for instance_ref in sorted(instance_refs, reverse=True,
+                                   key=lambda ref: ref['memory_mb']):
+            memory_mb = instance_ref['memory_mb']
+            fits = [(free_memory, host) for host, free_memory in free.items()
+                    if free_memory >= memory_mb]
+            if not fits:
+                LOG.debug("Error scheduling %s" % instance_ref['display_name'])
+                raise driver.NoValidHost(_("Insufficient memory on all hosts "
+                                           "for the whole batch."))
+            _free_memory, host = pick(fits)
+            free[host] -= memory_mb
+            plan.append((instance_ref, host))
+        return plan
+
+    def schedule_run_instances(self, context, instance_ids, strategy=None,
+                               *_args, **_kwargs):
+        """Places a batch of instances in one pass, all of them or none.
+
+        Memory for the whole batch is reserved before any instance is given a
+        host. Returns a dict of the host picked for each instance id.
+
+        """
+        strategy = strategy or FLAGS.reddwarf_batch_strategy
+        if strategy not in ('spread', 'pack'):
+            raise exception.InvalidInput(
+                    reason=_("Unknown placement strategy %s") % strategy)
+        instance_refs = []
+        forced_refs = []
+        for instance_id in instance_ids:
+            instance_ref = db.instance_get(context, instance_id)
+            if self._availability_zone_is_set(context, instance_ref):
+                forced_refs.append(instance_ref)
+            else:
+                instance_refs.append(instance_ref)
+        self._refresh_ledger(context)
+        plan = self._plan_batch(instance_refs, strategy)
+        reservations = []
+        try:
+            for instance_ref, host in plan:
+                reservations.append(self.ledger.reserve(
+                                        host, instance_ref['memory_mb']))
+        except OutOfInstanceMemory:
+            for reservation in reservations:
+                self.ledger.rollback(reservation)
+            raise driver.NoValidHost(_("Insufficient memory on all hosts "
+                                       "for the whole batch."))
+        hosts = {}
+        try:
+            for instance_ref in forced_refs:
+                hosts[instance_ref['id']] = \
+                    self._schedule_based_on_availability_zone(context,
+                                                              instance_ref)
+            for instance_ref, host in plan:
+                hosts[instance_ref['id']] = self._schedule_now_on_host(
+                                                context, host,
+                                                instance_ref['id'])
+        except Exception:
+            # NOTE: nothing is started unless every instance is placed, so
+            # the ones already given a host are taken off it again.
+            with utils.save_and_reraise_exception():
+                for reservation in reservations:
+                    self.ledger.rollback(reservation)
+                for instance_id in hosts:
+                    db.instance_update(context, instance_id,
+                                       {'host': None, 'scheduled_at': None})
+        for reservation in reservations:
+            self.ledger.commit(reservation)
+        LOG.debug("Placed a batch of %d instances (%s)."
+                  % (len(instance_ids), strategy))
+        return hosts
+
+    def reserve_memory(self, context, host, memory_mb, ttl=None):
+        """Holds memory on a host for a resize, returning the reservation.
+
+        The reservation lasts until it is released or the ttl runs out.
+
+        :raises OutOfInstanceMemory: if the host cannot hold memory_mb more.
+
+        """
+        self._refresh_ledger(context)
+        return self.ledger.reserve(host, memory_mb, ttl=ttl)
+
+    def release_memory(self, context, reservation_id, used=False):
+        """Ends a resize reservation, adding it to the host's used memory
+        if the resize went through."""
+        if used:
+            self.ledger.commit(reservation_id)
+        else:
+            self.ledger.rollback(reservation_id)
+
 
 class UnforgivingMemoryScheduler(MemoryScheduler):
     """When NoValidHosts is thrown, this sets the instance state to FAILED.
@@ -194,8 +319,8 @@ class UnforgivingMemoryScheduler(MemoryScheduler):
             return base.schedule_run_instance(context, instance_id,
                                               *_args, **_kwargs)
         except driver.NoValidHost:
-            db.instance_update(context, 
-                               instance_id, 
+            db.instance_update(context,
+                               instance_id,
                                {'power_state': power_state.FAILED,
                                 'vm_state': vm_states.ERROR})
             memory_mb = db.instance_get(context, instance_id)['memory_mb']
@@ -203,3 +328,22 @@ class UnforgivingMemoryScheduler(MemoryScheduler):
                             notifier.ERROR,
                             {"requested_instance_memory_mb": memory_mb})
             raise OutOfInstanceMemory(instance_memory_mb=memory_mb)
+
+    def schedule_run_instances(self, context, instance_ids, *_args, **_kwargs):
+        base = super(UnforgivingMemoryScheduler, self)
+        try:
+            return base.schedule_run_instances(context, instance_ids,
+                                               *_args, **_kwargs)
+        except driver.NoValidHost:
+            memory_mb = 0
+            for instance_id in instance_ids:
+                db.instance_update(context,
+                                   instance_id,
+                                   {'power_state': power_state.FAILED,
+                                    'vm_state': vm_states.ERROR})
+                memory_mb += db.instance_get(context, instance_id)['memory_mb']
+            notifier.notify(publisher_id(), 'out.of.instance.memory',
+                            notifier.ERROR,
+                            {"requested_instance_memory_mb": memory_mb,
+                             "requested_instance_count": len(instance_ids)})
+            raise OutOfInstanceMemory(instance_memory_mb=memory_mb)
@@ -118,6 +118,21 @@ class MgmtApiTest(test.TestCase):
     def test_instances_index_restricted(self):
         self._test_path_restricted('instances')
 
+    def test_caches_restricted(self):
+        self._test_path_restricted('caches')
+
+    def test_cache_stats(self):
+        stats = {'hits': 3, 'misses': 1, 'evictions': 0, 'expired': 0,
+                 'size': 1, 'max_size': 10}
+        self.stubs.Set(reddwarf.db.api, "localid_cache_stats", lambda: stats)
+        req = webob.Request.blank(mgmt_url + 'caches')
+        admin_context = context.RequestContext('fake', 'fake',
+                                               auth_token=True, is_admin=True)
+        res = req.get_response(util.wsgi_app(fake_auth_context=admin_context))
+        self.assertEqual(res.status_int, 200)
+        res_body = json.loads(res.body)
+        self.assertEqual(res_body['caches']['localid'], stats)
+
     def test_get_guest_info_no_dbs(self):
         # Instantiate the controller because we need to inject mocked
         # attributes and methods
@@ -165,14 +180,10 @@ class MgmtApiTest(test.TestCase):
         # Just some mock goodness
         status = mox.MockAnything()
         status.is_sql_running = True
-        self.mox.StubOutWithMock(controller.guest_api, 'list_databases')
-        controller.guest_api.list_databases(FAKE_CONTEXT,
-                                            FAKE_INSTANCE['id'])\
-            .AndReturn(FAKE_DB_LIST)
-        self.mox.StubOutWithMock(controller.guest_api, 'list_users')
-        controller.guest_api.list_users(FAKE_CONTEXT,
-                                        FAKE_INSTANCE['id'])\
-            .AndReturn(FAKE_USER_LIST)
+        self.mox.StubOutWithMock(controller.guest_api, 'get_summary')
+        controller.guest_api.get_summary(FAKE_CONTEXT, FAKE_INSTANCE['id'],
+                                         fields=('databases', 'users'))\
+            .AndReturn({'databases': FAKE_DB_LIST, 'users': FAKE_USER_LIST})
         self.mox.StubOutWithMock(reddwarf.api.management.dbapi,
                                  'get_root_enabled_history')
         reddwarf.api.management.dbapi.get_root_enabled_history(
@@ -188,4 +199,20 @@ class MgmtApiTest(test.TestCase):
         self.assertTrue(len(instance['databases']) >= 0)
         self.assertTrue(len(instance['users']) >= 0)
         self.assertEqual(root_enabled.created_at, instance['root_enabled_at'])
-        self.assertEqual(root_enabled.user_id, instance['root_enabled_by'])
\ No newline at end of file
+        self.assertEqual(root_enabled.user_id, instance['root_enabled_by'])
+
+    def test_stream_json_index(self):
+        instances = [{'id': 'uuid-2', 'ips': [], 'volumes': []},
+                     {'id': 'uuid-1', 'ips': [], 'volumes': []}]
+        links = [{'rel': 'next', 'href': 'https://localhost/?marker=uuid-1'}]
+        controller = reddwarf.api.management.Controller
+        res = controller._stream_json_index(instances, links)
+        self.assertEqual(res.content_type, 'application/json')
+        res_body = json.loads(res.body)
+        self.assertEqual(res_body['instances'], instances)
+        self.assertEqual(res_body['links'], links)
+
+    def test_stream_json_index_empty(self):
+        controller = reddwarf.api.management.Controller
+        res = controller._stream_json_index([], [])
+        self.assertEqual(json.loads(res.body), {'instances': []})
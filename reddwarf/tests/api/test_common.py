@@ -12,13 +12,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import webob
 from nose.tools import raises
 
 from nova import test
 
+import reddwarf
+from reddwarf import exception
 from reddwarf.api import common
 
 
+def fake_localid_from_uuid(uuid):
+    if uuid == 'missing':
+        raise exception.NotFound()
+    return 42
+
+
 class ApiCommonTest(test.TestCase):
     """Test common api functions"""
 
@@ -68,3 +77,48 @@ class ApiCommonTest(test.TestCase):
         self.assertEqual(len(user['_databases']), 2)
         self.assertEqual(user['_databases'][0]['_name'], "tdb")
         self.assertEqual(user['_databases'][1]['_name'], "tdb1")
+
+    def test_pagination_params_default_to_max_limit(self):
+        req = webob.Request.blank('/instances')
+        self.assertEqual(common.get_pagination_params(req, max_limit=10),
+                         (10, None))
+
+    def test_pagination_params_are_capped(self):
+        req = webob.Request.blank('/instances?limit=50')
+        self.assertEqual(common.get_pagination_params(req, max_limit=10),
+                         (10, None))
+
+    def test_pagination_params_resolve_the_marker(self):
+        self.stubs.Set(reddwarf.db.api, "localid_from_uuid",
+                       fake_localid_from_uuid)
+        req = webob.Request.blank('/instances?limit=5&marker=abc')
+        self.assertEqual(common.get_pagination_params(req, max_limit=10),
+                         (5, 42))
+
+    @raises(exception.BadRequest)
+    def test_pagination_params_unknown_marker(self):
+        self.stubs.Set(reddwarf.db.api, "localid_from_uuid",
+                       fake_localid_from_uuid)
+        req = webob.Request.blank('/instances?marker=missing')
+        common.get_pagination_params(req)
+
+    @raises(exception.BadRequest)
+    def test_pagination_params_negative_limit(self):
+        req = webob.Request.blank('/instances?limit=-1')
+        common.get_pagination_params(req)
+
+    def test_no_next_links_on_the_last_page(self):
+        req = webob.Request.blank('/instances?limit=2')
+        items = [{'id': 'a'}, {'id': 'b'}]
+        self.assertEqual(common.build_next_links(req, items, 2), [])
+        self.assertEqual(len(items), 2)
+
+    def test_next_links_point_after_the_last_item(self):
+        req = webob.Request.blank('/instances?limit=2&deleted=true')
+        items = [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]
+        links = common.build_next_links(req, items, 2)
+        self.assertEqual(items, [{'id': 'a'}, {'id': 'b'}])
+        self.assertEqual(links, [{
+            'rel': 'next',
+            'href': 'https://localhost/instances'
+                    '?deleted=true&limit=2&marker=b'}])
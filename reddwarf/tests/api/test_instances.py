@@ -26,6 +26,7 @@ from nova import context
 from nova import test
 from nova.compute import vm_states
 from nova.compute import power_state
+from nova.rpc.common import RemoteError
 import nova.exception as nova_exception
 
 
@@ -115,6 +116,48 @@ class InstanceApiTest(test.TestCase):
         self.assertEqual(res.status_int, 202)
         self.assertEqual(res.body, '')
 
+    def test_instances_create_batch_without_room(self):
+        created = []
+        destroyed = []
+        deleted_volumes = []
+
+        def create_volume(self, ctxt, body):
+            return {'id': 10 + len(body['instance']['name']), 'size': 1}
+
+        def create_db_entry(self, ctxt, instance_type, image, base_options,
+                            security_group, block_device_mapping, num=1):
+            created.append({'id': len(created) + 1, 'memory_mb': 512})
+            return created[-1]
+
+        def run_instances(ctxt, topic, msg):
+            raise RemoteError('NoValidHost', 'No host has room.', '')
+
+        self.stubs.Set(instances.Controller, "_setup_security_groups",
+                       lambda *args: None)
+        self.stubs.Set(instances.Controller, "create_volume", create_volume)
+        self.stubs.Set(reddwarf.db.api, "config_get",
+                       lambda key: models.Config(key=key, value='1'))
+        self.stubs.Set(instances.instance_types,
+                       "get_instance_type_by_flavor_id",
+                       lambda flavor_id: {'id': 1, 'memory_mb': 512})
+        self.stubs.Set(reddwarf.compute.API, "_check_create_parameters",
+                       lambda *args, **kwargs: (1, {}, {}))
+        self.stubs.Set(reddwarf.compute.API,
+                       "create_db_entry_for_new_instance", create_db_entry)
+        self.stubs.Set(reddwarf.compute.api.rpc, "call", run_instances)
+        self.stubs.Set(nova.db.api, "instance_destroy",
+                       lambda ctxt, id: destroyed.append(id))
+        self.stubs.Set(reddwarf.volume.API, "delete",
+                       lambda self, ctxt, id: deleted_volumes.append(id))
+        body = {'instances': [
+            {'name': 'a', 'flavorRef': '1', 'volume': {'size': 1}},
+            {'name': 'bb', 'flavorRef': '1', 'volume': {'size': 1}}]}
+        req = request_obj(instances_url, 'POST', body)
+        res = req.get_response(util.wsgi_app(fake_auth_context=self.context))
+        self.assertEqual(res.status_int, 422)
+        self.assertEqual([1, 2], destroyed)
+        self.assertEqual([11, 12], deleted_volumes)
+
 class InstanceApiValidation(test.TestCase):
     """
     Test the instance api validation methods
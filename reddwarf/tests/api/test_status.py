@@ -144,3 +144,19 @@ class StatusApiTest(test.TestCase):
     def test_get_status_from_server(self):
         lookup = status.InstanceStatusLookup([fake_instance['instance_id']])
         server = lookup.get_status_from_server(fake_instance)
+
+    def test_status_from_summary(self):
+        summary = {'vm_state': vm_states.ACTIVE,
+                   'power_state': power_state.RUNNING,
+                   'guest_state': power_state.RUNNING}
+        running = status.InstanceStatus.from_summary(summary)
+        self.assertTrue(running.is_sql_running)
+        self.assertEqual(running.status, 'ACTIVE')
+
+    def test_status_from_summary_without_guest_state(self):
+        summary = {'vm_state': vm_states.ACTIVE,
+                   'power_state': power_state.RUNNING,
+                   'guest_state': None}
+        missing = status.InstanceStatus.from_summary(summary)
+        self.assertFalse(missing.is_sql_running)
+        self.assertEqual(missing.status, 'SHUTDOWN')
@@ -16,6 +16,7 @@
 Tests the Authorization Service
 """
 
+import eventlet
 import json
 import mox
 import stubout
@@ -66,8 +67,10 @@ class AuthApiTest(test.TestCase):
                        validate_token)
         app = nova_auth_token.KeystoneAuthShim(None)
         self.auth = auth_token.AuthProtocol(app, {})
+        auth_token.get_memory_cache().clear()
 
     def tearDown(self):
+        auth_token.get_memory_cache().clear()
         self.stubs.UnsetAll()
         super(AuthApiTest, self).tearDown()
 
@@ -113,8 +116,146 @@ class AuthApiTest(test.TestCase):
 
     def test_cache_hit(self):
         cache_key = "aat/dbaas"
-        self.auth.cache.set_value(cache_key, (data, 200))
+        # The middleware serving the request shares the process cache.
+        auth_token.get_memory_cache().set_value(cache_key, (data, 200))
         req = webob.Request.blank(flavors_url)
         req.headers = [("X-AUTH-TOKEN", "aat")]
         res = req.get_response(util.wsgi_app(fake_auth=False))
         self.assertEqual(res.status_int, 200)
+
+    def test_cache_is_shared_by_the_process(self):
+        other = auth_token.AuthProtocol(None, {})
+        self.assertTrue(other.cache is self.auth.cache)
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenCacheTest(test.TestCase):
+
+    def setUp(self):
+        super(TokenCacheTest, self).setUp()
+        self.timer = FakeTimer()
+        self.cache = auth_token.TokenCache(4, timer=self.timer)
+
+    def test_expired_tokens_are_dropped(self):
+        self.cache.set_value("a/t", (data, 200), expiretime=10)
+        self.assertEqual((data, 200), self.cache.get("a/t"))
+        self.timer.now += 10
+        self.assertEqual(None, self.cache.get("a/t"))
+        self.assertEqual(0, len(self.cache))
+
+    def test_least_recently_used_token_is_evicted(self):
+        for key in ("a", "b", "c", "d"):
+            self.cache.set_value(key, (data, 200))
+            self.timer.now += 1
+        self.cache.get("a")
+        self.cache.set_value("e", (data, 200))
+        self.assertEqual(4, len(self.cache))
+        self.assertEqual(None, self.cache.get("b"))
+        self.assertEqual((data, 200), self.cache.get("a"))
+
+
+class FakeResponse(object):
+
+    def __init__(self, status=200, will_close=False):
+        self.status = status
+        self.will_close = will_close
+
+    def read(self):
+        return data
+
+
+class FakeConnection(object):
+
+    def __init__(self, stale=False):
+        self.stale = stale
+        self.requests = 0
+        self.closed = False
+
+    def request(self, method, path, body=None, headers=None):
+        self.requests += 1
+        if self.stale:
+            raise auth_token.httplib.BadStatusLine('')
+
+    def getresponse(self):
+        return FakeResponse()
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(test.TestCase):
+
+    def setUp(self):
+        super(ConnectionPoolTest, self).setUp()
+        self.connections = []
+        self.stubs.Set(auth_token, 'get_connection', self._get_connection)
+        self.pool = auth_token.ConnectionPool('http', 'localhost', 5001, 2)
+
+    def _get_connection(self, type, host, port):
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+    def test_connections_are_reused(self):
+        for i in range(3):
+            self.assertEqual((200, data), self.pool.request("GET", "/"))
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual(3, self.connections[0].requests)
+
+    def test_stale_connection_is_replaced(self):
+        stale = FakeConnection(stale=True)
+        self.pool.idle.append(stale)
+        self.assertEqual((200, data), self.pool.request("GET", "/"))
+        self.assertTrue(stale.closed)
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual([self.connections[0]], self.pool.idle)
+
+
+class TokenValidationTest(test.TestCase):
+
+    def setUp(self):
+        super(TokenValidationTest, self).setUp()
+        self.stubs.Set(auth_token.AuthProtocol, "get_admin_auth_token",
+                       get_admin_auth_token)
+        self.auth = auth_token.AuthProtocol(None, {})
+        self.auth.cache.clear()
+        self.validations = 0
+
+    def _validate_token(self, claims, tenant=None):
+        self.validations += 1
+        return validate_token(self.auth, claims, tenant)
+
+    def test_rejected_token_is_cached(self):
+        self.stubs.Set(self.auth, "_validate_token", self._validate_token)
+        self.assertEqual((data, 401), self.auth._coalesced_validate(
+            "bad", "dbaas", "bad/dbaas"))
+        self.assertEqual((data, 401), self.auth.cache.get("bad/dbaas"))
+        self.assertEqual(1, self.auth.get_stats()['rejections_cached'])
+
+    def test_concurrent_validations_are_coalesced(self):
+        release = eventlet.event.Event()
+
+        def slow_validate_token(claims, tenant=None):
+            release.wait()
+            return self._validate_token(claims, tenant)
+
+        self.stubs.Set(self.auth, "_validate_token", slow_validate_token)
+        key = "%s/dbaas" % TOKEN
+        first = eventlet.spawn(self.auth._coalesced_validate, TOKEN,
+                               "dbaas", key)
+        second = eventlet.spawn(self.auth._coalesced_validate, TOKEN,
+                                "dbaas", key)
+        eventlet.sleep(0)
+        release.send()
+        self.assertEqual((data, 200), first.wait())
+        self.assertEqual((data, 200), second.wait())
+        self.assertEqual(1, self.validations)
+        self.assertEqual(1, self.auth.get_stats()['validations_coalesced'])
+        self.assertEqual({}, self.auth.in_flight)
@@ -22,15 +22,21 @@ from paste import urlmap
 from nova import db
 from nova import context
 from nova import exception
+from nova import flags
+from nova import rpc
 from nova import test
 from nova.compute import instance_types
 from nova.compute import vm_states
+from nova.rpc.common import RemoteError
 from reddwarf import exception as reddwarf_exception
 from reddwarf.compute.api import API
 from reddwarf.db import api as dbapi
 from reddwarf.tests import util
 
 
+FLAGS = flags.FLAGS
+
+
 class InstanceTypes(object):
 
     def __init__(self):
@@ -94,6 +100,42 @@ class ResizeInPlaceTest(test.TestCase):
         self.assertNotEqual(vm_states.RESIZING, instance['vm_state'])
         return instance['id']
 
+    def stub_scheduler_without_ledger(self):
+        self.mox.StubOutWithMock(rpc, "call")
+        rpc.call(mox.IgnoreArg(), FLAGS.scheduler_topic,
+                 mox.ContainsKeyValue('method', 'reserve_memory'))\
+            .AndReturn(False)
+
+    def test_when_scheduler_reserves_memory(self):
+        self.instance_id = self.create_instance(self.inst_type_small)
+        self.mox.StubOutWithMock(rpc, "call")
+        rpc.call(mox.IgnoreArg(), FLAGS.scheduler_topic,
+                 {'method': 'reserve_memory',
+                  'args': {'host': 'fake_host', 'memory_mb': 512}})\
+            .AndReturn({'scheduler': 'sched', 'id': 3})
+        # The ledger replaces the memory sum over the host's instances.
+        self.mox.StubOutWithMock(dbapi, "instance_get_memory_sum_by_host")
+        self.mox.StubOutWithMock(self.api, "_cast_compute_message")
+        # The compute host releases the reservation once it has resized.
+        mock_params = {'new_instance_type_id': self.inst_type_big['id'],
+                       'reservation': {'scheduler': 'sched', 'id': 3}}
+        self.api._cast_compute_message("resize_in_place", self.ctxt,
+                                       self.instance_id,
+                                       params=mock_params)
+        self.mox.ReplayAll()
+        self.api.resize_in_place(self.ctxt, self.instance_id,
+                                 self.inst_type_big['id'])
+
+    def test_when_scheduler_ledger_is_full(self):
+        self.instance_id = self.create_instance(self.inst_type_small)
+        self.mox.StubOutWithMock(rpc, "call")
+        rpc.call(mox.IgnoreArg(), FLAGS.scheduler_topic, mox.IgnoreArg())\
+            .AndRaise(RemoteError('OutOfInstanceMemory', 'full', None))
+        self.mox.ReplayAll()
+        self.assertRaises(reddwarf_exception.OutOfInstanceMemory,
+                          self.api.resize_in_place, self.ctxt,
+                          self.instance_id, self.inst_type_big['id'])
+
     def test_when_instance_not_found(self):
         self.assertRaises(exception.NotFound, self.api.resize_in_place,
                           self.ctxt, -1, self.inst_type_small['id'])
@@ -106,12 +148,12 @@ class ResizeInPlaceTest(test.TestCase):
 
     def test_when_new_flavor_is_smaller(self):
         self.instance_id = self.create_instance(self.inst_type_big)
+        # Shrinking never needs to check the memory left on the host.
         self.mox.StubOutWithMock(dbapi, "instance_get_memory_sum_by_host")
-        dbapi.instance_get_memory_sum_by_host(mox.IgnoreArg(), 'fake_host')\
-            .AndReturn(1024 * 10)
         self.mox.StubOutWithMock(self.api, "_cast_compute_message")
         # Stub out final cast call.
-        mock_params = {'new_instance_type_id':self.inst_type_small['id']}
+        mock_params = {'new_instance_type_id': self.inst_type_small['id'],
+                       'reservation': None}
         self.api._cast_compute_message("resize_in_place", self.ctxt,
                                        self.instance_id,
                                        params=mock_params)
@@ -127,6 +169,7 @@ class ResizeInPlaceTest(test.TestCase):
 
     def test_when_new_flavor_is_too_big(self):
         self.instance_id = self.create_instance(self.inst_type_small)
+        self.stub_scheduler_without_ledger()
         # Stub out call to get available space on host.
         self.mox.StubOutWithMock(dbapi, "instance_get_memory_sum_by_host")
         dbapi.instance_get_memory_sum_by_host(mox.IgnoreArg(), 'fake_host')\
@@ -139,13 +182,15 @@ class ResizeInPlaceTest(test.TestCase):
 
     def test_successful(self):
         self.instance_id = self.create_instance(self.inst_type_small)
+        self.stub_scheduler_without_ledger()
         # Stub out call to get available space on host.
         self.mox.StubOutWithMock(dbapi, "instance_get_memory_sum_by_host")
         dbapi.instance_get_memory_sum_by_host(mox.IgnoreArg(), 'fake_host')\
             .AndReturn(1024 * 10)
         self.mox.StubOutWithMock(self.api, "_cast_compute_message")
         # Stub out final cast call.
-        mock_params = {'new_instance_type_id':self.inst_type_big['id']}
+        mock_params = {'new_instance_type_id': self.inst_type_big['id'],
+                       'reservation': None}
         self.api._cast_compute_message("resize_in_place", self.ctxt,
                                        self.instance_id,
                                        params=mock_params)
@@ -144,11 +144,22 @@ class RdComputeManagerResizeInPlaceTest(test.TestCase):
                            'new_instance_type_id':self.new_instance_type_id,
                            'final_vm_state':final_vm_state })
 
-    def expect_instance_update_to_type(self, actual_vm_state, instance_type_id):
+    def expect_instance_update_to_type(self, actual_vm_state, instance_type_id,
+                                       memory_mb=None):
         self.mox.StubOutWithMock(self.rd_compute, "_instance_update")
+        values = {'instance_type_id': instance_type_id,
+                  'vm_state': actual_vm_state,
+                  'task_state': None}
+        if memory_mb is not None:
+            values['memory_mb'] = memory_mb
         self.rd_compute._instance_update(self.ctxt, self.instance_id,
-            instance_type_id=instance_type_id,
-            vm_state=actual_vm_state, task_state=None)
+                                         **values)
+
+    def expect_reservation_released(self, used):
+        self.mox.StubOutWithMock(manager.rpc, "cast")
+        manager.rpc.cast(self.ctxt, '%s.sched' % FLAGS.scheduler_topic,
+                         {'method': 'release_memory',
+                          'args': {'reservation_id': 3, 'used': used}})
 
     def test_when_stop_mysql_raises(self):
         guest_error = self.expect_guest_api_stop_mysql_fails()
@@ -219,7 +230,8 @@ class RdComputeManagerResizeInPlaceTest(test.TestCase):
         ex = self.expect_guest_api_start_mysql_fails(self.new_memory_size)
         self.expect_notify_of_failure_2(ex, vm_states.ACTIVE)
         self.expect_instance_update_to_type(vm_states.ACTIVE,
-                                            self.new_instance_type_id)
+                                            self.new_instance_type_id,
+                                            self.new_memory_size)
         self.mox.ReplayAll()
 
         self.assertRaises(reddwarf_exception.GuestError,
@@ -233,12 +245,43 @@ class RdComputeManagerResizeInPlaceTest(test.TestCase):
         self.expect_driver_resize_in_place_works()
         self.expect_guest_api_start_mysql_works(self.new_memory_size)
         self.expect_instance_update_to_type(vm_states.ACTIVE,
-                                            self.new_instance_type_id)
+                                            self.new_instance_type_id,
+                                            self.new_memory_size)
         self.mox.ReplayAll()
 
         self.rd_compute.resize_in_place(self.ctxt, self.instance_id,
                                         self.new_instance_type_id)
 
+    def test_reservation_is_used_when_resized(self):
+        self.expect_guest_api_stop_mysql_works()
+        self.expect_driver_resize_in_place_works()
+        self.expect_guest_api_start_mysql_works(self.new_memory_size)
+        self.expect_instance_update_to_type(vm_states.ACTIVE,
+                                            self.new_instance_type_id,
+                                            self.new_memory_size)
+        self.expect_reservation_released(used=True)
+        self.mox.ReplayAll()
+
+        self.rd_compute.resize_in_place(self.ctxt, self.instance_id,
+                                        self.new_instance_type_id,
+                                        reservation={'scheduler': 'sched',
+                                                     'id': 3})
+
+    def test_reservation_is_rolled_back_when_not_resized(self):
+        self.expect_guest_api_stop_mysql_works()
+        self.expect_driver_resize_in_place_fails()
+        self.expect_driver_reset_instance_size_works()
+        self.expect_guest_api_start_mysql_works(updated_memory_size=None)
+        self.expect_instance_update_to_type(vm_states.ACTIVE,
+                                            self.old_instance_type_id)
+        self.expect_reservation_released(used=False)
+        self.mox.ReplayAll()
+
+        self.rd_compute.resize_in_place(self.ctxt, self.instance_id,
+                                        self.new_instance_type_id,
+                                        reservation={'scheduler': 'sched',
+                                                     'id': 3})
+
 
 class RdComputeManagerGuestUpdateTest(test.TestCase):
 
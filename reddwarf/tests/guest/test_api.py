@@ -0,0 +1,151 @@
+#    Copyright 2011 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for reddwarf.guest.api.
+"""
+
+import time
+
+import eventlet
+
+from nova import context
+from nova import test
+from nova.rpc.common import RemoteError
+from nova.rpc.common import Timeout
+
+from reddwarf.guest import api as guest_api
+
+
+class GuestRoutingKeyTest(test.TestCase):
+
+    def setUp(self):
+        super(GuestRoutingKeyTest, self).setUp()
+        self.context = context.get_admin_context()
+        self.api = guest_api.API()
+        self.loads = []
+        self.stubs.Set(guest_api, 'ROUTING_KEYS', None)
+        self.stubs.Set(guest_api.dbapi, 'instance_get', self._instance_get)
+
+    def _instance_get(self, context, id):
+        self.loads.append(id)
+        return {'id': id, 'hostname': 'host-%d.example.com' % id}
+
+    def test_routing_key_is_loaded_once(self):
+        self.assertEqual('guest.host-1', self.api._get_routing_key(
+                         self.context, 1))
+        self.assertEqual('guest.host-1', self.api._get_routing_key(
+                         self.context, 1))
+        self.assertEqual([1], self.loads)
+
+    def test_remembered_routing_key_skips_the_load(self):
+        self.api.remember_routing_key({'id': 2, 'hostname': 'other.host'})
+        self.assertEqual('guest.other', self.api._get_routing_key(
+                         self.context, 2))
+        self.assertEqual([], self.loads)
+
+    def test_forgotten_routing_key_is_reloaded(self):
+        self.api._get_routing_key(self.context, 3)
+        self.api.forget_routing_key(3)
+        self.api._get_routing_key(self.context, 3)
+        self.assertEqual([3, 3], self.loads)
+
+
+class GuestSummaryTest(test.TestCase):
+
+    def setUp(self):
+        super(GuestSummaryTest, self).setUp()
+        self.context = context.get_admin_context()
+        self.api = guest_api.API()
+        self.stubs.Set(guest_api, 'ROUTING_KEYS', None)
+        self.stubs.Set(guest_api, 'LEGACY_GUESTS', None)
+        self.api.remember_routing_key({'id': 1, 'hostname': 'host-1'})
+        self.methods = []
+        self.timeouts = []
+
+    def _rpc_call(self, summary_error=None, delay=0):
+        def call(context, topic, msg, timeout=None):
+            self.methods.append(msg['method'])
+            self.timeouts.append(timeout)
+            if msg['method'] == 'get_summary':
+                if summary_error:
+                    raise summary_error
+                return {'root_enabled': True, 'databases': []}
+            eventlet.sleep(delay)
+            return msg['method']
+        self.stubs.Set(guest_api.rpc, 'call', call)
+
+    def test_summary_in_one_call(self):
+        self._rpc_call()
+        summary = self.api.get_summary(self.context, 1,
+                                       fields=('root_enabled', 'databases'))
+        self.assertEqual({'root_enabled': True, 'databases': []}, summary)
+        self.assertEqual(['get_summary'], self.methods)
+
+    def test_legacy_guest_falls_back_to_concurrent_calls(self):
+        self._rpc_call(summary_error=RemoteError('NotFound', '', ''))
+        fields = ('root_enabled', 'databases', 'users')
+        summary = self.api.get_summary(self.context, 1, fields=fields)
+        self.assertEqual({'root_enabled': 'is_root_enabled',
+                          'databases': 'list_databases',
+                          'users': 'list_users'}, summary)
+        # The next summary skips the get_summary call.
+        self.methods = []
+        self.api.get_summary(self.context, 1, fields=fields)
+        self.assertFalse('get_summary' in self.methods)
+
+    def test_cpp_guest_without_summary_is_legacy(self):
+        self._rpc_call(summary_error=RemoteError('std::exception',
+            'Could not handle the JSON input. No such method was found.',
+            'unavailable'))
+        summary = self.api.get_summary(self.context, 1,
+                                       fields=('root_enabled', 'users'))
+        self.assertEqual({'root_enabled': 'is_root_enabled',
+                          'users': 'list_users'}, summary)
+        self.assertTrue(guest_api.LEGACY_GUESTS.get(1))
+
+    def test_other_guest_errors_leave_every_field_none(self):
+        self._rpc_call(summary_error=RemoteError('std::exception',
+                                                 'MySQL is down.', ''))
+        summary = self.api.get_summary(self.context, 1,
+                                       fields=('databases', 'users'))
+        self.assertEqual({'databases': None, 'users': None}, summary)
+        self.assertEqual(None, guest_api.LEGACY_GUESTS.get(1))
+
+    def test_slow_calls_are_none_after_the_deadline(self):
+        self._rpc_call(summary_error=RemoteError('NotFound', '', ''), delay=5)
+        start = time.time()
+        summary = self.api.get_summary(self.context, 1,
+                                       fields=('databases', 'users'),
+                                       timeout=0.1)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual({'databases': None, 'users': None}, summary)
+
+    def test_summary_call_is_given_the_deadline(self):
+        self._rpc_call()
+        self.api.get_summary(self.context, 1, fields=('databases',),
+                             timeout=3)
+        self.assertEqual([3], self.timeouts)
+
+    def test_summary_timeout_leaves_every_field_none(self):
+        self._rpc_call(summary_error=Timeout())
+        summary = self.api.get_summary(self.context, 1,
+                                       fields=('databases', 'users'))
+        self.assertEqual({'databases': None, 'users': None}, summary)
+        self.assertEqual(['get_summary'], self.methods)
+
+    def test_calls_default_to_the_guest_call_timeout(self):
+        self.flags(guest_call_timeout=7)
+        self._rpc_call()
+        self.assertEqual('list_users', self.api.list_users(self.context, 1))
+        self.assertEqual([7], self.timeouts)
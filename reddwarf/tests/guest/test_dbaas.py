@@ -0,0 +1,129 @@
+#    Copyright 2011 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for reddwarf.guest.dbaas.
+"""
+
+from nova import test
+
+from reddwarf.guest import dbaas
+
+
+class FakeSqlClient(object):
+
+    clients = []
+
+    def __init__(self, engine, use_flush=True):
+        self.statements = []
+        self.clients.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def execute(self, t, **kwargs):
+        self.statements.append(str(t))
+
+
+class CreateUsersAndDatabasesTest(test.TestCase):
+
+    def setUp(self):
+        super(CreateUsersAndDatabasesTest, self).setUp()
+        FakeSqlClient.clients = []
+        self.stubs.Set(dbaas, 'LocalSqlClient', FakeSqlClient)
+        self.stubs.Set(dbaas, 'get_engine', lambda: None)
+        self.agent = dbaas.DBaaSAgent()
+
+    def test_batch_uses_one_client(self):
+        databases = [{'_name': 'db1'}, {'_name': 'db2'}]
+        users = [{'_name': 'user1', '_password': 'pass1',
+                  '_databases': [{'_name': 'db1'}, {'_name': 'db2'}]},
+                 {'_name': 'user2', '_password': 'pass2',
+                  '_databases': [{'_name': 'db1'}]}]
+        result = self.agent.create_users_and_databases(databases, users)
+        self.assertEqual(1, len(FakeSqlClient.clients))
+        statements = FakeSqlClient.clients[0].statements
+        # Two databases, one CREATE USER and one GRANT per granted database.
+        self.assertEqual(5, len(statements))
+        self.assertEqual(5, result['statements'])
+        self.assertEqual(2, result['users'])
+        self.assertEqual(2, result['databases'])
+        self.assertTrue('total' in result['timings'])
+        create_user = [s for s in statements if s.startswith('CREATE USER')]
+        self.assertEqual(1, len(create_user))
+        self.assertTrue('`user1`' in create_user[0])
+        self.assertTrue('`user2`' in create_user[0])
+
+    def test_invalid_batch_creates_nothing(self):
+        users = [{'_name': 'user1', '_password': 'pass1'},
+                 {'_name': 'bad;user', '_password': 'pass2'}]
+        self.assertRaises(ValueError, self.agent.create_users_and_databases,
+                          [{'_name': 'db1'}], users)
+        self.assertEqual([], FakeSqlClient.clients)
+
+
+class GetSummaryTest(test.TestCase):
+
+    def test_volume_info_is_the_filesystem_usage(self):
+        agent = dbaas.DBaaSAgent()
+        self.stubs.Set(agent, 'get_filesystem_stats',
+                       lambda fs_path: {'used': len(fs_path)})
+        summary = agent.get_summary(fields=('volume_info',))
+        self.assertEqual({'volume_info': {'used': len('/var/lib/mysql')}},
+                         summary)
+
+    def test_filesystem_stats(self):
+        stats = dbaas.DBaaSAgent().get_filesystem_stats('/')
+        self.assertEqual(stats['total'] - stats['free'], stats['used'])
+
+
+class StatusProbeScheduleTest(test.TestCase):
+
+    def test_backs_off_while_stable(self):
+        schedule = dbaas.StatusProbeSchedule(5, 60)
+        self.assertTrue(schedule.is_due(now=0))
+        intervals = []
+        for _i in range(6):
+            schedule.record('running', now=0)
+            intervals.append(schedule.interval)
+        self.assertEqual([5, 10, 20, 40, 60, 60], intervals)
+        self.assertFalse(schedule.is_due(now=59))
+        self.assertTrue(schedule.is_due(now=60))
+
+    def test_tightens_after_a_change(self):
+        schedule = dbaas.StatusProbeSchedule(5, 60)
+        for _i in range(4):
+            schedule.record('running', now=0)
+        schedule.record('shutdown', now=0)
+        self.assertEqual(5, schedule.interval)
+        self.assertTrue(schedule.is_due(now=5))
+
+
+class MysqldIsRunningTest(test.TestCase):
+
+    def setUp(self):
+        super(MysqldIsRunningTest, self).setUp()
+        self.stubs.Set(dbaas, 'MYSQLD_ARGS', {'pid-file': '/nonexistent'})
+
+    def test_finds_mysqld_in_proc(self):
+        self.stubs.Set(dbaas.os, 'listdir', lambda path: ['self', '12', '34'])
+        self.stubs.Set(dbaas, '_is_mysqld', lambda pid: pid == '34')
+        self.assertTrue(dbaas.mysqld_is_running())
+
+    def test_no_mysqld(self):
+        self.stubs.Set(dbaas.os, 'listdir', lambda path: ['12'])
+        self.stubs.Set(dbaas, '_is_mysqld', lambda pid: False)
+        self.assertFalse(dbaas.mysqld_is_running())
@@ -0,0 +1,219 @@
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for reddwarf.scheduler.simple and its capacity ledger.
+"""
+
+from nova import context
+from nova import exception
+from nova import flags
+from nova import test
+from nova.scheduler import driver
+
+from reddwarf.exception import OutOfInstanceMemory
+from reddwarf.scheduler import ledger
+from reddwarf.scheduler import simple
+
+
+FLAGS = flags.FLAGS
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PlacementError(Exception):
+    pass
+
+
+def fake_service(host):
+    return {'host': host, 'id': host}
+
+
+class CapacityLedgerTest(test.TestCase):
+
+    def setUp(self):
+        super(CapacityLedgerTest, self).setUp()
+        self.flags(max_instance_memory_mb=4096,
+                   reddwarf_ledger_resync_interval=20,
+                   reddwarf_reservation_ttl=60)
+        self.context = context.get_admin_context()
+        self.timer = FakeTimer()
+        self.loads = 0
+        self.usage = [(fake_service('a'), 1024), (fake_service('b'), 0)]
+        self.stubs.Set(ledger.db_api, 'service_get_all_compute_memory',
+                       self._service_get_all_compute_memory)
+        self.ledger = ledger.CapacityLedger(timer=self.timer)
+        self.ledger.resync(self.context)
+
+    def _service_get_all_compute_memory(self, context):
+        self.loads += 1
+        return self.usage
+
+    def test_resync_is_rate_limited(self):
+        self.assertFalse(self.ledger.resync(self.context))
+        self.timer.now += 20
+        self.assertTrue(self.ledger.resync(self.context))
+        self.assertEqual(2, self.loads)
+
+    def test_hosts_are_ordered_by_usage(self):
+        hosts = [(service['host'], free)
+                 for service, free in self.ledger.hosts_by_usage()]
+        self.assertEqual([('b', 4096), ('a', 3072)], hosts)
+
+    def test_reservations_cannot_overcommit(self):
+        self.ledger.reserve('a', 2048)
+        self.assertRaises(OutOfInstanceMemory, self.ledger.reserve, 'a', 2048)
+        self.assertEqual(1024, self.ledger.free('a'))
+
+    def test_commit_and_rollback(self):
+        committed = self.ledger.reserve('b', 1024)
+        rolled_back = self.ledger.reserve('b', 1024)
+        self.ledger.commit(committed)
+        self.ledger.rollback(rolled_back)
+        self.assertEqual({'used': 1024, 'reserved': 0, 'capacity': 4096},
+                         self.ledger.get_stats()['b'])
+
+    def test_reservations_expire(self):
+        self.ledger.reserve('a', 3072)
+        self.assertRaises(OutOfInstanceMemory, self.ledger.reserve, 'a', 1)
+        self.timer.now += 60
+        self.ledger.reserve('a', 3072)
+
+    def test_reported_memory_caps_capacity(self):
+        self.ledger.update_capabilities('a', {'host_memory_total': 2048})
+        self.assertEqual(1024, self.ledger.free('a'))
+        self.ledger.resync(self.context, force=True)
+        self.assertEqual(1024, self.ledger.free('a'))
+
+
+class MemorySchedulerTest(test.TestCase):
+
+    def setUp(self):
+        super(MemorySchedulerTest, self).setUp()
+        self.flags(max_instance_memory_mb=4096)
+        self.context = context.get_admin_context()
+        self.usage = [(fake_service('a'), 3072), (fake_service('b'), 2048)]
+        self.stubs.Set(ledger.db_api, 'service_get_all_compute_memory',
+                       lambda context: self.usage)
+        self.scheduler = simple.MemoryScheduler()
+        self.stubs.Set(self.scheduler, 'service_is_up', lambda service: True)
+        self.placed = []
+        self.stubs.Set(self.scheduler, '_schedule_now_on_host',
+                       self._schedule_now_on_host)
+
+    def _schedule_now_on_host(self, context, host, instance_id):
+        self.placed.append((host, instance_id))
+        return host
+
+    def _instance(self, id, memory_mb):
+        return {'id': id, 'memory_mb': memory_mb, 'display_name': str(id)}
+
+    def test_placements_update_the_ledger(self):
+        self.assertEqual('b', self.scheduler._schedule_based_on_resources(
+            self.context, self._instance(1, 1024)))
+        self.assertEqual('a', self.scheduler._schedule_based_on_resources(
+            self.context, self._instance(2, 1024)))
+        self.assertRaises(driver.NoValidHost,
+                          self.scheduler._schedule_based_on_resources,
+                          self.context, self._instance(3, 2048))
+
+    def test_failed_placement_releases_memory(self):
+        def fail(context, host, instance_id):
+            raise PlacementError()
+        self.stubs.Set(self.scheduler, '_schedule_now_on_host', fail)
+        self.assertRaises(PlacementError,
+                          self.scheduler._schedule_based_on_resources,
+                          self.context, self._instance(1, 2048))
+        self.assertEqual(2048, self.scheduler.ledger.free('b'))
+
+    def test_reserve_memory_for_resize(self):
+        self.scheduler.reserve_memory(self.context, 'a', 1024)
+        self.assertRaises(OutOfInstanceMemory, self.scheduler.reserve_memory,
+                          self.context, 'a', 1)
+
+    def test_release_memory_after_resize(self):
+        used = self.scheduler.reserve_memory(self.context, 'a', 512)
+        unused = self.scheduler.reserve_memory(self.context, 'b', 512)
+        self.scheduler.release_memory(self.context, used, used=True)
+        self.scheduler.release_memory(self.context, unused)
+        self.assertEqual({}, self.scheduler.ledger.reservations)
+        self.assertEqual(512, self.scheduler.ledger.free('a'))
+        self.assertEqual(2048, self.scheduler.ledger.free('b'))
+
+    def _stub_instances(self, *instances):
+        refs = dict((ref['id'], ref) for ref in instances)
+        self.stubs.Set(simple.db, 'instance_get',
+                       lambda context, instance_id: refs[instance_id])
+        self.stubs.Set(self.scheduler, '_availability_zone_is_set',
+                       lambda context, instance_ref: False)
+
+    def test_batch_spread(self):
+        self._stub_instances(self._instance(1, 1536), self._instance(2, 768))
+        hosts = self.scheduler.schedule_run_instances(self.context, [1, 2],
+                                                      strategy='spread')
+        self.assertEqual({1: 'b', 2: 'a'}, hosts)
+
+    def test_batch_pack(self):
+        self._stub_instances(self._instance(1, 512), self._instance(2, 512))
+        hosts = self.scheduler.schedule_run_instances(self.context, [1, 2],
+                                                      strategy='pack')
+        self.assertEqual({1: 'a', 2: 'a'}, hosts)
+        self.assertEqual(0, self.scheduler.ledger.free('a'))
+
+    def test_batch_places_largest_first(self):
+        self._stub_instances(self._instance(1, 512), self._instance(2, 2048))
+        hosts = self.scheduler.schedule_run_instances(self.context, [1, 2],
+                                                      strategy='spread')
+        self.assertEqual({1: 'a', 2: 'b'}, hosts)
+
+    def test_batch_that_does_not_fit_reserves_nothing(self):
+        self._stub_instances(self._instance(1, 2048), self._instance(2, 2048))
+        self.assertRaises(driver.NoValidHost,
+                          self.scheduler.schedule_run_instances,
+                          self.context, [1, 2])
+        self.assertEqual([], self.placed)
+        self.assertEqual({}, self.scheduler.ledger.reservations)
+        self.assertEqual(2048, self.scheduler.ledger.free('b'))
+
+    def test_batch_failed_placement_releases_the_whole_batch(self):
+        self._stub_instances(self._instance(1, 1024), self._instance(2, 512))
+
+        def fail_second(context, host, instance_id):
+            if self.placed:
+                raise PlacementError()
+            self.placed.append((host, instance_id))
+            return host
+        unplaced = []
+        self.stubs.Set(self.scheduler, '_schedule_now_on_host', fail_second)
+        self.stubs.Set(simple.db, 'instance_update',
+                       lambda context, instance_id, values:
+                           unplaced.append((instance_id, values['host'])))
+        self.assertRaises(PlacementError,
+                          self.scheduler.schedule_run_instances,
+                          self.context, [1, 2], strategy='pack')
+        self.assertEqual({}, self.scheduler.ledger.reservations)
+        self.assertEqual([(1, None)], unplaced)
+        self.assertEqual(1024, self.scheduler.ledger.free('a'))
+        self.assertEqual(2048, self.scheduler.ledger.free('b'))
+
+    def test_batch_unknown_strategy(self):
+        self.assertRaises(exception.InvalidInput,
+                          self.scheduler.schedule_run_instances,
+                          self.context, [1], strategy='random')
@@ -18,14 +18,29 @@
 from datetime import timedelta
 from nova import context
 from nova.db import api as db_api
+from nova.db.sqlalchemy import models
 from nova import test
 from nova import utils
+from reddwarf.db import api as reddwarf_db
+from reddwarf.guest import status as guest_status
+from reddwarf.reaper.collector import GuestStatusCollector
+from reddwarf.reaper.driver import DeleteRateLimiter
 from reddwarf.reaper.driver import ReddwarfReaperDriver
+from reddwarf.tests import util
 
 
 ORPHAN_TIME_OUT = 24 * 60 * 60
 
 
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
 class FakeVolumeApi(object):
 
     def __init__(self):
@@ -77,3 +92,142 @@ class TestWhenAVolumeIsOrphaned(test.TestCase):
     def test_an_new_orphan_is_left_alone(self):
         self.reaper_driver.periodic_tasks(self.context)
         self.assertEqual(len(self.reaper_driver.volume_api.deleted_volumes), 0)
+
+    def make_old(self):
+        updated_at = utils.utcnow() - timedelta(seconds=ORPHAN_TIME_OUT * 2)
+        db_api.volume_update(self.context, self.new_volume['id'],
+                             {'updated_at': updated_at})
+
+    def test_a_dry_run_only_reports(self):
+        self.flags(reddwarf_reaper_dry_run=True)
+        self.make_old()
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual(len(self.reaper_driver.volume_api.deleted_volumes), 0)
+        stats = self.reaper_driver.get_stats()['orphaned_volumes']
+        self.assertEqual(stats['would_reap'], 1)
+        self.assertEqual(len(stats['last_report']), 1)
+
+    def test_deletes_over_the_rate_limit_wait(self):
+        timer = FakeTimer()
+        self.reaper_driver.limiter = DeleteRateLimiter(1, timer=timer)
+        self.reaper_driver.limiter.acquire()
+        self.make_old()
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual(len(self.reaper_driver.volume_api.deleted_volumes), 0)
+        stats = self.reaper_driver.get_stats()['orphaned_volumes']
+        self.assertEqual(stats['deferred'], 1)
+        timer.now += 60
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual(len(self.reaper_driver.volume_api.deleted_volumes), 1)
+
+
+class TestDeleteRateLimiter(test.TestCase):
+
+    def test_allowance_refills_over_a_minute(self):
+        timer = FakeTimer()
+        limiter = DeleteRateLimiter(2, timer=timer)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        timer.now += 30
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+
+    def test_no_limit(self):
+        limiter = DeleteRateLimiter(0)
+        for i in range(100):
+            self.assertTrue(limiter.acquire())
+
+
+class TestWhenAGuestStatusIsDeleted(test.TestCase):
+
+    def setUp(self):
+        super(TestWhenAGuestStatusIsDeleted, self).setUp()
+        util.reset_database()
+        util.db_sync()
+        self.context = context.get_admin_context()
+        self.reaper_driver = ReddwarfReaperDriver(ORPHAN_TIME_OUT)
+        self.reaper_driver.volume_api = FakeVolumeApi()
+        reddwarf_db.guest_status_create(9001)
+        reddwarf_db.guest_status_delete(9001)
+
+    def deleted_statuses(self):
+        return reddwarf_db.guest_status_get_deleted_before(utils.utcnow())
+
+    def test_an_old_deleted_status_is_purged(self):
+        self.flags(reddwarf_reaper_guest_status_expiration_time=0)
+        self.assertEqual(len(self.deleted_statuses()), 1)
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual(len(self.deleted_statuses()), 0)
+        stats = self.reaper_driver.get_stats()['deleted_guest_statuses']
+        self.assertEqual(stats['reaped'], 1)
+
+    def test_a_new_deleted_status_is_kept(self):
+        self.reaper_driver.periodic_tasks(self.context)
+        self.assertEqual(len(self.deleted_statuses()), 1)
+
+
+class TestWhenADnsRecordIsStale(test.TestCase):
+
+    def setUp(self):
+        super(TestWhenADnsRecordIsStale, self).setUp()
+        factory = 'reddwarf.dns.driver.DnsSimpleInstanceEntryFactory'
+        self.flags(dns_instance_entry_factory=factory)
+        self.context = context.get_admin_context()
+        self.reaper_driver = ReddwarfReaperDriver(ORPHAN_TIME_OUT)
+        live = models.Instance(id=5, uuid='live')
+        self.records = [{'name': live.name}, {'name': 'gone'}]
+        self.stubs.Set(reddwarf_db, 'instance_get_all_live',
+                       lambda context: [live])
+        self.stubs.Set(reddwarf_db, 'rsdns_record_get_created_before',
+                       lambda time, marker=None, limit=None: self.records)
+
+    def test_only_records_without_an_instance_are_found(self):
+        stale = self.reaper_driver.find_stale_dns_records(self.context,
+                                                          None, 10)
+        self.assertEqual([{'name': 'gone'}], stale)
+
+
+class TestGuestStatusCollector(test.TestCase):
+
+    def setUp(self):
+        super(TestGuestStatusCollector, self).setUp()
+        util.reset_database()
+        util.db_sync()
+        self.collector = GuestStatusCollector()
+        self.instance_ids = [9001, 9002, 9003]
+        for instance_id in self.instance_ids:
+            reddwarf_db.guest_status_create(instance_id)
+
+    def assert_state(self, instance_id, status):
+        self.assertEqual(reddwarf_db.guest_status_get(instance_id).state,
+                         status.code)
+
+    def test_reports_are_written_on_flush(self):
+        for instance_id in self.instance_ids:
+            self.collector.report(instance_id, guest_status.RUNNING.code)
+        self.assert_state(9001, guest_status.BUILDING)
+        self.assertEqual(self.collector.flush(), 3)
+        for instance_id in self.instance_ids:
+            self.assert_state(instance_id, guest_status.RUNNING)
+
+    def test_only_the_latest_report_is_kept(self):
+        self.collector.report(9001, guest_status.RUNNING.code)
+        self.collector.report(9001, guest_status.SHUTDOWN.code)
+        self.assertEqual(self.collector.flush(), 1)
+        self.assert_state(9001, guest_status.SHUTDOWN)
+        stats = self.collector.get_stats()
+        self.assertEqual(stats['reports_merged'], 1)
+        self.assertEqual(stats['writes_avoided'], 1)
+
+    def test_unchanged_heartbeats_do_not_write(self):
+        self.collector.report(9001, guest_status.RUNNING.code)
+        self.collector.flush()
+        self.collector.report(9001, guest_status.RUNNING.code,
+                              heartbeat=True)
+        self.assertEqual(self.collector.flush(), 0)
+        stats = self.collector.get_stats()
+        self.assertEqual(stats['writes_performed'], 1)
+        self.assertEqual(stats['writes_avoided'], 1)
+        self.assertEqual(stats['heartbeats_received'], 1)
+        self.assertEqual(stats['pending'], 0)
@@ -12,10 +12,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
+import eventlet
+
 from nova import test
 
 from reddwarf import exception
+from reddwarf.utils import LRUCache
 from reddwarf.utils import poll_until
+from reddwarf.utils import wait_until
+from reddwarf.utils import WaitRegistry
 
 
 class PollUntilTestCase(test.TestCase):
@@ -44,3 +51,105 @@ class PollUntilTestCase(test.TestCase):
                             sleep_time=0)
         self.assertEqual(60, result)
 
+
+class WaitUntilTestCase(test.TestCase):
+
+    def test_when_timeout_occurs(self):
+        self.assertRaises(exception.PollTimeOut, wait_until, lambda: 5,
+                          lambda n: n != 5, sleep_time=0.1, time_out=0.3)
+
+    def test_backs_off_between_retrievals(self):
+        calls = []
+        self.assertRaises(exception.PollTimeOut, wait_until,
+                          lambda: calls.append(1), sleep_time=0.05,
+                          max_sleep_time=1, time_out=0.5)
+        # Retrieved after 0, 0.05, 0.15 and 0.35 seconds, then around the
+        # deadline instead of every 0.05 seconds.
+        self.assertTrue(4 <= len(calls) <= 6)
+
+    def test_notification_ends_the_sleep(self):
+        waiters = WaitRegistry()
+        values = [False, True]
+        eventlet.spawn_after(0.1, waiters.notify, 'key')
+        start = time.time()
+        result = wait_until(lambda: values.pop(0), waiters=waiters,
+                            key='key', sleep_time=10, time_out=20)
+        self.assertTrue(result)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_notification_during_retrieval_is_kept(self):
+        waiters = WaitRegistry()
+        values = [True, False]
+
+        def retriever():
+            # The change lands between the read and the sleep.
+            waiters.notify('key')
+            return values.pop()
+
+        start = time.time()
+        result = wait_until(retriever, waiters=waiters, key='key',
+                            sleep_time=10, time_out=20)
+        self.assertTrue(result)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual({}, waiters.waiters)
+
+
+class WaitRegistryTestCase(test.TestCase):
+
+    def test_wait_times_out(self):
+        waiters = WaitRegistry()
+        self.assertFalse(waiters.wait('key', 0.01))
+        self.assertEqual({}, waiters.waiters)
+
+    def test_notify_without_waiters(self):
+        self.assertEqual(0, WaitRegistry().notify('key'))
+
+
+class LRUCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(LRUCacheTestCase, self).setUp()
+        self.now = 1000
+        self.cache = LRUCache(2, ttl=10, timer=lambda: self.now)
+
+    def test_get_missing(self):
+        self.assertEqual(None, self.cache.get('a'))
+        self.assertEqual(1, self.cache.get_stats()['misses'])
+
+    def test_get_hit(self):
+        self.cache.set('a', 1)
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual(1, self.cache.get_stats()['hits'])
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertTrue('a' in self.cache)
+        self.assertFalse('b' in self.cache)
+        self.assertTrue('c' in self.cache)
+        self.assertEqual(1, self.cache.get_stats()['evictions'])
+
+    def test_expires_after_ttl(self):
+        self.cache.set('a', 1)
+        self.now += 10
+        self.assertEqual(None, self.cache.get('a'))
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(1, self.cache.get_stats()['expired'])
+
+    def test_entry_ttl_overrides_the_default(self):
+        self.cache.set('a', 1, ttl=20)
+        self.now += 10
+        self.assertEqual(1, self.cache.get('a'))
+        self.now += 10
+        self.assertEqual(None, self.cache.get('a'))
+
+    def test_delete(self):
+        self.cache.set('a', 1)
+        self.cache.delete('a')
+        self.cache.delete('missing')
+        self.assertEqual(None, self.cache.get('a'))
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        self.assertEqual(2, len(self.cache))
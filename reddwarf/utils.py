@@ -12,8 +12,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
 import time
 
+import eventlet
+from eventlet import event
+
 from nova.utils import LoopingCall
 from nova.utils import LoopingCallDone
 
@@ -37,4 +41,181 @@ def poll_until(retriever, condition=lambda value: value,
         if time_out is not None and time.time() > start_time + time_out:
             raise exception.PollTimeOut
     lc = LoopingCall(f=poll_and_check).start(sleep_time, True)
-    return lc.wait()
\ No newline at end of file
+    return lc.wait()
+
+
+def wait_until(retriever, condition=lambda value: value, waiters=None,
+               key=None, sleep_time=1, max_sleep_time=30, time_out=None):
+    """Retrieves object until it passes condition, then returns it.
+
+    Between two retrievals the caller sleeps until key is notified through
+    waiters, or until the sleep time elapses. The sleep time doubles after
+    each retrieval up to max_sleep_time, so the polling is only a fallback
+    for missed notifications. PollTimeOut is raised once time_out seconds
+    have passed.
+
+    """
+    start_time = time.time()
+    while True:
+        # NOTE: the waiter is registered before the retrieval, so a change
+        # notified while the object is being retrieved still wakes it up.
+        waiter = None
+        if waiters is not None:
+            waiter = waiters.register(key)
+        try:
+            obj = retriever()
+            if condition(obj):
+                return obj
+            sleep = sleep_time
+            if time_out is not None:
+                remaining = start_time + time_out - time.time()
+                if remaining <= 0:
+                    raise exception.PollTimeOut
+                sleep = min(sleep, remaining)
+            if waiter is not None:
+                waiters.wait_for(waiter, sleep)
+            else:
+                eventlet.sleep(sleep)
+        finally:
+            if waiter is not None:
+                waiters.unregister(key, waiter)
+        sleep_time = min(sleep_time * 2, max_sleep_time)
+
+
+class WaitRegistry(object):
+    """Lets green threads sleep until another one notifies them of a key."""
+
+    def __init__(self):
+        self.waiters = {}
+
+    def register(self, key):
+        """Returns a waiter that the next notification of key will wake."""
+        waiter = event.Event()
+        self.waiters.setdefault(key, []).append(waiter)
+        return waiter
+
+    def unregister(self, key, waiter):
+        """Forgets a waiter returned by register."""
+        waiters = self.waiters.get(key, [])
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters:
+            self.waiters.pop(key, None)
+
+    @staticmethod
+    def wait_for(waiter, timeout):
+        """Wait until waiter is woken, returning False on timeout."""
+        if waiter.ready():
+            return True
+        with eventlet.Timeout(timeout, False):
+            waiter.wait()
+            return True
+        return False
+
+    def wait(self, key, timeout):
+        """Wait for a notification of key, returning False on timeout."""
+        waiter = self.register(key)
+        try:
+            return self.wait_for(waiter, timeout)
+        finally:
+            self.unregister(key, waiter)
+
+    def notify(self, key):
+        """Wake up everything waiting on key, returning how many there were."""
+        waiters = self.waiters.pop(key, [])
+        for waiter in waiters:
+            waiter.send()
+        return len(waiters)
+
+
+class LRUCache(object):
+    """A bounded mapping that drops the least recently used entries.
+
+    Entries older than ttl seconds, or than the ttl they were set with, are
+    treated as missing. Lookups, hits, misses and evictions are counted in
+    stats.
+
+    """
+
+    def __init__(self, max_size, ttl=None, timer=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.lock = threading.Lock()
+        # Maps each key to a [previous, next, key, value, expires] link of a
+        # circular list which is kept in order of use, oldest first.
+        self.links = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, None]
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def _unlink(self, link):
+        previous, next = link[0], link[1]
+        previous[1] = next
+        next[0] = previous
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0], link[1] = last, self.root
+        last[1] = self.root[0] = link
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if absent or stale."""
+        with self.lock:
+            link = self.links.get(key)
+            if link is None:
+                self.stats['misses'] += 1
+                return default
+            if link[4] is not None and link[4] <= self.timer():
+                self._unlink(link)
+                del self.links[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.stats['hits'] += 1
+            return link[3]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = None
+        if ttl is not None:
+            expires = self.timer() + ttl
+        with self.lock:
+            link = self.links.get(key)
+            if link is not None:
+                self._unlink(link)
+            link = [None, None, key, value, expires]
+            self._append(link)
+            self.links[key] = link
+            while len(self.links) > self.max_size:
+                oldest = self.root[1]
+                self._unlink(oldest)
+                del self.links[oldest[2]]
+                self.stats['evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            link = self.links.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+
+    def clear(self):
+        with self.lock:
+            self.links.clear()
+            self.root[:] = [self.root, self.root, None, None, None]
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.links)
+        stats['max_size'] = self.max_size
+        return stats
@@ -35,12 +35,13 @@ intact.
 
 from nova import flags
 from nova import log as logging
+from nova import rpc
 from nova import utils
 from nova.notifier import api as notifier
 from nova.volume import manager
 
 from reddwarf import exception
-from reddwarf.utils import poll_until
+from reddwarf.utils import wait_until
 
 LOG = logging.getLogger('reddwarf.volume.manager')
 FLAGS = flags.FLAGS
@@ -56,6 +57,19 @@ class ReddwarfVolumeManager(manager.VolumeManager):
         """Load the driver from the one specified in args, or from flags."""
         super(ReddwarfVolumeManager, self).__init__(*args, **kwargs)
 
+    def _notify_compute_of_status(self, context, volume_id, status=None):
+        """Tells the compute nodes the volume's status has changed."""
+        try:
+            if status is None:
+                status = self.db.volume_get(context, volume_id)['status']
+            rpc.fanout_cast(context, FLAGS.compute_topic,
+                            {'method': 'volume_status_changed',
+                             'args': {'volume_id': volume_id,
+                                      'status': status}})
+        except Exception as e:
+            LOG.error("Could not notify compute of volume %s status: %s"
+                      % (volume_id, e))
+
     def _verify_available_space(self, context, volume_id, size):
         vol_avail = self.driver.check_for_available_space(size)
         if not vol_avail:
@@ -73,16 +87,20 @@ class ReddwarfVolumeManager(manager.VolumeManager):
         #TODO (rnirmal): Need to somehow remove the extra db call
         context = context.elevated()
         volume_ref = self.db.volume_get(context, volume_id)
-        self._verify_available_space(context, volume_id, volume_ref['size'])
-        return super(ReddwarfVolumeManager, self).create_volume(context,
+        try:
+            self._verify_available_space(context, volume_id,
+                                         volume_ref['size'])
+            return super(ReddwarfVolumeManager, self).create_volume(context,
                                                                 volume_id,
                                                                 snapshot_id)
+        finally:
+            self._notify_compute_of_status(context, volume_id)
 
     def delete_volume_when_available(self, context, volume_id, time_out):
         """Waits until the volume is available or error and then deletes it."""
-        poll_until(lambda: self.db.volume_get(context, volume_id),
-                         lambda volume: volume['status'] in ['available', 'error'],
-                         sleep_time=1, time_out=time_out)
+        wait_until(lambda: self.db.volume_get(context, volume_id),
+                   lambda volume: volume['status'] in ['available', 'error'],
+                   sleep_time=1, max_sleep_time=8, time_out=time_out)
         self.delete_volume(context, volume_id)
 
     def check_for_available_space(self, context, size):
@@ -113,6 +131,7 @@ class ReddwarfVolumeManager(manager.VolumeManager):
             self.driver.resize(volume_ref, size)
             self.db.volume_update(context, volume_id,
                                   {'size': int(size), 'status': 'resized'})
+            self._notify_compute_of_status(context, volume_id, 'resized')
             notifier.notify(publisher_id(self.host),
                             'volume.resize', notifier.INFO,
                             "Completed the volume resize")
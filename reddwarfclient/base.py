@@ -1,3 +1,6 @@
+import urllib
+
+
 
 def isid(obj):
     """
@@ -13,3 +16,33 @@ def isid(obj):
         else:
             return True
 
+
+def list_pages(client, url, response_key, limit=None, marker=None,
+               params=None):
+    """
+    Returns the items of a paginated listing.
+
+    If no limit is given every page is fetched, following the next links
+    returned by the server. Otherwise only the page of at most limit items
+    following the marker is returned.
+    """
+    params = dict(params or {})
+    items = []
+    while True:
+        if limit is not None:
+            params['limit'] = limit
+        if marker is not None:
+            params['marker'] = marker
+        query = ''
+        if params:
+            query = "?%s" % urllib.urlencode(sorted(params.items()))
+        resp, body = client.get(url + query)
+        if not body:
+            raise Exception("Call to " + url + " did not return a body.")
+        page = body[response_key]
+        items.extend(page)
+        next_links = [link for link in body.get('links', [])
+                      if link['rel'] == 'next']
+        if limit is not None or not next_links or not page:
+            return items
+        marker = page[-1]['id']
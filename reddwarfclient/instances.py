@@ -17,6 +17,7 @@ from novaclient import base
 
 import exceptions
 
+from reddwarfclient.base import list_pages
 from reddwarfclient.common import check_for_exceptions
 
 
@@ -68,35 +69,37 @@ class Instances(base.ManagerWithFind):
 
         return self._create("/instances", body, "instance")
 
-    def _list(self, url, response_key):
-        resp, body = self.api.client.get(url)
-        if not body:
-            raise Exception("Call to " + url + " did not return a body.")
-        return [self.resource_class(self, res) for res in body[response_key]]
+    def _list(self, url, response_key, limit=None, marker=None):
+        items = list_pages(self.api.client, url, response_key,
+                           limit=limit, marker=marker)
+        return [self.resource_class(self, res) for res in items]
 
-    def list(self):
+    def list(self, limit=None, marker=None):
         """
         Get a list of all instances.
 
+        Every page is fetched unless a limit is given, in which case only the
+        page of at most limit instances following the marker is returned.
+
         :rtype: list of :class:`Instance`.
         """
-        return self._list("/instances/detail", "instances")
+        return self._list("/instances/detail", "instances", limit, marker)
 
-    def index(self):
+    def index(self, limit=None, marker=None):
         """
         Get a list of all instances.
 
         :rtype: list of :class:`Instance`.
         """
-        return self._list("/instances", "instances")
+        return self._list("/instances", "instances", limit, marker)
 
-    def details(self):
+    def details(self, limit=None, marker=None):
         """
         Get details of all instances.
 
         :rtype: list of :class:`Instance`.
         """
-        return self._list("/instances/detail", "instances")
+        return self._list("/instances/detail", "instances", limit, marker)
 
     def get(self, instance):
         """
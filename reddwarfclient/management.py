@@ -15,6 +15,7 @@
 
 from novaclient import base
 
+from reddwarfclient.base import list_pages
 from reddwarfclient.common import check_for_exceptions
 from reddwarfclient.instances import Instance
 
@@ -45,25 +46,27 @@ class Management(base.ManagerWithFind):
         return self._list("/mgmt/instances/%s" % base.getid(instance),
             'instance')
 
-    def index(self, deleted=None):
+    def index(self, deleted=None, limit=None, marker=None):
         """
         Show an overview of all local instances.
         Optionally, filter by deleted status.
 
+        Every page is fetched unless a limit is given, in which case only the
+        page of at most limit instances following the marker is returned.
+
         :rtype: list of :class:`Instance`.
         """
-        form = ''
+        params = {}
         if deleted is not None:
             if deleted:
-                form = "?deleted=true"
+                params['deleted'] = "true"
             else:
-                form = "?deleted=false"
+                params['deleted'] = "false"
 
-        url = "/mgmt/instances%s" % form
-        resp, body = self.api.client.get(url)
-        if not body:
-            raise Exception("Call to " + url + " did not return a body.")
-        return [self.resource_class(self, instance) for instance in body['instances']]
+        instances = list_pages(self.api.client, "/mgmt/instances",
+                               'instances', limit=limit, marker=marker,
+                               params=params)
+        return [self.resource_class(self, instance) for instance in instances]
 
     def root_enabled_history(self, instance):
         """
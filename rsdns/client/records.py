@@ -61,8 +61,22 @@ class RecordsManager(base.ManagerWithFind):
         :param record: The ID of the :class:`Record` to get.
         :rtype: :class:`Record`
         """
-        data = {"records":[{"type": record_type, "name": record_name,
-                            "data": record_data, "ttl": record_ttl }]}
+        return self.create_many(domain, [{"type": record_type,
+                                          "name": record_name,
+                                          "data": record_data,
+                                          "ttl": record_ttl}])
+
+    def create_many(self, domain, records):
+        """
+        Create several new Records on the given domain with one request.
+
+        :param domain: The ID of the :class:`Domain` to get.
+        :param records: A list of dicts with the type, name, data and ttl of
+                        each record.
+        :rtype: :class:`FutureRecord` whose resource is the list of
+                :class:`Record`.
+        """
+        data = {"records": records}
         resp, body = self.api.client.post("/domains/%s/records" % \
                                           base.getid(domain), body=data)
         if resp.status == 202:
@@ -0,0 +1,55 @@
+import collections
+import unittest
+import mox
+
+from rsdns.client import DNSaasClient
+from rsdns.client import RecordsManager
+from rsdns.client.records import FutureRecord
+
+
+FakeDNSaaS = collections.namedtuple("FakeDNSaaS",
+                                    ['client', 'domains', 'records'])
+
+FakeResponse = collections.namedtuple("FakeResponse", ['status'])
+
+
+FAKE_DOMAIN_ID = 75762
+
+
+class DNSClientRecordCreate(unittest.TestCase):
+
+    def setUp(self):
+        self.mox = mox.Mox()
+
+    def tearDown(self):
+        self.mox.VerifyAll()
+
+    def test_create_many_posts_one_request(self):
+        """Makes sure every record goes out in a single job."""
+        client = self.mox.CreateMock(DNSaasClient)
+        client.management_url = "https://fake.com"
+        dns = FakeDNSaaS(client, None, None)
+        records = [{"type": "A", "name": "a.fake.com", "data": "10.0.0.1",
+                    "ttl": 300},
+                   {"type": "A", "name": "b.fake.com", "data": "10.0.0.2",
+                    "ttl": 300}]
+        dns.client.post("/domains/%s/records" % FAKE_DOMAIN_ID,
+                        body={"records": records})\
+            .AndReturn((FakeResponse(202),
+                        {"jobId": "abc", "status": "RUNNING",
+                         "callbackUrl": "https://fake.com/status/abc"}))
+        self.mox.ReplayAll()
+        future = RecordsManager(dns).create_many(FAKE_DOMAIN_ID, records)
+        self.assertTrue(isinstance(future, FutureRecord))
+        self.assertEqual("abc", future.jobId)
+        self.assertEqual("/status/abc", future.callbackUrl)
+
+    def test_create_many_when_not_accepted(self):
+        client = self.mox.CreateMock(DNSaasClient)
+        dns = FakeDNSaaS(client, None, None)
+        dns.client.post("/domains/%s/records" % FAKE_DOMAIN_ID,
+                        body={"records": []})\
+            .AndReturn((FakeResponse(400), None))
+        self.mox.ReplayAll()
+        self.assertRaises(RuntimeError, RecordsManager(dns).create_many,
+                          FAKE_DOMAIN_ID, [])
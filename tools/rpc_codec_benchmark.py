@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#    Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measures the encode and decode cost and wire size of RPC messages.
+
+Each sample message is sent plain, with the context in _context_* keys, and
+in the envelope with each installed codec.  The times include the JSON
+serialization the broker library does on top, and the size is that of its
+output.
+
+    tools/rpc_codec_benchmark.py [--rpc_compress_threshold=N] [repeat]
+
+"""
+
+import gettext
+import json
+import os
+import sys
+import timeit
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import context
+from nova import flags
+from nova import utils
+from nova.rpc import codec
+
+
+FLAGS = flags.FLAGS
+
+
+def sample_messages():
+    users = [{'_name': 'user%d' % i, '_password': None,
+              '_databases': [{'_name': 'db%d' % i, '_character_set': 'utf8',
+                              '_collate': 'utf8_general_ci'}]}
+             for i in range(500)]
+    databases = [{'_name': 'db%d' % i, '_character_set': 'utf8',
+                  '_collate': 'utf8_general_ci'} for i in range(500)]
+    nw_info = [({'bridge': 'br100', 'id': 1, 'injected': False,
+                 'cidr': '10.0.0.0/24', 'cidr_v6': None},
+                {'label': 'public', 'gateway': '10.0.0.1',
+                 'broadcast': '10.0.0.255', 'mac': '02:16:3e:%02x:00:01' % i,
+                 'dns': ['8.8.8.8', '8.8.4.4'], 'rxtx_cap': 0,
+                 'ips': [{'ip': '10.0.0.%d' % i, 'netmask': '255.255.255.0',
+                          'enabled': '1'}]})
+               for i in range(4)]
+    return [('small call', {'method': 'is_root_enabled', 'args': {}}),
+            ('list_users reply', {'result': users, 'failure': None}),
+            ('list_databases reply', {'result': databases, 'failure': None}),
+            ('get_instance_nw_info reply', {'result': nw_info,
+                                            'failure': None})]
+
+
+def plain(msg, ctxt):
+    """Pack and unpack the context the way impl_kombu does without it."""
+    def encode():
+        packed = dict(msg)
+        packed.update(('_context_%s' % key, value)
+                      for key, value in ctxt.to_dict().iteritems())
+        return utils.dumps(packed)
+
+    def decode(data):
+        message = json.loads(data)
+        context_dict = {}
+        for key in list(message.keys()):
+            key = str(key)
+            if key.startswith('_context_'):
+                context_dict[key[9:]] = message.pop(key)
+        return message, context_dict
+    return encode, decode
+
+
+def enveloped(msg, ctxt, codec_name):
+    def encode():
+        return utils.dumps(codec.wrap(msg, context=ctxt.to_dict(),
+                                      codec=codec_name))
+
+    def decode(data):
+        return codec.unwrap(json.loads(data))
+    return encode, decode
+
+
+def measure(encode, decode, repeat):
+    data = encode()
+    encode_time = min(timeit.repeat(encode, number=repeat, repeat=3))
+    decode_time = min(timeit.repeat(lambda: decode(data), number=repeat,
+                                    repeat=3))
+    return (encode_time * 1000000 / repeat, decode_time * 1000000 / repeat,
+            len(data))
+
+
+def main(argv):
+    argv = FLAGS(argv)
+    repeat = int(argv[1]) if len(argv) > 1 else 200
+    ctxt = context.RequestContext('some-user', 'some-project',
+                                  roles=['admin'], auth_token='x' * 32)
+    print "%-28s %-14s %12s %12s %10s" % ('message', 'format',
+                                          'encode us', 'decode us', 'bytes')
+    for name, msg in sample_messages():
+        formats = [('plain', plain(msg, ctxt))]
+        for codec_name in sorted(codec.CODECS):
+            formats.append(('envelope/%s' % codec_name,
+                            enveloped(msg, ctxt, codec_name)))
+        for format_name, (encode, decode) in formats:
+            encode_us, decode_us, size = measure(encode, decode, repeat)
+            print "%-28s %-14s %12.1f %12.1f %10d" % (name, format_name,
+                                                      encode_us, decode_us,
+                                                      size)
+    if codec.msgpack is None:
+        print "msgpack is not installed; its codec was skipped."
+
+
+if __name__ == '__main__':
+    main(sys.argv)